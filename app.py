@@ -2,19 +2,49 @@ import time
 
 import tyro
 
+from src.job_queue import JobQueue, JobWorker, enqueue_directories
 from src.sub_genie import SubGenie, SubGenieConfig
+from src.tracing import TRACER
+from src.utils import CONSOLE, configure_logging
+from src.youtube_downloader import YoutubeDownloader
 
 if __name__ == '__main__':
     start_t = time.time()
     config = tyro.cli(SubGenieConfig)
+    configure_logging(config.log_level, config.headless)
+    if config.trace_path:
+        TRACER.enable()
+    if config.task == 'enqueue':
+        # 只扫描目录提交任务，不需要加载模型
+        jobs = enqueue_directories(JobQueue(config.job_db), config, translate=not config.skip_translate)
+        CONSOLE.print(f"[green]已提交{len(jobs)}个任务: {config.job_db}")
+        exit()
+    if config.task == 'cover':
+        # 只处理封面图片，不需要加载模型
+        YoutubeDownloader(config.youtube_downloader).process_covers()
+        CONSOLE.print(f"总耗时: {time.time() - start_t:.2f}s")
+        exit()
     generator = SubGenie(config)
-    if config.task == 'download':
+    if config.task == 'worker':
+        worker = JobWorker(JobQueue(config.job_db), generator,
+                           worker_id=config.worker_id, lease_seconds=config.lease_seconds)
+        try:
+            worker.run(idle_exit=config.worker_idle_exit)
+        except KeyboardInterrupt:
+            # 正在执行的任务不再续约，租约到期后由其他工作进程重新领取
+            pass
+    elif config.task == 'download':
         generator.download_video()
     elif config.task == 'generate':
         generator.batch_generate()
     elif config.task == 'continue':
         generator.continue_generate()
+    elif config.task == 'stream':
+        generator.stream_generate()
     else:
-        print(f"不支持的任务类型:{config.task}")
+        CONSOLE.print(f"[red]不支持的任务类型:{config.task}")
         exit()
-    print(f"总耗时: {time.time() - start_t}")
+    if config.trace_path:
+        TRACER.show()
+        TRACER.save(config.trace_path)
+    CONSOLE.print(f"总耗时: {time.time() - start_t:.2f}s")
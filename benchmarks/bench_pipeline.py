@@ -0,0 +1,305 @@
+"""
+端到端流水线性能测试。
+用合成音频和假模型(benchmarks/fakes.py)驱动SubGenie.batch_generate、continue_generate、
+_write_subtitle和websocket的asr/qwen_translate任务，统计各阶段吞吐量和峰值内存，并与保存的基线比较。
+本地存在WhisperAsrConfig中的模型目录时(或--mode real)，语音识别和标点使用真实模型，翻译始终为假。
+
+在仓库根目录运行:
+python -m benchmarks.bench_pipeline --save-baseline   # 记录当前机器上的基线
+python -m benchmarks.bench_pipeline                   # 与基线比较，变慢超过tolerance、基线不存在或参数不同时以非0状态退出
+仓库中的基线benchmarks/baselines/bench_pipeline.json为--mode fake的默认参数生成。
+"""
+import asyncio
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import tyro
+import websockets
+from rich.table import Table
+
+import websocket_server
+from benchmarks.bench_subtitle import make_merged_lines
+from benchmarks.fakes import (FakeApiTranslator, FakePunctuationModel, FakeWhisperModel, fake_qwen_translate,
+                              write_synthetic_wav)
+from src.metrics import process_rss_bytes
+from src.sub_genie import SubGenie, SubGenieConfig
+from src.tracing import TRACER
+from src.translator import TranslatorConfig
+from src.utils import CONSOLE
+from src.whisper_asr import WhisperAsr, WhisperAsrConfig
+
+
+@dataclass
+class BenchPipelineConfig:
+    """端到端流水线性能测试"""
+
+    # 模型 auto | fake | real。auto: 模型目录存在时用真实模型
+    mode: str = 'auto'
+    # 合成音频文件数
+    num_files: int = 4
+    # 每个音频的秒数
+    audio_seconds: float = 600
+    # 假ASR每秒音频的额外耗时(秒)
+    asr_rtf: float = 0.0
+    # 假标点模型每次调用的耗时(秒)
+    punctuation_latency: float = 0.0
+    # 假翻译每次调用的耗时(秒)
+    translate_latency: float = 0.0
+    # _write_subtitle测试的字幕行数
+    subtitle_lines: int = 50000
+    # 用tracemalloc统计Python堆内存峰值，会拖慢Python代码较多的阶段
+    trace_memory: bool = True
+    # websocket并发客户端数
+    ws_clients: int = 8
+    # 每个客户端的请求数
+    ws_requests: int = 8
+    # 随机种子
+    seed: int = 0
+    # 基线文件
+    baseline_path: str = 'benchmarks/baselines/bench_pipeline.json'
+    # 保存本次结果为基线
+    save_baseline: bool = False
+    # 允许比基线慢的比例
+    tolerance: float = 0.2
+    # 比基线慢的绝对值小于该秒数时忽略，避免很短的用例误报
+    min_regression_seconds: float = 0.05
+
+
+@dataclass
+class CaseResult:
+    name: str
+    seconds: float
+    # 吞吐量及其单位
+    throughput: float = 0.0
+    unit: str = ''
+    # Python堆内存峰值(MB)，不包含模型等原生内存
+    peak_mb: float = 0.0
+
+
+def use_real_models(config: BenchPipelineConfig) -> bool:
+    if config.mode == 'fake':
+        return False
+    asr_config = WhisperAsrConfig()
+    exists = Path(asr_config.whisper_model).exists() and Path(asr_config.punctuation_model).exists()
+    if config.mode == 'real' and not exists:
+        raise FileNotFoundError(f"Model directories not found: {asr_config.whisper_model}, {asr_config.punctuation_model}")
+    return exists
+
+
+def make_asr(config: BenchPipelineConfig, real: bool) -> WhisperAsr:
+    if real:
+        return WhisperAsr(WhisperAsrConfig())
+    return WhisperAsr(WhisperAsrConfig(),
+                      model=FakeWhisperModel(config.asr_rtf, config.seed),
+                      punctuation_model=FakePunctuationModel(config.punctuation_latency))
+
+
+def measure(name: str, fn, *args) -> tuple[CaseResult, object]:
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    ret = fn(*args)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+    return CaseResult(name, seconds, peak_mb=peak / 2**20), ret
+
+
+def bench_generate(config: BenchPipelineConfig, asr: WhisperAsr, work_dir: Path) -> list[CaseResult]:
+    video_dir, audio_dir = work_dir / "video", work_dir / "audio"
+    video_dir.mkdir(parents=True)
+    audio_dir.mkdir(parents=True)
+    for i in range(config.num_files):
+        write_synthetic_wav(audio_dir / f"episode{i}.wav", config.audio_seconds, config.seed + i)
+        # batch_generate只处理有对应视频的音频
+        (video_dir / f"episode{i}.mp4").touch()
+
+    sub_genie_config = SubGenieConfig(
+        video_dir=str(video_dir), audio_dir=str(audio_dir), asr_dir=str(work_dir / "asr"),
+        input_is_audio=True, translator=TranslatorConfig(translate_api='google'))
+    sub_genie = SubGenie(sub_genie_config, whisper_asr=asr)
+    sub_genie.translator = FakeApiTranslator(sub_genie_config.translator, config.translate_latency)
+
+    TRACER.enable()
+    result, _ = measure("batch_generate", sub_genie.batch_generate)
+    summary = TRACER.summary()
+    TRACER.enabled = False
+
+    total_audio = config.num_files * config.audio_seconds
+    # 翻译时会在同目录写入译文缓存xx_zh.list，只统计ASR输出
+    asr_outputs = [path for path in (work_dir / "asr").glob("*.list") if not path.stem.endswith("_zh")]
+    num_lines = sum(len(path.read_text(encoding="utf-8").splitlines()) for path in asr_outputs)
+    result.throughput, result.unit = total_audio / result.seconds, "audio s/s"
+    results = [result]
+    # 各阶段的耗时来自tracing
+    for stage, amount, unit in (("decode_audio", total_audio, "audio s/s"),
+                                ("whisper_decode", total_audio, "audio s/s"),
+                                ("split_sentences", total_audio, "audio s/s"),
+                                ("punctuation", None, "calls/s"),
+                                ("translate_call", None, "calls/s"),
+                                ("write_subtitle", num_lines, "lines/s")):
+        count, seconds = summary.get(stage, (0, 0.0))
+        amount = count if amount is None else amount
+        results.append(CaseResult(f"  {stage}", seconds, amount / seconds if seconds else 0.0, unit))
+
+    # continue_generate: 模拟手动翻译好的_zh.list，重新合并生成字幕
+    for path in asr_outputs:
+        lines = path.read_text(encoding="utf-8").splitlines()
+        path.with_stem(path.stem + "_zh").write_text(
+            "".join(line.split("]")[0] + "]译文\n" for line in lines), encoding="utf-8")
+    for path in video_dir.glob("*.ass"):
+        path.unlink()
+    result, _ = measure("continue_generate", sub_genie.continue_generate)
+    result.throughput, result.unit = num_lines / result.seconds, "lines/s"
+    results.append(result)
+    return results
+
+
+def bench_write_subtitle(config: BenchPipelineConfig, asr: WhisperAsr, work_dir: Path) -> list[CaseResult]:
+    lines = make_merged_lines(config.subtitle_lines, config.seed)
+    sub_genie = SubGenie(SubGenieConfig(video_dir=str(work_dir), audio_dir=str(work_dir), asr_dir=str(work_dir)),
+                         whisper_asr=asr)
+    results = []
+    for suffix in (".ass", ".srt"):
+        result, _ = measure(f"_write_subtitle {suffix}", sub_genie._write_subtitle, lines, work_dir / f"bench{suffix}")
+        result.throughput, result.unit = config.subtitle_lines / result.seconds, "lines/s"
+        results.append(result)
+    return results
+
+
+async def _ws_client(url: str, requests: list[dict]) -> list[float]:
+    latencies = []
+    async with websockets.connect(url, max_size=None) as ws:
+        for request in requests:
+            start = time.perf_counter()
+            await ws.send(json.dumps(request))
+            while True:
+                msg = json.loads(await ws.recv())
+                if msg["task_id"] == request["task_id"] and (msg.get("task_progress") == 100 or msg["type"] == "error"):
+                    break
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def _bench_ws(config: BenchPipelineConfig, audio_path: Path, task_type: str) -> list[float]:
+    async with websockets.serve(websocket_server.server, "localhost", 0, max_size=None) as server:
+        url = "ws://localhost:%d" % server.sockets[0].getsockname()[1]
+        clients = []
+        for c in range(config.ws_clients):
+            requests = []
+            for r in range(config.ws_requests):
+                # 每个请求内容不同，避免被合并
+                if task_type == "asr":
+                    start = (c * config.ws_requests + r) * 10 % max(config.audio_seconds - 30, 1)
+                    payload = {"audio_path": str(audio_path), "time_range": f"{start}, {start + 30}"}
+                else:
+                    payload = "\n".join("[%d.00->%d.50]line %d of client %d request %d" % (i, i, i, c, r)
+                                        for i in range(40))
+                requests.append({"type": task_type, "task_id": f"{c}-{r}", "payload": payload})
+            clients.append(_ws_client(url, requests))
+        return [latency for latencies in await asyncio.gather(*clients) for latency in latencies]
+
+
+def bench_websocket(config: BenchPipelineConfig, asr: WhisperAsr, work_dir: Path) -> list[CaseResult]:
+    audio_path = work_dir / "ws.wav"
+    write_synthetic_wav(audio_path, config.audio_seconds, config.seed)
+    websocket_server.whisper_asr_instance = asr
+    websocket_server.qwen_translate = fake_qwen_translate(config.translate_latency)
+
+    results = []
+    for task_type in ("asr", "qwen_translate"):
+        result, latencies = measure(f"websocket {task_type}", asyncio.run, _bench_ws(config, audio_path, task_type))
+        result.throughput, result.unit = len(latencies) / result.seconds, "req/s"
+        results.append(result)
+        p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]
+        results.append(CaseResult(f"  {task_type} p50 latency", statistics.median(latencies)))
+        results.append(CaseResult(f"  {task_type} p95 latency", p95))
+    return results
+
+
+def baseline_key(config: BenchPipelineConfig, real: bool) -> dict:
+    """只有这些参数相同的结果才能比较。"""
+    keys = ("num_files", "audio_seconds", "asr_rtf", "punctuation_latency", "translate_latency",
+            "subtitle_lines", "trace_memory", "ws_clients", "ws_requests", "seed")
+    return {"real_models": real, **{k: v for k, v in asdict(config).items() if k in keys}}
+
+
+def compare_baseline(config: BenchPipelineConfig, key: dict, results: list[CaseResult]) -> list[str]:
+    """
+    返回变慢的用例。基线不存在或参数不同时无法比较，也作为失败返回，
+    避免CI在没有基线时一直通过；有意更换基线时用--save-baseline重新生成。
+    """
+    path = Path(config.baseline_path)
+    if not path.exists():
+        return [f"No baseline at {path}, run with --save-baseline to create one"]
+    baseline = json.loads(path.read_text(encoding="utf-8"))
+    if baseline["config"] != key:
+        return [f"Baseline config differs, run with --save-baseline to update it: "
+                f"{baseline['config']} vs {key}"]
+    regressions = []
+    for result in results:
+        base = baseline["results"].get(result.name.strip())
+        if base is None:
+            continue
+        if (result.seconds > base * (1 + config.tolerance)
+                and result.seconds - base > config.min_regression_seconds):
+            regressions.append(f"{result.name.strip()}: {result.seconds:.3f}s vs baseline {base:.3f}s "
+                               f"(+{(result.seconds / base - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main(config: BenchPipelineConfig):
+    real = use_real_models(config)
+    CONSOLE.print(f"[green]Models: {'real' if real else 'fake'}")
+    asr = make_asr(config, real)
+
+    if config.trace_memory:
+        tracemalloc.start()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = Path(tmp_dir)
+        results += bench_generate(config, asr, work_dir / "generate")
+        results += bench_write_subtitle(config, asr, work_dir / "write")
+        results += bench_websocket(config, asr, work_dir)
+    tracemalloc.stop()
+
+    table = Table(title=f"Pipeline Benchmark ({'real' if real else 'fake'} models)", show_header=True)
+    table.add_column('Case', style='cyan')
+    table.add_column('Time(s)', justify="right", style='magenta')
+    table.add_column('Throughput', justify="right", style='magenta')
+    table.add_column('Peak MB', justify="right", style='magenta')
+    for result in results:
+        table.add_row(result.name, f"{result.seconds:.4f}",
+                      f"{result.throughput:,.1f} {result.unit}" if result.unit else "",
+                      f"{result.peak_mb:.1f}" if result.peak_mb else "")
+    CONSOLE.print(table)
+    CONSOLE.print(f"Process RSS: {process_rss_bytes() / 2**20:.1f} MB")
+
+    key = baseline_key(config, real)
+    if config.save_baseline:
+        path = Path(config.baseline_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps({
+            "config": key,
+            "machine": platform.platform(),
+            "results": {result.name.strip(): result.seconds for result in results},
+        }, indent=2, ensure_ascii=False), encoding="utf-8")
+        CONSOLE.print(f"[green]Baseline saved to {path}")
+        return
+
+    regressions = compare_baseline(config, key, results)
+    if regressions:
+        CONSOLE.rule("[bold red]Performance regressions", style="red")
+        for regression in regressions:
+            CONSOLE.print(f"[bold red]{regression}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(tyro.cli(BenchPipelineConfig))
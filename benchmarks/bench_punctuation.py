@@ -0,0 +1,147 @@
+"""
+标点模型引擎对比: 原模型(transformers) vs int8量化的ONNX模型(python -m src.punctuation导出)。
+语料为ASR输出的.list文件，去掉标点后按chunk_words个单词一段送入模型(与try_punctuation的长句类似)，
+统计两个引擎的加载时间和吞吐量，以及各标点相对ASR原文标点的P/R/F1、ONNX相对原模型的一致率。
+
+在仓库根目录运行:
+python -m benchmarks.bench_punctuation --onnx-model models/fullstop-punctuation-multilang-large-onnx
+"""
+import time
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+
+import tyro
+from rich.table import Table
+
+from src.punctuation import load_punctuation_model
+from src.translator import LANGUAGES
+from src.utils import CONSOLE
+
+# 模型输出的标点标签，"0"为没有标点
+LABELS = (".", ",", "?", ":", "-")
+# ASR原文中单词末尾的字符 -> 标签
+MARK_LABELS = {".": ".", "!": ".", ",": ",", ";": ",", "?": "?", ":": ":", "-": "-"}
+
+
+@dataclass
+class BenchPunctuationConfig:
+    """标点模型引擎对比"""
+
+    # ASR输出的.list文件夹
+    list_dir: str = "assets/asr_output"
+    # 原模型(transformers)
+    reference_model: str = "models/oliverguhr-fullstop-punctuation-multilang-large"
+    # 导出的ONNX模型文件夹
+    onnx_model: str = "models/fullstop-punctuation-multilang-large-onnx"
+    # onnx引擎的CPU线程数，0为ONNX Runtime默认值
+    onnx_threads: int = 0
+    # 每段的单词数
+    chunk_words: int = 40
+    # 最多使用的单词数，0为全部
+    max_words: int = 20000
+
+
+def load_corpus(list_dir: str, max_words: int) -> tuple[list[str], list[str]]:
+    """返回(去掉标点的单词, ASR原文中每个单词的标点标签)。跳过译文缓存xx_zh.list等。"""
+    cache_suffixes = tuple(f"_{code}" for code, _ in LANGUAGES.values())
+    words, labels = [], []
+    for path in sorted(Path(list_dir).glob("*.list")):
+        if path.stem.endswith(cache_suffixes):
+            continue
+        for line in path.read_text(encoding="utf-8").splitlines():
+            # [0.00->2.46]some text
+            text = line.split("]", 1)[-1]
+            for token in text.split():
+                # 与PunctuationModel.preprocess相同: 去掉不在数字中的标点
+                word = token.rstrip(".,;:!?")
+                if not word:
+                    continue
+                words.append(word)
+                # 单独的"-"等符号本身不带标点
+                labels.append(MARK_LABELS.get(token[-1], "0") if len(token) > 1 else "0")
+                if max_words and len(words) >= max_words:
+                    return words, labels
+    return words, labels
+
+
+def run_engine(model, words: list[str], chunk_words: int) -> tuple[list[str], float]:
+    labels = []
+    start = time.perf_counter()
+    for i in range(0, len(words), chunk_words):
+        labels += [label for _, label, _ in model.predict(words[i:i + chunk_words])]
+    return labels, time.perf_counter() - start
+
+
+def f1_scores(predicted: list[str], expected: list[str]) -> dict[str, tuple[float, float, float]]:
+    """各标签的(precision, recall, f1)。"""
+    pairs = Counter(zip(predicted, expected))
+    predicted_count = Counter(predicted)
+    expected_count = Counter(expected)
+    scores = {}
+    for label in LABELS:
+        tp = pairs[(label, label)]
+        precision = tp / predicted_count[label] if predicted_count[label] else 0.0
+        recall = tp / expected_count[label] if expected_count[label] else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        scores[label] = (precision, recall, f1)
+    return scores
+
+
+def main(config: BenchPunctuationConfig):
+    words, corpus_labels = load_corpus(config.list_dir, config.max_words)
+    if not words:
+        CONSOLE.print(f"[red]No .list files found in {config.list_dir}")
+        return
+    CONSOLE.print(f"[green]Corpus: {len(words)} words, {config.chunk_words} words per call")
+
+    engines = {
+        "transformers": (config.reference_model, 0),
+        "onnx": (config.onnx_model, config.onnx_threads),
+    }
+    results = {}
+    for engine, (model_path, threads) in engines.items():
+        start = time.perf_counter()
+        model = load_punctuation_model(model_path, engine, threads)
+        load_cost = time.perf_counter() - start
+        # 预热一次，不计入耗时
+        model.predict(words[:config.chunk_words])
+        labels, cost = run_engine(model, words, config.chunk_words)
+        results[engine] = (labels, load_cost, cost)
+        del model
+
+    reference_cost = results["transformers"][2]
+    speed_table = Table(title="Punctuation Engine Speed", show_header=True)
+    speed_table.add_column('Engine', style='cyan')
+    speed_table.add_column('Load(s)', justify="right", style='magenta')
+    speed_table.add_column('Time(s)', justify="right", style='magenta')
+    speed_table.add_column('Words/s', justify="right", style='magenta')
+    speed_table.add_column('Speedup', justify="right", style='magenta')
+    for engine, (_, load_cost, cost) in results.items():
+        speed_table.add_row(engine, f"{load_cost:.2f}", f"{cost:.2f}", f"{len(words) / cost:,.0f}",
+                            f"{reference_cost / cost:.2f}x")
+    CONSOLE.print(speed_table)
+
+    reference_labels, onnx_labels = results["transformers"][0], results["onnx"][0]
+    scores = {
+        "transformers vs ASR": f1_scores(reference_labels, corpus_labels),
+        "onnx vs ASR": f1_scores(onnx_labels, corpus_labels),
+        "onnx vs transformers": f1_scores(onnx_labels, reference_labels),
+    }
+    accuracy_table = Table(title="Punctuation Accuracy (P/R/F1)", show_header=True)
+    accuracy_table.add_column('Label', style='cyan')
+    accuracy_table.add_column('Count', justify="right", style='magenta')
+    for name in scores:
+        accuracy_table.add_column(name, justify="right", style='magenta')
+    corpus_count = Counter(corpus_labels)
+    for label in LABELS:
+        accuracy_table.add_row(label, str(corpus_count[label]),
+                               *("%.3f/%.3f/%.3f" % score[label] for score in scores.values()))
+    CONSOLE.print(accuracy_table)
+
+    agreement = sum(a == b for a, b in zip(onnx_labels, reference_labels)) / len(words)
+    CONSOLE.print(f"onnx/transformers label agreement: {agreement:.2%}")
+
+
+if __name__ == '__main__':
+    main(tyro.cli(BenchPunctuationConfig))
@@ -0,0 +1,96 @@
+"""
+字幕文档解析与写入的性能测试。
+在仓库根目录运行: python -m benchmarks.bench_subtitle --num-lines 100000
+"""
+import random
+import re
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import tyro
+from rich.table import Table
+
+from src.subtitle import SubtitleDocument, SubtitleFile
+from src.utils import CONSOLE, get_timestamp
+
+
+@dataclass
+class BenchSubtitleConfig:
+    """字幕文档性能测试"""
+
+    # 合成字幕行数
+    num_lines: int = 100000
+    # 重复次数，取最快的一次
+    repeat: int = 3
+    # 随机种子
+    seed: int = 0
+
+
+def make_merged_lines(num_lines: int, seed: int = 0) -> list[str]:
+    """生成translate_file格式的合成字幕行。"""
+    rng = random.Random(seed)
+    lines = []
+    t = 0.0
+    for i in range(num_lines):
+        duration = rng.uniform(0.5, 8.0)
+        lines.append("[%.2f->%.2f]This is synthetic subtitle line number %d.@@@这是第%d行合成字幕。\n"
+                     % (t, t + duration, i, i))
+        t += duration + rng.uniform(0.0, 1.0)
+    return lines
+
+
+def legacy_write(lines: list[str], path: Path):
+    """旧实现: 逐行正则匹配并逐行调用get_timestamp。"""
+    pattern = re.compile(r"^\[(\d+\.\d+)->(\d+\.\d+)\](.*)@@@(.*)$")
+    ass = path.suffix == ".ass"
+    with path.open("w", encoding="utf-8") as f:
+        for i, line in enumerate(lines):
+            start, end, source_text, target_text = pattern.match(line.strip()).groups()
+            if ass:
+                f.write("Dialogue: 0,%s,%s,ZH,,0,0,0,,%s\\N{\\rEN}%s\n" % (
+                    get_timestamp(start), get_timestamp(end), target_text, source_text))
+            else:
+                f.write("%d\n%s --> %s\n%s\n%s\n\n" % (
+                    i + 1, get_timestamp(start, False), get_timestamp(end, False), target_text, source_text))
+
+
+def best_of(repeat: int, fn, *args) -> float:
+    costs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        costs.append(time.perf_counter() - start)
+    return min(costs)
+
+
+def main(config: BenchSubtitleConfig):
+    lines = make_merged_lines(config.num_lines, config.seed)
+    table = Table(title=f"Subtitle Benchmark ({config.num_lines} lines)", show_header=True)
+    table.add_column('Case', style='cyan')
+    table.add_column('Time(s)', justify="right", style='magenta')
+    table.add_column('Lines/s', justify="right", style='magenta')
+
+    def add_row(name, cost):
+        table.add_row(name, f"{cost:.4f}", f"{config.num_lines / cost:,.0f}")
+
+    add_row("parse", best_of(config.repeat, SubtitleDocument.from_merged_lines, lines))
+    doc = SubtitleDocument.from_merged_lines(lines)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for suffix in (".ass", ".srt"):
+            path = Path(tmp_dir) / f"legacy{suffix}"
+            add_row(f"legacy parse+write {suffix}", best_of(config.repeat, legacy_write, lines, path))
+        for suffix in (".ass", ".srt", ".vtt"):
+            path = Path(tmp_dir) / f"bench{suffix}"
+            add_row(f"write {suffix}", best_of(config.repeat, doc.write, path))
+            add_row(f"parse+write {suffix}", best_of(
+                config.repeat, lambda p: SubtitleDocument.from_merged_lines(lines).write(p), path))
+            add_row(f"load+shift+save {suffix}", best_of(
+                config.repeat, lambda p: SubtitleFile.load(p).shift(1.5).save(p), path))
+
+    CONSOLE.print(table)
+
+
+if __name__ == '__main__':
+    main(tyro.cli(BenchSubtitleConfig))
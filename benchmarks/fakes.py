@@ -0,0 +1,141 @@
+"""
+性能测试用的假模型，接口与真实后端一致，输出由随机种子决定，耗时可配置。
+- FakeWhisperModel: 替代faster_whisper.WhisperModel，按音频长度生成单词流
+- FakePunctuationModel: 替代deepmultilingualpunctuation.PunctuationModel
+- FakeTranslator: 替代deep_translator的翻译器，保留每行的时间戳
+- FakeApiTranslator: translate_api为google/baidu时使用FakeTranslator的Translator
+"""
+import random
+import re
+import time
+import wave
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+from faster_whisper.transcribe import Word
+
+from src.translator import Translator, TranslatorConfig
+from src.utils import SAMPLE_RATE
+
+VOCABULARY = ("so", "let's", "open", "the", "project", "and", "add", "a", "new", "scene", "then", "we",
+              "can", "drag", "this", "node", "into", "tree", "because", "it", "will", "be", "used", "later",
+              "you", "see", "that", "card", "deck", "shuffle", "function", "returns", "value", "player")
+
+
+class FakeSegment(NamedTuple):
+    start: float
+    end: float
+    text: str
+    words: list
+
+
+def write_synthetic_wav(path: Path, seconds: float, seed: int = 0):
+    """生成16kHz单声道的合成音频(带噪声的正弦波)。"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    audio = 0.3 * np.sin(2 * np.pi * 220 * t) + 0.05 * rng.standard_normal(len(t))
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes((audio * 32767).astype("<i2").tobytes())
+
+
+def synthetic_words(seconds: float, seed: int = 0) -> list[Word]:
+    """
+    生成覆盖seconds秒的单词流。大部分句子以句号结尾，
+    约三分之一是没有标点的长句，会触发重新标点和长句切分。
+    """
+    rng = random.Random(seed)
+    words = []
+    t = 0.0
+    while True:
+        long_sentence = rng.random() < 0.3
+        length = rng.randint(20, 45) if long_sentence else rng.randint(3, 18)
+        for i in range(length):
+            duration = rng.uniform(0.15, 0.45)
+            if t + duration > seconds:
+                return words
+            text = " " + rng.choice(VOCABULARY)
+            if i == length - 1:
+                text += "."
+            elif not long_sentence and rng.random() < 0.1:
+                text += ","
+            words.append(Word(t, t + duration, text, 0.9))
+            # 偶尔出现较长的停顿
+            t += duration + (rng.uniform(0.5, 1.0) if rng.random() < 0.05 else rng.uniform(0.0, 0.1))
+
+
+class FakeWhisperModel:
+    """
+    按音频长度生成确定的单词流，每个segment约30秒。
+    rtf为实时率: 每秒音频额外sleep的秒数，模拟解码耗时。
+    """
+
+    def __init__(self, rtf: float = 0.0, seed: int = 0):
+        self.rtf = rtf
+        self.seed = seed
+
+    def transcribe(self, audio, **kwargs):
+        seconds = len(audio) / SAMPLE_RATE
+        words = synthetic_words(seconds, self.seed)
+
+        def segments():
+            start = 0
+            while start < len(words):
+                end = start
+                while end < len(words) and words[end].end - words[start].start < 30:
+                    end += 1
+                segment_words = words[start:end]
+                if self.rtf:
+                    time.sleep((segment_words[-1].end - segment_words[0].start) * self.rtf)
+                yield FakeSegment(segment_words[0].start, segment_words[-1].end,
+                                  "".join(w.word for w in segment_words), segment_words)
+                start = end
+
+        return segments(), None
+
+
+class FakePunctuationModel:
+    """每8个单词加一个逗号，单词数不变。latency为每次调用的耗时。"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    def restore_punctuation(self, text: str) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        words = [w.rstrip(",.") for w in text.split(" ")]
+        words = [w + "," if i % 8 == 7 else w for i, w in enumerate(words)]
+        return " ".join(words) + "."
+
+
+class FakeTranslator:
+    """保留每行的时间戳，把文本替换为确定的中文。latency为每次调用的耗时。"""
+    line_pattern = re.compile(r"(\[\d+\.\d+->\d+\.\d+\])([^\[]*)")
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    def translate(self, text: str) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        return "".join("%s这是第%d个字符开始的翻译。\n" % (stamp, len(body))
+                       for stamp, body in self.line_pattern.findall(text))
+
+
+class FakeApiTranslator(Translator):
+    def __init__(self, config: TranslatorConfig = TranslatorConfig(translate_api='google'), latency: float = 0.0):
+        super().__init__(config)
+        self._fake_translator = FakeTranslator(latency)
+
+    @property
+    def translator(self) -> FakeTranslator:
+        return self._fake_translator
+
+
+def fake_qwen_translate(latency: float = 0.0):
+    """替代utils.qwen_translate的函数。"""
+    translator = FakeTranslator(latency)
+    return lambda content, model="qwen-max", target_language="中文": translator.translate(content)
@@ -1,17 +1,10 @@
-import subprocess
-from pathlib import Path
+import tyro
 
-from src.utils import TIME_RECORDER
+from src.ffmpeg_runner import FFmpegConfig, FFmpegRunner
 
 if __name__ == '__main__':
-    video_dir = Path("assets/video")
-    TIME_RECORDER.reset()
-    for video in video_dir.glob("*.mp4"):
-        filename = video.stem
-        if filename.startswith("000"):
-            # cmd = f'ffmpeg -i "assets/video/{filename}.mp4" -vf subtitles="assets/video/{filename}.ass" -b:v 6M "assets/final/{filename}.mp4"'
-            # 使用 NVIDIA GPU 加速
-            cmd = f'ffmpeg -hide_banner -i "assets/video/{filename}.mp4" -vcodec h264_nvenc -vf subtitles="assets/video/{filename}.ass" -b:v 6M "assets/final/{filename}.mp4"'
-            subprocess.run(cmd, shell=True)
-            TIME_RECORDER.record(filename)
-    TIME_RECORDER.show()
+    # CPU压制: python run_ffmpeg.py --encoder libx264 --preset veryfast --threads-per-job 4
+    # 使用 NVIDIA GPU 加速: python run_ffmpeg.py --encoder h264_nvenc --jobs 2
+    # 封装软字幕，不重新编码: python run_ffmpeg.py --mode mux --mux-tracks bilingual,tgt,src
+    config = tyro.cli(FFmpegConfig)
+    FFmpegRunner(config).run()
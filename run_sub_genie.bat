@@ -10,9 +10,41 @@ python app.py
 :: 使用通义千问qwen-max翻译(效果最好)
 ::python app.py --translator.translate-api qwen --translator.qwen-model qwen-max --translator.line-num-in-one-call 42
 
+:: 使用本地CTranslate2模型离线翻译(需先用ct2-transformers-converter转换模型)
+::python app.py --translator.translate-api local --translator.local-model models/opus-mt-en-zh --translator.local-intra-threads 8
+
+:: 同时翻译为多种语言，每种语言一个字幕文件(xx.ass, xx.ja.ass, xx.ko.ass)，加--multi-lang-tracks则写入同一个ass
+::python app.py --translator.tgt-langs chinese,japanese,korean
+
 :: 下载视频和封面
 ::python app.py --task download --youtube-downloader.url "https://www.youtube.com/watch?v=ulgh_neTJG8&list=PL6SABXRSlpH8CD71L7zye311cp9R4JazJ"
 
+:: 边下载边生成字幕，音频下载完成后立即开始语音识别和翻译
+::python app.py --task stream --youtube-downloader.url "https://www.youtube.com/watch?v=ulgh_neTJG8&list=PL6SABXRSlpH8CD71L7zye311cp9R4JazJ"
+
+:: 长音频分窗识别，每次只解码10分钟音频，内存占用与音频长度无关
+::python app.py --whisper-asr.window-seconds 600
+
+:: 用VAD跳过静音和片头音乐，语音区间缓存在音频旁的xx.vad.json中，断句时也参考VAD检测到的静音
+::python app.py --whisper-asr.vad --whisper-asr.vad-config.min-silence 1.0
+
+:: 标点模型用int8量化的ONNX Runtime在CPU上推理，先导出一次模型
+::python -m src.punctuation --output-dir models/fullstop-punctuation-multilang-large-onnx
+::python app.py --whisper-asr.punctuation-engine onnx --whisper-asr.punctuation-model models/fullstop-punctuation-multilang-large-onnx
+:: 与原模型对比标点准确率和速度
+::python -m benchmarks.bench_punctuation --onnx-model models/fullstop-punctuation-multilang-large-onnx
+
+:: 记录各阶段耗时，生成的trace.json可在 https://ui.perfetto.dev 中查看
+::python app.py --trace-path assets/trace.json
+
+:: 无界面模式(服务器/批处理)，stdout每行一个JSON进度事件，日志写到stderr
+::python app.py --headless --log-level INFO > progress.jsonl
+
+:: 多进程/多机器处理: 先扫描目录提交任务到共享队列，再在各台机器上启动工作进程
+:: 各目录参数(--video-dir等)和--job-db都需指向共享目录，所有机器使用相同的路径
+::python app.py --task enqueue --job-db //nas/subgenie/jobs.db
+::python app.py --task worker --job-db //nas/subgenie/jobs.db --worker-idle-exit
+
 :: 手动用ChatGPT或Kimi翻译
 :: python app.py --skip-translate
 :: 将翻译结果复制到xx_zh.list后，合并两个文件并生成ass双语字幕。
@@ -0,0 +1,114 @@
+"""
+按时间戳把译文对齐到原文。
+翻译API和大模型会合并、拆分、漏掉或改写时间标签，按位置对齐时一处不一致会使后面全部错位。
+这里先为原文建立时间戳索引，译文的每一行按其时间标签查找对应的原文行:
+精确匹配用哈希表，时间标签被改写时在tolerance秒内近似匹配(二分查找)，总体为线性时间。
+只有确实没有译文的原文行会被标记为缺失。
+"""
+import bisect
+import re
+from dataclasses import dataclass, field
+from typing import Optional, Sequence
+
+# 缺失译文的占位文本
+MISSING_TRANSLATION = "AI翻译漏行"
+
+# 宽松的时间标签: [1.44->3.18]、[1.44 -> 3.18]、【1.44->3.18】、[1.44-->3.18]
+LOOSE_TIME_TAG_PATTERN = re.compile(r"[\[【]\s*(\d+(?:\.\d+)?)\s*-+>\s*(\d+(?:\.\d+)?)\s*[\]】]")
+
+
+@dataclass
+class Alignment:
+    # 与原文逐行对应的译文，缺失的为None
+    texts: list[Optional[str]]
+    # 缺失译文的原文行号
+    missing: list[int] = field(default_factory=list)
+    # 没有对应原文行的译文(时间标签无法匹配或重复)
+    unmatched: list[str] = field(default_factory=list)
+
+    def filled(self, placeholder: str = MISSING_TRANSLATION) -> list[str]:
+        """缺失的行用placeholder填充。"""
+        return [placeholder if text is None else text for text in self.texts]
+
+
+def parse_timed_text(text: str) -> list[tuple[float, float, str]]:
+    """
+    解析带时间标签的文本，返回[(start, end, text), ...]。
+    两个时间标签之间的所有内容(包括换行)属于前一个标签，第一个标签之前的内容被忽略。
+    """
+    # API翻译结果有时候会出现"\u200b"
+    text = text.replace("\u200b", "")
+    matches = list(LOOSE_TIME_TAG_PATTERN.finditer(text))
+    ends = [m.start() for m in matches[1:]] + [len(text)]
+    return [(float(m.group(1)), float(m.group(2)), " ".join(text[m.end():end].split()))
+            for m, end in zip(matches, ends)]
+
+
+class TimestampIndex:
+    """原文行的时间戳索引，行需按开始时间排序(ASR输出的顺序)。"""
+
+    def __init__(self, starts: Sequence[float], ends: Sequence[float], tolerance: float = 0.3):
+        self.starts = [float(s) for s in starts]
+        self.ends = [float(e) for e in ends]
+        self.tolerance = tolerance
+        # 时间标签 -> 原文行号列表，长句切分时可能有几行的时间标签相同
+        self._exact: dict[tuple[int, int], list[int]] = {}
+        for i, (start, end) in enumerate(zip(self.starts, self.ends)):
+            self._exact.setdefault(self._key(start, end), []).append(i)
+
+    @staticmethod
+    def _key(start: float, end: float) -> tuple[int, int]:
+        return round(start * 100), round(end * 100)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def lookup(self, start: float, end: float, taken: Optional[list[bool]] = None) -> Optional[int]:
+        """
+        查找与[start, end]对应的原文行号，taken中已占用的行不再匹配。
+        先精确匹配，否则在开始时间±tolerance内找开始或结束时间最接近的行。
+        """
+        for index in self._exact.get(self._key(start, end), ()):
+            if not (taken and taken[index]):
+                return index
+
+        lo = bisect.bisect_left(self.starts, start - self.tolerance)
+        best, best_distance = None, None
+        for i in range(lo, len(self.starts)):
+            if self.starts[i] > start + self.tolerance:
+                break
+            if taken and taken[i]:
+                continue
+            # 合并的行只有开始时间对得上，结束时间差得多
+            distance = abs(self.starts[i] - start) + min(abs(self.ends[i] - end), self.tolerance)
+            if best_distance is None or distance < best_distance:
+                best, best_distance = i, distance
+        return best
+
+    def align(self, translation: str) -> Alignment:
+        """把带时间标签的译文对齐到原文行。"""
+        texts: list[Optional[str]] = [None] * len(self)
+        taken = [False] * len(self)
+        unmatched = []
+        for start, end, text in parse_timed_text(translation):
+            indices = self._exact.get(self._key(start, end), ())
+            if indices and all(taken[i] for i in indices):
+                # 时间标签相同的原文行都已有译文，一般是把一行拆成了两行
+                index = indices[-1]
+                if text and text != texts[index]:
+                    texts[index] = f"{texts[index]} {text}".strip()
+                continue
+            index = self.lookup(start, end, taken)
+            if index is None:
+                unmatched.append(text)
+                continue
+            taken[index] = True
+            texts[index] = text
+        missing = [i for i, text in enumerate(texts) if text is None]
+        return Alignment(texts, missing, unmatched)
+
+
+def align_translation(source_lines: Sequence[str], translation: str, tolerance: float = 0.3) -> Alignment:
+    """source_lines为.list格式的原文行([0.00->2.46]some text)，按时间标签对齐translation。"""
+    timed = parse_timed_text("\n".join(source_lines))
+    return TimestampIndex([t[0] for t in timed], [t[1] for t in timed], tolerance).align(translation)
@@ -0,0 +1,101 @@
+"""
+流式读取音频。用PyAV边解码边重采样为16kHz单声道float32，不把整个文件读入内存。
+- iter_audio_chunks: 按解码帧依次返回[start, end)范围内的音频
+- read_audio_range: 读取一段音频(websocket切片识别)
+- iter_audio_windows: 固定长度、相互重叠的窗口(长音频分窗识别)
+"""
+from typing import Iterator, Optional
+
+import av
+import numpy as np
+
+from src.utils import SAMPLE_RATE
+
+
+def probe_duration(audio_path: str) -> float:
+    """音频时长(秒)，无法获取时返回0。"""
+    with av.open(audio_path, metadata_errors="ignore") as container:
+        stream = container.streams.audio[0]
+        if stream.duration is not None and stream.time_base is not None:
+            return float(stream.duration * stream.time_base)
+        if container.duration is not None:
+            return container.duration / av.time_base
+    return 0.0
+
+
+def iter_audio_chunks(audio_path: str, start_time: float = 0.0,
+                      end_time: Optional[float] = None) -> Iterator[np.ndarray]:
+    """依次返回[start_time, end_time)范围内的音频块，与faster_whisper.audio.decode_audio的结果一致。"""
+    with av.open(audio_path, metadata_errors="ignore") as container:
+        stream = container.streams.audio[0]
+        resampler = av.AudioResampler(format="s16", layout="mono", rate=SAMPLE_RATE)
+        if start_time > 0:
+            # 跳到start_time之前最近的关键帧，之后按样本数丢弃多余部分
+            container.seek(int(start_time / stream.time_base), stream=stream)
+
+        # position: 下一个样本的时间(秒)
+        position = None
+        end_sample = None
+
+        def convert(frames) -> Iterator[np.ndarray]:
+            nonlocal position
+            for frame in frames:
+                chunk = frame.to_ndarray().reshape(-1)
+                chunk_start = position
+                position += len(chunk) / SAMPLE_RATE
+                skip = max(int(round((start_time - chunk_start) * SAMPLE_RATE)), 0)
+                if end_time is not None:
+                    keep = int(round((end_time - chunk_start) * SAMPLE_RATE))
+                    chunk = chunk[:max(keep, 0)]
+                chunk = chunk[skip:]
+                if len(chunk):
+                    yield chunk.astype(np.float32) / 32768.0
+
+        for frame in container.decode(stream):
+            if position is None:
+                position = frame.time if start_time > 0 and frame.time is not None else 0.0
+            yield from convert(resampler.resample(frame))
+            if end_time is not None and position >= end_time:
+                return
+        if position is not None:
+            yield from convert(resampler.resample(None))
+
+
+def read_audio_range(audio_path: str, start_time: float, end_time: float) -> np.ndarray:
+    """读取[start_time, end_time)的音频。"""
+    chunks = list(iter_audio_chunks(audio_path, start_time, end_time))
+    return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.float32)
+
+
+def iter_audio_windows(audio_path: str, window_seconds: float,
+                       overlap_seconds: float) -> Iterator[tuple[float, np.ndarray]]:
+    """
+    按window_seconds长、相邻重叠overlap_seconds的窗口读取音频，返回(窗口起始时间, 音频)。
+    所有窗口共用一块缓冲区，返回的数组在取下一个窗口前有效，内存占用与音频总长度无关。
+    """
+    window = int(window_seconds * SAMPLE_RATE)
+    overlap = min(int(overlap_seconds * SAMPLE_RATE), window // 2)
+    hop = window - overlap
+    buffer = np.empty(window, dtype=np.float32)
+    filled = 0
+    offset = 0
+    # 缓冲区中还有上一个窗口没有返回过的样本
+    has_new = False
+
+    for chunk in iter_audio_chunks(audio_path):
+        while len(chunk):
+            n = min(len(chunk), window - filled)
+            buffer[filled:filled + n] = chunk[:n]
+            filled += n
+            has_new = True
+            chunk = chunk[n:]
+            if filled == window:
+                yield offset / SAMPLE_RATE, buffer
+                # 窗口末尾的重叠部分移到缓冲区开头
+                buffer[:overlap] = buffer[hop:]
+                filled = overlap
+                offset += hop
+                has_new = False
+
+    if has_new:
+        yield offset / SAMPLE_RATE, buffer[:filled]
@@ -0,0 +1,359 @@
+import bisect
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+from rich.progress import (BarColumn, Progress, TaskProgressColumn,
+                           TextColumn, TimeRemainingColumn)
+
+from src.subtitle import SubtitleFile, split_bilingual
+from src.utils import (CONSOLE, LOGGER, TIME_RECORDER, ensure_folder_exists,
+                       filter_files, is_up_to_date)
+
+# 编码器 -> 默认预设
+ENCODER_PRESETS = {
+    "libx264": "medium",
+    "libx265": "medium",
+    "h264_nvenc": "p4",
+}
+
+
+@dataclass
+class FFmpegConfig:
+    """基于ffmpeg的字幕压制工具"""
+
+    # 压制模式 burn: 每个视频一个ffmpeg进程，多个视频并行 | segment: 单个长视频按关键帧切段并行压制后无损拼接
+    # | mux: 不重新编码，把字幕作为软字幕轨道封装进视频
+    mode: str = 'burn'
+    # 输入视频目录
+    video_dir: str = 'assets/video'
+    # 视频过滤器
+    video_filter: str = 'mp4'
+    # 只处理文件名以此开头的视频，为空时处理全部
+    prefix: str = ''
+    # 字幕文件类型 ass | srt
+    subtitle_type: str = 'ass'
+    # 输出目录
+    output_dir: str = 'assets/final'
+    # 视频编码器 libx264 | libx265 | h264_nvenc
+    encoder: str = 'libx264'
+    # 编码预设，为空时使用编码器的默认值。libx264/libx265: ultrafast ... veryslow, nvenc: p1 ... p7
+    preset: str = ''
+    # libx264/libx265的crf，为0时改用码率控制
+    crf: int = 20
+    # 码率，crf为0或使用nvenc时生效
+    bitrate: str = '6M'
+    # 每个ffmpeg任务使用的线程数
+    threads_per_job: int = 4
+    # 同时运行的ffmpeg任务数，0表示根据CPU核数和threads_per_job自动计算
+    jobs: int = 0
+    # 输出文件已是最新时也重新压制
+    overwrite: bool = False
+    # segment模式的分段数，0表示与并发数相同
+    segments: int = 0
+    # segment模式每段的最短时长(秒)，视频太短时减少分段数
+    min_segment_seconds: float = 60.0
+    # mux模式的输出容器 mkv | mp4(mp4只支持纯文本字幕，ass样式会丢失)
+    mux_format: str = 'mkv'
+    # mux模式封装的字幕轨道，逗号分隔，第一个为默认轨道。bilingual: 双语 | tgt: 只有译文 | src: 只有原文
+    mux_tracks: str = 'bilingual'
+    # 译文轨道的语言码(ISO 639-2)
+    tgt_language_code: str = 'chi'
+    # 原文轨道的语言码(ISO 639-2)
+    src_language_code: str = 'eng'
+
+
+def probe_format(video_path: Path, key: str) -> float:
+    """用ffprobe获取容器信息(duration | start_time)，失败时返回0。"""
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", f"format={key}",
+         "-of", "default=noprint_wrappers=1:nokey=1", str(video_path)],
+        capture_output=True, text=True)
+    try:
+        return float(result.stdout.strip())
+    except ValueError:
+        return 0.0
+
+
+def probe_duration(video_path: Path) -> float:
+    """视频时长(秒)，失败时返回0。"""
+    return probe_format(video_path, "duration")
+
+
+def probe_keyframes(video_path: Path) -> list[float]:
+    """读取视频流所有关键帧的时间(秒，已减去容器的start_time)。只解析包头，不解码。"""
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "packet=pts_time,flags",
+         "-of", "csv=print_section=0", str(video_path)],
+        capture_output=True, text=True)
+    start_time = probe_format(video_path, "start_time")
+    keyframes = []
+    for line in result.stdout.splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags and pts_time not in ("", "N/A"):
+            keyframes.append(float(pts_time) - start_time)
+    return sorted(keyframes)
+
+
+def choose_split_points(keyframes: list[float], duration: float, count: int, min_seconds: float) -> list[float]:
+    """在关键帧中挑出离等分点最近的位置作为切分点，返回包含0和duration的分段边界。"""
+    if min_seconds > 0:
+        count = min(count, int(duration // min_seconds))
+    bounds = [0.0]
+    for i in range(1, max(1, count)):
+        target = duration * i / count
+        index = bisect.bisect_left(keyframes, target)
+        candidates = keyframes[max(0, index - 1):index + 1]
+        if not candidates:
+            continue
+        best = min(candidates, key=lambda k: abs(k - target))
+        if bounds[-1] < best < duration:
+            bounds.append(best)
+    bounds.append(duration)
+    return bounds
+
+
+def escape_filter_path(path: Path) -> str:
+    """转义滤镜参数中的路径，兼容Windows盘符、单引号、逗号等特殊字符。"""
+    path_str = path.as_posix()
+    # 第一层: 滤镜参数值的转义
+    for c in "\\':":
+        path_str = path_str.replace(c, "\\" + c)
+    # 第二层: 滤镜图的转义
+    for c in "\\'[],;":
+        path_str = path_str.replace(c, "\\" + c)
+    return path_str
+
+
+class FFmpegRunner:
+    def __init__(self, config: FFmpegConfig = FFmpegConfig()):
+        self.config = config
+        ensure_folder_exists(config.output_dir)
+
+    @property
+    def jobs(self) -> int:
+        if self.config.jobs > 0:
+            return self.config.jobs
+        return max(1, (os.cpu_count() or 1) // max(1, self.config.threads_per_job))
+
+    @property
+    def output_format(self) -> str:
+        return self.config.mux_format if self.config.mode == "mux" else "mp4"
+
+    def encoder_args(self) -> list[str]:
+        encoder = self.config.encoder
+        preset = self.config.preset or ENCODER_PRESETS.get(encoder, "medium")
+        args = ["-c:v", encoder, "-preset", preset]
+        if encoder.endswith("nvenc") or self.config.crf <= 0:
+            args += ["-b:v", self.config.bitrate]
+        else:
+            args += ["-crf", str(self.config.crf)]
+        if encoder == "libx265":
+            # libx265不认-threads，要通过x265-params限制线程池
+            args += ["-x265-params", f"pools={self.config.threads_per_job}:log-level=error"]
+        else:
+            args += ["-threads", str(self.config.threads_per_job)]
+        return args
+
+    def collect_jobs(self) -> list[tuple[Path, Path, Path]]:
+        """返回需要压制的 (视频, 字幕, 输出) 列表，跳过缺少字幕或输出已是最新的视频。"""
+        jobs = []
+        for video in sorted(filter_files(self.config.video_dir, self.config.video_filter)):
+            if not video.stem.startswith(self.config.prefix):
+                continue
+            subtitle = video.with_suffix("." + self.config.subtitle_type)
+            output = Path(self.config.output_dir) / (video.stem + "." + self.output_format)
+            if not subtitle.exists():
+                LOGGER.warning(f"Subtitle not found, skip: {subtitle}")
+                continue
+            if not self.config.overwrite and is_up_to_date(output, video, subtitle):
+                LOGGER.info(f"{output} is up to date, skip.")
+                continue
+            jobs.append((video, subtitle, output))
+        return jobs
+
+    def run_ffmpeg(self, cmd: list[str], on_progress=None) -> bool:
+        """运行ffmpeg并解析-progress输出，on_progress(已处理秒数)用于更新进度。返回是否成功。"""
+        cmd = ["ffmpeg", "-hide_banner", "-nostats", "-loglevel", "error", "-progress", "pipe:1", "-y"] + cmd
+        LOGGER.debug(" ".join(cmd))
+        # stderr写到临时文件: 两个都用管道时，stderr写满管道缓冲区会使ffmpeg阻塞，而这里在等stdout，形成死锁
+        with tempfile.TemporaryFile() as stderr_file:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file,
+                                    text=True, encoding="utf-8", errors="replace")
+            for line in proc.stdout:
+                key, _, value = line.strip().partition("=")
+                # out_time_ms的单位其实也是微秒
+                if key in ("out_time_us", "out_time_ms") and value.isdigit() and on_progress:
+                    on_progress(int(value) / 1e6)
+            proc.wait()
+            stderr_file.seek(0)
+            stderr = stderr_file.read().decode("utf-8", errors="replace")
+        if proc.returncode != 0:
+            LOGGER.error(f"ffmpeg failed({proc.returncode}): {stderr.strip()[-1000:]}")
+            return False
+        return True
+
+    def run_ffmpeg_to(self, cmd: list[str], output: Path, on_progress=None) -> bool:
+        """
+        运行ffmpeg，输出先写到同目录的临时文件，成功后才替换为output。
+        失败或中断时删除临时文件，不会在output留下不完整、却比视频和字幕新的文件而被当作已压制。
+        """
+        tmp_path = output.with_name(output.stem + ".part" + output.suffix)
+        try:
+            ok = self.run_ffmpeg(cmd + [str(tmp_path)], on_progress)
+            if ok:
+                os.replace(tmp_path, output)
+            return ok
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def burn_in(self, video: Path, subtitle: Path, output: Path, progress: Progress) -> bool:
+        duration = probe_duration(video)
+        task_id = progress.add_task(video.stem, total=duration or None)
+        start_t = time.time()
+        cmd = ["-i", str(video), "-vf", f"subtitles=filename={escape_filter_path(subtitle)}"] + \
+            self.encoder_args() + ["-c:a", "copy"]
+        ok = self.run_ffmpeg_to(cmd, output, lambda t: progress.update(task_id, completed=min(t, duration)))
+        if ok:
+            progress.update(task_id, completed=duration)
+        TIME_RECORDER.add(video.stem, time.time() - start_t)
+        return ok
+
+    def burn_in_segmented(self, video: Path, subtitle: Path, output: Path, progress: Progress) -> bool:
+        """
+        把单个视频在关键帧处切成多段，每段配上平移后的字幕切片并行压制，
+        最后用concat无损拼接，并直接复制原视频的音轨。
+        """
+        duration = probe_duration(video)
+        bounds = choose_split_points(probe_keyframes(video), duration,
+                                     self.config.segments or self.jobs, self.config.min_segment_seconds)
+        segment_dir = output.parent / f".{output.stem}_segments"
+        segment_dir.mkdir(parents=True, exist_ok=True)
+        subtitle_file = SubtitleFile.load(subtitle)
+
+        task_id = progress.add_task(f"{video.stem} x{len(bounds) - 1}", total=duration or None)
+        done = [0.0] * (len(bounds) - 1)
+        start_t = time.time()
+
+        def encode_segment(i: int) -> Path:
+            start, end = bounds[i], bounds[i + 1]
+            segment_path = segment_dir / f"{i:03d}.mp4"
+            segment_subtitle = segment_dir / f"{i:03d}{subtitle.suffix}"
+            subtitle_file.slice(start, end).save(segment_subtitle)
+            cmd = ["-ss", f"{start:.6f}"]
+            if i < len(bounds) - 2:  # 最后一段直接到结尾
+                cmd += ["-t", f"{end - start:.6f}"]
+            cmd += ["-i", str(video), "-an", "-vf", f"subtitles=filename={escape_filter_path(segment_subtitle)}"] + \
+                self.encoder_args() + [str(segment_path)]
+
+            def on_progress(t):
+                done[i] = min(t, end - start)
+                progress.update(task_id, completed=sum(done))
+
+            if not self.run_ffmpeg(cmd, on_progress):
+                raise RuntimeError(f"segment {i} of {video.name} failed")
+            return segment_path
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                try:
+                    segment_paths = list(executor.map(encode_segment, range(len(bounds) - 1)))
+                except RuntimeError as e:
+                    LOGGER.error(str(e))
+                    return False
+
+            concat_list = segment_dir / "concat.txt"
+            concat_list.write_text("".join([f"file '{p.name}'\n" for p in segment_paths]), encoding="utf-8")
+            ok = self.run_ffmpeg_to(["-f", "concat", "-safe", "0", "-i", str(concat_list), "-i", str(video),
+                                     "-map", "0:v", "-map", "1:a?", "-c", "copy"], output)
+            if ok:
+                progress.update(task_id, completed=duration)
+            return ok
+        finally:
+            # 无论成功、失败还是异常，都不留下分段文件
+            shutil.rmtree(segment_dir, ignore_errors=True)
+            TIME_RECORDER.add(video.stem, time.time() - start_t)
+
+    def mux(self, video: Path, subtitle: Path, output: Path, progress: Progress) -> bool:
+        """音视频流直接复制，把字幕作为独立轨道封装，不做任何编码。"""
+        duration = probe_duration(video)
+        task_id = progress.add_task(video.stem, total=duration or None)
+        start_t = time.time()
+        track_dir = output.parent / f".{output.stem}_tracks"
+        track_dir.mkdir(parents=True, exist_ok=True)
+
+        subtitle_file = SubtitleFile.load(subtitle)
+        tgt_doc, src_doc = split_bilingual(subtitle_file) if subtitle.suffix == ".ass" else (None, None)
+        tracks = [t.strip() for t in self.config.mux_tracks.split(",") if t.strip()]
+        if subtitle.suffix != ".ass" and any(track != "bilingual" for track in tracks):
+            # srt/vtt没有ZH/EN样式，无法拆分，整个文件只封装为一条轨道
+            LOGGER.warning(f"{subtitle.name}: tgt/src tracks need an .ass subtitle, mux as one bilingual track.")
+            tracks = ["bilingual"]
+        track_files = []
+        for track in tracks:
+            if track == "bilingual":
+                track_files.append((subtitle, self.config.tgt_language_code, "双语"))
+            elif track in ("tgt", "src"):
+                doc = tgt_doc if track == "tgt" else src_doc
+                if len(doc) == 0:
+                    LOGGER.warning(f"{subtitle.name} has no {track} lines, skip track.")
+                    continue
+                track_path = track_dir / f"{track}{subtitle.suffix}"
+                doc.write(track_path, only_tgt=track == "tgt")
+                language = self.config.tgt_language_code if track == "tgt" else self.config.src_language_code
+                track_files.append((track_path, language, "译文" if track == "tgt" else "原文"))
+            else:
+                LOGGER.warning(f"Unknown subtitle track: {track}")
+
+        cmd = ["-i", str(video)]
+        for track_path, _, _ in track_files:
+            cmd += ["-i", str(track_path)]
+        cmd += ["-map", "0:v", "-map", "0:a?"]
+        for i in range(len(track_files)):
+            cmd += ["-map", f"{i + 1}:s"]
+        cmd += ["-c", "copy", "-c:s", "mov_text" if self.output_format == "mp4" else "ass"]
+        for i, (_, language, title) in enumerate(track_files):
+            cmd += [f"-metadata:s:s:{i}", f"language={language}", f"-metadata:s:s:{i}", f"title={title}",
+                    f"-disposition:s:{i}", "default" if i == 0 else "0"]
+
+        ok = self.run_ffmpeg_to(cmd, output, lambda t: progress.update(task_id, completed=min(t, duration)))
+        if ok:
+            progress.update(task_id, completed=duration)
+        shutil.rmtree(track_dir, ignore_errors=True)
+        TIME_RECORDER.add(video.stem, time.time() - start_t)
+        return ok
+
+    def burn_in_all(self):
+        jobs = self.collect_jobs()
+        if not jobs:
+            CONSOLE.print("[yellow]没有需要压制的视频")
+            return
+
+        CONSOLE.print(f"[green]{self.config.mode}模式压制 {len(jobs)} 个视频，并发数 {self.jobs}，"
+                      f"每个任务 {self.config.threads_per_job} 线程，编码器 {self.config.encoder}")
+        progress = Progress(
+            TextColumn("[cyan]{task.description}"), BarColumn(), TaskProgressColumn(), TimeRemainingColumn(),
+            console=CONSOLE)
+        if self.config.mode == "segment":
+            # 视频逐个处理，每个视频内部的分段并行
+            with progress:
+                results = [self.burn_in_segmented(*job, progress) for job in jobs]
+        else:
+            handler = self.mux if self.config.mode == "mux" else self.burn_in
+            with progress, ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                results = list(executor.map(lambda job: handler(*job, progress), jobs))
+
+        failed = [job[0].name for job, ok in zip(jobs, results) if not ok]
+        if failed:
+            LOGGER.error(f"压制失败: {failed}")
+
+    def run(self):
+        TIME_RECORDER.reset()
+        self.burn_in_all()
+        TIME_RECORDER.show()
@@ -0,0 +1,402 @@
+"""
+持久化的整文件任务队列。
+语音转文字、翻译和字幕生成任务写入SQLite，由常驻进程(websocket_server.py)或
+app.py --task worker 启动的工作进程中已加载的模型按优先级依次执行。
+
+多个工作进程(同一台或多台机器)可以共享同一个数据库文件。
+领取任务时获得一段租约，执行过程中定期续约(心跳)，
+工作进程崩溃后租约过期，任务会被其他工作进程重新领取。
+任务中的路径按原样保存，多台机器需要以相同的相对路径挂载共享目录。
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Optional
+
+from src.metrics import METRICS
+from src.utils import CONSOLE, LOGGER, extract_sound_from_video, filter_files
+
+# extract: 视频 -> 音频 | transcribe: 音频 -> .list | translate: .list -> 字幕 | generate: 视频或音频 -> .list -> 字幕
+JOB_KINDS = ("extract", "transcribe", "translate", "generate")
+# 任务状态
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+AUDIO_SUFFIXES = (".mp3", ".wav", ".flac", ".m4a", ".aac")
+
+JOBS_TOTAL = METRICS.counter("subgenie_jobs_total", "Finished whole-file jobs", ("kind", "status"))
+JOB_SECONDS = METRICS.histogram("subgenie_job_seconds", "Whole-file job run time", ("kind",))
+JOBS_RECLAIMED_TOTAL = METRICS.counter("subgenie_jobs_reclaimed_total", "Jobs claimed again after their lease expired")
+# 默认租约时长(秒)，心跳间隔为其三分之一
+DEFAULT_LEASE_SECONDS = 60.0
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+@dataclass
+class Job:
+    id: int
+    kind: str
+    payload: dict
+    # 数值越大越先执行，相同优先级按提交顺序
+    priority: int
+    status: str
+    # 0~100
+    progress: float
+    # 输出文件路径
+    result: str
+    error: str
+    created_at: float
+    updated_at: float
+    # 正在执行的工作进程
+    worker: str = ""
+    # 租约到期时间，到期前没有续约则可被重新领取
+    lease_until: float = 0.0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class JobQueue:
+    """
+    基于SQLite的优先级任务队列，线程安全，可被多个进程共享。
+    其他进程提交的任务无法通知到本进程，claim每隔poll_interval秒重新查询一次。
+    """
+
+    def __init__(self, db_path: str = "assets/jobs.db", poll_interval: float = 1.0):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.poll_interval = poll_interval
+        # 其他进程写入时最多等待30秒
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL,
+                    progress REAL NOT NULL DEFAULT 0,
+                    result TEXT NOT NULL DEFAULT '',
+                    error TEXT NOT NULL DEFAULT '',
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    worker TEXT NOT NULL DEFAULT '',
+                    lease_until REAL NOT NULL DEFAULT 0
+                )""")
+            # 旧版本创建的数据库没有租约字段
+            columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(jobs)")}
+            if "worker" not in columns:
+                self.conn.execute("ALTER TABLE jobs ADD COLUMN worker TEXT NOT NULL DEFAULT ''")
+            if "lease_until" not in columns:
+                self.conn.execute("ALTER TABLE jobs ADD COLUMN lease_until REAL NOT NULL DEFAULT 0")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, priority DESC, id)")
+            # 上次进程退出时正在执行的任务不再续约，租约到期后会被重新领取
+            expired = self.conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND lease_until < ?", (RUNNING, time.time())).fetchone()[0]
+        if expired:
+            LOGGER.info(f"{expired} unfinished jobs have expired leases and will be reclaimed")
+
+    @staticmethod
+    def _to_job(row: sqlite3.Row) -> Job:
+        return Job(**{**dict(row), "payload": json.loads(row["payload"])})
+
+    def submit(self, kind: str, payload: dict, priority: int = 0, unique: bool = False) -> Job:
+        """
+        提交任务。payload["next"]是后续阶段的任务类型列表，本阶段完成后以其输出文件提交下一阶段。
+        unique为True时，如果同类型同路径的任务正在排队或执行，直接返回该任务。
+        """
+        self._check_submit(kind, payload)
+        with self.not_empty, self.conn:
+            job_id = self._insert(kind, payload, priority, unique)
+            self.not_empty.notify()
+        return self.get(job_id)
+
+    @staticmethod
+    def _check_submit(kind: str, payload: dict):
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind: {kind}, expected one of {JOB_KINDS}")
+        if not Path(payload.get("path", "")).exists():
+            raise ValueError(f"File not found: {payload.get('path')}")
+
+    def _insert(self, kind: str, payload: dict, priority: int, unique: bool) -> int:
+        """在调用方的事务中插入任务，返回任务id。unique时返回已有的同类型同路径任务。"""
+        if unique:
+            row = self.conn.execute(
+                "SELECT id FROM jobs WHERE kind = ? AND json_extract(payload, '$.path') = ? AND status IN (?, ?)",
+                (kind, payload["path"], QUEUED, RUNNING)).fetchone()
+            if row is not None:
+                return row["id"]
+        now = time.time()
+        return self.conn.execute(
+            "INSERT INTO jobs (kind, payload, priority, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (kind, json.dumps(payload, ensure_ascii=False), priority, QUEUED, now, now)).lastrowid
+
+    def get(self, job_id: int) -> Optional[Job]:
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_job(row) if row else None
+
+    def list_jobs(self, status: str = "", limit: int = 100) -> list[Job]:
+        with self.lock:
+            if status:
+                rows = self.conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY id DESC LIMIT ?", (status, limit)).fetchall()
+            else:
+                rows = self.conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [self._to_job(row) for row in rows]
+
+    def count(self, status: str) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+
+    def claim(self, timeout: Optional[float] = None, worker: str = "",
+              lease_seconds: float = DEFAULT_LEASE_SECONDS) -> Optional[Job]:
+        """
+        取出优先级最高的排队任务(或租约已过期的执行中任务)，标记为由worker执行，租约为lease_seconds秒。
+        队列为空时最多等待timeout秒。
+        """
+        worker = worker or default_worker_id()
+        with self.not_empty:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while True:
+                now = time.time()
+                row = self.conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? OR (status = ? AND lease_until < ?) "
+                    "ORDER BY priority DESC, id LIMIT 1", (QUEUED, RUNNING, now)).fetchone()
+                if row is not None:
+                    # 其他进程可能同时选中了同一个任务，只有更新成功的一方领取到
+                    with self.conn:
+                        claimed = self.conn.execute(
+                            "UPDATE jobs SET status = ?, progress = 0, worker = ?, lease_until = ?, updated_at = ? "
+                            "WHERE id = ? AND (status = ? OR (status = ? AND lease_until < ?))",
+                            (RUNNING, worker, now + lease_seconds, now, row["id"], QUEUED, RUNNING, now)).rowcount
+                    if claimed:
+                        break
+                    continue
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.not_empty.wait(self.poll_interval if remaining is None else min(remaining, self.poll_interval))
+        if row["status"] == RUNNING:
+            JOBS_RECLAIMED_TOTAL.inc()
+            LOGGER.warning(f"Job {row['id']} reclaimed from {row['worker']} after its lease expired")
+        job = self._to_job(row)
+        job.status, job.progress, job.worker, job.lease_until = RUNNING, 0, worker, now + lease_seconds
+        return job
+
+    def heartbeat(self, job_id: int, worker: str, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> bool:
+        """续约，返回False表示租约已被其他工作进程取得或任务已结束。"""
+        now = time.time()
+        with self.lock, self.conn:
+            return self.conn.execute(
+                "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND worker = ? AND status = ?",
+                (now + lease_seconds, now, job_id, worker, RUNNING)).rowcount > 0
+
+    def update(self, job_id: int, owner: str = "", **fields) -> bool:
+        """更新任务字段。owner不为空时只有该工作进程仍持有租约才会更新，返回是否更新成功。"""
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{key} = ?" for key in fields)
+        with self.lock, self.conn:
+            if owner:
+                return self.conn.execute(
+                    f"UPDATE jobs SET {columns} WHERE id = ? AND worker = ? AND status = ?",
+                    (*fields.values(), job_id, owner, RUNNING)).rowcount > 0
+            return self.conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id)).rowcount > 0
+
+    def complete(self, job_id: int, owner: str, result: str, next_kind: str = "",
+                 next_payload: Optional[dict] = None, priority: int = 0) -> tuple[bool, Optional[Job]]:
+        """
+        owner仍持有租约时把任务标记为完成，并在同一个事务中提交下一阶段的任务(next_kind不为空时)，
+        两者要么都成功，要么都不生效。返回(是否完成, 下一阶段任务)。
+        """
+        if next_kind:
+            self._check_submit(next_kind, next_payload)
+        next_id = None
+        with self.not_empty, self.conn:
+            updated = self.conn.execute(
+                "UPDATE jobs SET status = ?, progress = 100, result = ?, updated_at = ? "
+                "WHERE id = ? AND worker = ? AND status = ?",
+                (DONE, result, time.time(), job_id, owner, RUNNING)).rowcount > 0
+            if not updated:
+                return False, None
+            if next_kind:
+                next_id = self._insert(next_kind, next_payload, priority, unique=True)
+                self.not_empty.notify()
+        return True, self.get(next_id) if next_id is not None else None
+
+    def cancel(self, job_id: int) -> bool:
+        """只能取消还在排队的任务。"""
+        with self.lock, self.conn:
+            return self.conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (CANCELLED, time.time(), job_id, QUEUED)).rowcount > 0
+
+
+class JobWorker:
+    """
+    依次执行队列中的任务。start()在后台线程中运行，run()在当前线程中运行。
+    sub_genie应传入共享常驻模型的实例，on_event在任务状态或进度变化时调用(在工作线程中)。
+    执行任务期间每隔lease_seconds/3秒续约一次。
+    """
+
+    def __init__(self, job_queue: JobQueue, sub_genie, on_event: Optional[Callable[[Job], None]] = None,
+                 worker_id: str = "", lease_seconds: float = DEFAULT_LEASE_SECONDS):
+        self.job_queue = job_queue
+        self.sub_genie = sub_genie
+        self.on_event = on_event
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def run(self, idle_exit: bool = False):
+        """循环领取并执行任务。idle_exit为True时队列为空就返回。"""
+        LOGGER.info(f"Worker {self.worker_id} started")
+        while not self._stop.is_set():
+            job = self.job_queue.claim(timeout=1, worker=self.worker_id, lease_seconds=self.lease_seconds)
+            if job is not None:
+                self.run_job(job)
+            elif idle_exit:
+                break
+
+    def _emit(self, job_id: int, **fields) -> bool:
+        updated = self.job_queue.update(job_id, owner=self.worker_id, **fields)
+        if updated and self.on_event is not None:
+            self.on_event(self.job_queue.get(job_id))
+        return updated
+
+    def _heartbeat(self, job_id: int, done: threading.Event):
+        while not done.wait(self.lease_seconds / 3):
+            if not self.job_queue.heartbeat(job_id, self.worker_id, self.lease_seconds):
+                LOGGER.warning(f"Job {job_id} lease lost by {self.worker_id}")
+                return
+
+    def run_job(self, job: Job):
+        CONSOLE.print(f"[green]Job {job.id} {job.kind} start: {job.payload['path']}")
+        self._emit(job.id, progress=0)
+        last_progress = 0
+
+        def report(progress: float):
+            nonlocal last_progress
+            # 每变化1%才写库和推送一次
+            if progress - last_progress >= 1:
+                last_progress = progress
+                self._emit(job.id, progress=progress)
+
+        done = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(job.id, done), daemon=True).start()
+        start = time.perf_counter()
+        try:
+            result = self._execute(job, report)
+            done.set()
+            if self._complete(job, result):
+                JOBS_TOTAL.inc(kind=job.kind, status=DONE)
+                CONSOLE.print(f"[green]Job {job.id} {job.kind} done: {result}")
+            else:
+                LOGGER.warning(f"Job {job.id} finished after its lease was taken over, result discarded")
+        except Exception as e:
+            done.set()
+            traceback.print_exc()
+            self._emit(job.id, status=FAILED, error=str(e))
+            JOBS_TOTAL.inc(kind=job.kind, status=FAILED)
+        JOB_SECONDS.observe(time.perf_counter() - start, kind=job.kind)
+
+    def _complete(self, job: Job, result: Path) -> bool:
+        """
+        标记任务完成，同时以输出文件提交payload["next"]中的下一阶段任务。
+        两者在同一个事务中，提交失败(如数据库繁忙)时任务仍为执行中，由调用方标记为失败。
+        """
+        next_kinds = job.payload.get("next", [])
+        next_kind, next_payload = "", None
+        if next_kinds:
+            next_kind, next_payload = next_kinds[0], {"path": str(result), "next": next_kinds[1:]}
+        completed, next_job = self.job_queue.complete(
+            job.id, self.worker_id, str(result), next_kind, next_payload, job.priority)
+        if not completed:
+            return False
+        if self.on_event is not None:
+            self.on_event(self.job_queue.get(job.id))
+        if next_job is not None:
+            LOGGER.info(f"Job {job.id} -> job {next_job.id} {next_job.kind}: {result}")
+        return True
+
+    def _execute(self, job: Job, report: Callable[[float], None]) -> Path:
+        path = Path(job.payload["path"])
+        sub_genie = self.sub_genie
+        if job.kind == "extract":
+            return self._extract(path)
+        if job.kind == "transcribe":
+            return sub_genie.transcribe_file(path, lambda p: report(p * 100))
+        if job.kind == "translate":
+            return self._translate(path, lambda p: report(p * 100))
+
+        # generate: 提取音频(0~5) -> 语音转文字(5~80) -> 翻译(80~100)
+        if path.suffix.lower() not in AUDIO_SUFFIXES:
+            path = self._extract(path)
+        report(5)
+        list_path = sub_genie.transcribe_file(path, lambda p: report(5 + p * 75))
+        report(80)
+        if not sub_genie.can_translate:
+            return list_path
+        return self._translate(list_path, lambda p: report(80 + p * 20))
+
+    def _extract(self, video_path: Path) -> Path:
+        audio_path = self.sub_genie.audio_dir / (video_path.stem + '.wav')
+        if not audio_path.exists():
+            # 先写临时文件，避免其他工作进程读到不完整的音频
+            tmp_path = audio_path.with_stem(audio_path.stem + f'.{self.worker_id}.part')
+            extract_sound_from_video(video_path, tmp_path)
+            tmp_path.replace(audio_path)
+        return audio_path
+
+    def _translate(self, list_path: Path, on_progress: Callable[[float], None]) -> Path:
+        if not self.sub_genie.can_translate:
+            raise RuntimeError("Translation is disabled or the Dashscope api key is not set")
+        return self.sub_genie.translate_file(list_path, on_progress)
+
+
+def enqueue_directories(job_queue: JobQueue, config, translate: bool = True, priority: int = 0) -> list[Job]:
+    """
+    按SubGenieConfig的目录扫描还未处理的文件，为每个文件提交从当前阶段开始的任务链:
+    视频(无音频) -> extract -> transcribe -> translate，音频(无.list) -> transcribe -> translate，
+    .list(无字幕) -> translate。只处理视频目录中有对应视频的文件，与batch_generate一致。
+    已在排队或执行中的同一文件不会重复提交。
+    """
+    video_files = filter_files(config.video_dir, config.video_filter)
+    audio_files = {f.stem: f for f in filter_files(config.audio_dir, config.audio_filter)}
+    list_files = {f.stem: f for f in filter_files(config.asr_dir, config.asr_filter) if not f.stem.endswith("_zh")}
+    subtitle_stems = {f.stem for f in filter_files(config.video_dir, "srt,ass,vtt")}
+    tail = ["translate"] if translate else []
+
+    jobs = []
+    for video in video_files:
+        stem = video.stem
+        if stem in list_files:
+            if translate and stem not in subtitle_stems:
+                jobs.append(job_queue.submit("translate", {"path": str(list_files[stem]), "next": []},
+                                             priority, unique=True))
+        elif stem in audio_files:
+            jobs.append(job_queue.submit("transcribe", {"path": str(audio_files[stem]), "next": tail},
+                                         priority, unique=True))
+        elif not config.input_is_audio:
+            jobs.append(job_queue.submit("extract", {"path": str(video), "next": ["transcribe"] + tail},
+                                         priority, unique=True))
+    return jobs
@@ -0,0 +1,241 @@
+"""
+实时音频流识别。
+客户端持续发送16kHz单声道PCM，LiveTranscriber维护滚动缓冲区并反复识别，
+相邻两次识别结果中一致的前缀(LocalAgreement-2)才会作为确认的单词输出。
+
+本地测试(需先启动websocket_server.py):
+python -m src.live_asr --wav-path assets/audio/test.m4a
+"""
+import asyncio
+import base64
+import json
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import tyro
+
+from src.utils import CONSOLE, SAMPLE_RATE
+from src.whisper_asr import WhisperAsrConfig
+
+# 单词格式与transcribe_audio_slice_words一致: (word, start, end)
+LiveWord = tuple[str, float, float]
+
+
+@dataclass
+class LiveAsrConfig:
+    # 新音频累积到多少秒才进行一次识别
+    min_chunk_seconds: float = 1.0
+    # 缓冲区超过多少秒时，在最后一个已确认单词处裁剪
+    buffer_trim_seconds: float = 15.0
+    # 作为提示词的已确认文本的最大字符数
+    prompt_chars: int = 200
+
+
+def pcm16_to_float(pcm: bytes) -> np.ndarray:
+    """16位小端PCM转为whisper使用的float32。"""
+    return np.frombuffer(pcm, dtype="<i2").astype(np.float32) / 32768.0
+
+
+def float_to_pcm16(audio: np.ndarray) -> bytes:
+    return (np.clip(audio, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+
+class HypothesisBuffer:
+    """LocalAgreement-2: 只确认连续两次识别结果的公共前缀。"""
+
+    def __init__(self):
+        # 已确认且音频仍在缓冲区中的单词，用于去掉新结果中重复的开头
+        self.committed_in_buffer: list[LiveWord] = []
+        # 上一次识别中未确认的部分
+        self.buffer: list[LiveWord] = []
+        self.last_committed_time = 0.0
+
+    def insert(self, words: list[LiveWord]) -> list[LiveWord]:
+        """插入新的识别结果，返回新确认的单词。"""
+        new = [w for w in words if w[1] > self.last_committed_time - 0.1]
+        # 缓冲区开头的音频已经确认过，whisper可能再次输出，去掉与已确认结尾重复的1~5个单词
+        if new and self.committed_in_buffer and abs(new[0][1] - self.last_committed_time) < 1:
+            for n in range(min(len(self.committed_in_buffer), len(new), 5), 0, -1):
+                committed_tail = [w[0].strip() for w in self.committed_in_buffer[-n:]]
+                if committed_tail == [w[0].strip() for w in new[:n]]:
+                    new = new[n:]
+                    break
+
+        commit = []
+        for prev, curr in zip(self.buffer, new):
+            if prev[0].strip() != curr[0].strip():
+                break
+            commit.append(curr)
+        if commit:
+            self.last_committed_time = commit[-1][2]
+        self.buffer = new[len(commit):]
+        self.committed_in_buffer.extend(commit)
+        return commit
+
+    def pop_committed(self, time: float):
+        """音频裁剪后，丢弃已经不在缓冲区内的已确认单词。"""
+        self.committed_in_buffer = [w for w in self.committed_in_buffer if w[2] > time]
+
+
+class LiveTranscriber:
+    """
+    滚动缓冲区的增量识别，不是线程安全的，同一实例的调用需串行。
+    model为WhisperAsr.model，与文件识别共享同一个模型和WhisperAsrConfig。
+    """
+
+    def __init__(self, model, asr_config: WhisperAsrConfig = WhisperAsrConfig(),
+                 config: LiveAsrConfig = LiveAsrConfig()):
+        self.model = model
+        self.asr_config = asr_config
+        self.config = config
+        self.audio = np.zeros(0, dtype=np.float32)
+        # 缓冲区开头在整个音频流中的时间
+        self.buffer_offset = 0.0
+        # 上次识别后新增的采样数
+        self.unprocessed = 0
+        self.hypothesis = HypothesisBuffer()
+        self.committed: list[LiveWord] = []
+
+    def insert_audio(self, audio: np.ndarray):
+        self.audio = np.concatenate([self.audio, audio.astype(np.float32, copy=False)])
+        self.unprocessed += len(audio)
+
+    def prompt(self) -> str:
+        """已经移出缓冲区的确认文本作为提示词，保持上下文连贯。"""
+        text = "".join(w[0] for w in self.committed if w[2] <= self.buffer_offset)
+        return (self.asr_config.prompt + text[-self.config.prompt_chars:]).strip()
+
+    def process_iter(self, force: bool = False) -> list[LiveWord]:
+        """新音频足够时识别一次缓冲区，返回新确认的单词。"""
+        if len(self.audio) == 0:
+            return []
+        if not force and self.unprocessed < self.config.min_chunk_seconds * SAMPLE_RATE:
+            return []
+        self.unprocessed = 0
+
+        segments, _ = self.model.transcribe(
+            self.audio, word_timestamps=True, condition_on_previous_text=False,
+            initial_prompt=self.prompt(), task=self.asr_config.task)
+        words = [(word.word, word.start + self.buffer_offset, word.end + self.buffer_offset)
+                 for segment in segments for word in segment.words]
+
+        commit = self.hypothesis.insert(words)
+        self.committed.extend(commit)
+        self.trim_buffer()
+        return commit
+
+    def trim_buffer(self):
+        trim_samples = int(self.config.buffer_trim_seconds * SAMPLE_RATE)
+        if len(self.audio) <= trim_samples:
+            return
+        if not self.hypothesis.committed_in_buffer:
+            # 长时间静音、音乐或识别结果不稳定时没有可以确认的单词，
+            # 仍然丢弃窗口之前的音频，否则缓冲区无限增长，每次识别越来越慢
+            cut = len(self.audio) - trim_samples
+            self.audio = self.audio[cut:]
+            self.buffer_offset += cut / SAMPLE_RATE
+            # 未确认的结果对应的音频可能已被丢弃，下次重新识别
+            self.hypothesis.buffer = []
+            return
+        trim_time = self.hypothesis.committed_in_buffer[-1][2]
+        # 优先在句子结尾处裁剪
+        for word in reversed(self.hypothesis.committed_in_buffer):
+            if word[0].strip()[-1:] in (".", "?", "!"):
+                trim_time = word[2]
+                break
+        cut = int((trim_time - self.buffer_offset) * SAMPLE_RATE)
+        if cut <= 0:
+            return
+        self.audio = self.audio[cut:]
+        self.buffer_offset = trim_time
+        self.hypothesis.pop_committed(trim_time)
+
+    def finish(self) -> list[LiveWord]:
+        """音频流结束，对剩余音频再识别一次，并确认所有未确认的单词。"""
+        commit = self.process_iter(force=self.unprocessed > 0)
+        rest = self.hypothesis.buffer
+        self.hypothesis.buffer = []
+        self.committed.extend(rest)
+        return commit + rest
+
+
+@dataclass
+class LiveClientConfig:
+    """以实时速度把音频文件推流到websocket服务器的live_asr任务，用于测试"""
+
+    # 音频或视频文件，会被解码为16kHz单声道
+    wav_path: str = 'assets/audio/test.m4a'
+    # 服务器地址
+    url: str = 'ws://localhost:5000'
+    # 每次发送的音频秒数
+    chunk_seconds: float = 0.5
+    # 播放速度倍率，1为实时
+    speed: float = 1.0
+    # 使用msgpack二进制协议
+    msgpack: bool = True
+
+
+async def stream_file(config: LiveClientConfig):
+    import websockets
+    from faster_whisper.audio import decode_audio
+
+    if config.msgpack:
+        import msgpack
+        subprotocols = ["subgenie.msgpack"]
+        encode, decode = msgpack.packb, msgpack.unpackb
+    else:
+        subprotocols = ["subgenie.json"]
+        encode, decode = json.dumps, json.loads
+
+    audio = decode_audio(config.wav_path, SAMPLE_RATE)
+    chunk = int(config.chunk_seconds * SAMPLE_RATE)
+    task_id = f"live-{int(time.time())}"
+
+    async with websockets.connect(config.url, subprotocols=subprotocols, max_size=None) as ws:
+        async def send_audio():
+            await ws.send(encode({"type": "live_asr", "task_id": task_id, "payload": {}}))
+            start = time.perf_counter()
+            for i in range(0, len(audio), chunk):
+                pcm = float_to_pcm16(audio[i:i+chunk])
+                await ws.send(encode({
+                    "type": "live_asr_audio", "task_id": task_id,
+                    "payload": pcm if config.msgpack else base64.b64encode(pcm).decode(),
+                }))
+                # 按实时速度发送
+                delay = start + (i + chunk) / SAMPLE_RATE / config.speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await ws.send(encode({"type": "live_asr_end", "task_id": task_id, "payload": {}}))
+
+        sender = asyncio.create_task(send_audio())
+        start = time.perf_counter()
+        async for msg in ws:
+            msg = decode(msg)
+            if msg.get("task_id") != task_id:
+                continue
+            if msg["type"] == "error":
+                CONSOLE.print(f"[red]{msg['data']}")
+                break
+            words = msg.get("partial") if msg["task_progress"] != 100 else msg.get("data")
+            if words is None:
+                continue
+            if isinstance(words, dict):
+                timings = np.frombuffer(words["timings"], dtype="<f4").reshape(-1, 2)
+                words = [(w, float(s), float(e)) for w, (s, e) in zip(words["words"], timings)]
+            else:
+                words = json.loads(words)
+            if msg["task_progress"] == 100:
+                CONSOLE.rule("Transcript")
+                CONSOLE.print("".join(w[0] for w in words).strip())
+                break
+            if words:
+                # 延迟: 确认单词的结尾时间与当前已发送音频时间的差
+                latency = (time.perf_counter() - start) * config.speed - words[-1][2]
+                CONSOLE.print(f"[green][{words[0][1]:.2f}->{words[-1][2]:.2f}][/green]"
+                              f"{''.join(w[0] for w in words)} [dim](latency {latency:.2f}s)")
+        await sender
+
+
+if __name__ == '__main__':
+    asyncio.run(stream_file(tyro.cli(LiveClientConfig)))
@@ -0,0 +1,48 @@
+import ctranslate2
+from transformers import AutoTokenizer
+
+from src.metrics import record_model_load
+from src.utils import LOGGER
+
+
+class LocalTranslator:
+    """
+    基于CTranslate2的本地机器翻译。
+    模型需事先用ct2-transformers-converter转换，例如:
+    ct2-transformers-converter --model Helsinki-NLP/opus-mt-en-zh --output_dir models/opus-mt-en-zh --copy_files tokenizer_config.json source.spm target.spm vocab.json
+    """
+
+    def __init__(self, model_path: str, device: str = "cpu", compute_type: str = "int8",
+                 inter_threads: int = 1, intra_threads: int = 0,
+                 target_prefix: str = "", source_code: str = ""):
+        with record_model_load(model_path):
+            self.model = ctranslate2.Translator(
+                model_path, device=device, compute_type=compute_type,
+                inter_threads=inter_threads, intra_threads=intra_threads)
+            self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        # NLLB/M2M100等多语言模型需要指定源语言码和目标语言前缀
+        if source_code:
+            self.tokenizer.src_lang = source_code
+        self.target_prefix = target_prefix
+        LOGGER.debug(f"Local translate model loaded: {model_path}")
+
+    def translate_batch(self, texts: list[str], batch_size: int = 32, beam_size: int = 2) -> list[str]:
+        """批量翻译，返回结果与输入逐行对应。"""
+        if not texts:
+            return []
+
+        source_tokens = [self.tokenizer.convert_ids_to_tokens(self.tokenizer.encode(text)) for text in texts]
+        target_prefix = [[self.target_prefix]] * len(texts) if self.target_prefix else None
+        # max_batch_size会让CTranslate2先按长度排序再分批，减少padding
+        results = self.model.translate_batch(
+            source_tokens, target_prefix=target_prefix,
+            max_batch_size=batch_size, beam_size=beam_size)
+
+        translations = []
+        for result in results:
+            tokens = result.hypotheses[0]
+            if self.target_prefix:
+                tokens = tokens[1:]
+            translations.append(self.tokenizer.decode(
+                self.tokenizer.convert_tokens_to_ids(tokens), skip_special_tokens=True))
+        return translations
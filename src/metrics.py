@@ -0,0 +1,245 @@
+"""
+运行指标: 计数器、瞬时值和直方图，以Prometheus文本格式通过本地HTTP端口暴露，
+也可以用snapshot()得到可json序列化的字典(websocket的metrics任务)。
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+from src.tracing import TRACER
+from src.utils import LOGGER
+
+# 延迟类指标的默认分桶(秒)
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _label_key(labelnames: tuple, labels: dict) -> tuple:
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _format_labels(labelnames: tuple, key: tuple, extra: str = "") -> str:
+    pairs = ['%s="%s"' % (name, value.replace("\\", "\\\\").replace('"', '\\"'))
+             for name, value in zip(labelnames, key)]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+    def snapshot(self) -> list[dict]:
+        with self._lock:
+            return [{"labels": dict(zip(self.labelnames, key)), "value": value}
+                    for key, value in self._values.items()]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        super().__init__(name, help, labelnames)
+        # 无标签的gauge可以在采集时调用函数取值
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float]):
+        self._function = function
+
+    def _collect(self):
+        if self._function is None:
+            return
+        try:
+            value = self._function()
+        except Exception:
+            return
+        with self._lock:
+            self._values[()] = value
+
+    def render(self) -> list[str]:
+        self._collect()
+        return super().render()
+
+    def snapshot(self) -> list[dict]:
+        self._collect()
+        return super().snapshot()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            # [各分桶计数(非累计)..., +Inf分桶计数, sum]
+            state = self._values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            state[bisect.bisect_left(self.buckets, value)] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            for key, state in self._values.items():
+                cumulative = 0
+                for le, count in zip(self.buckets + ("+Inf",), state[:-1]):
+                    cumulative += count
+                    bucket_labels = _format_labels(self.labelnames, key, 'le="%s"' % le)
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {state[-1]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+    def snapshot(self) -> list[dict]:
+        with self._lock:
+            result = []
+            for key, state in self._values.items():
+                counts = state[:-1]
+                result.append({
+                    "labels": dict(zip(self.labelnames, key)),
+                    "count": sum(counts),
+                    "sum": state[-1],
+                    "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], counts)),
+                })
+            return result
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        # 同名指标只创建一次，多个模块可以各自声明
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, *args, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name: str, help: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: tuple = ()) -> Gauge:
+        return self._register(Gauge, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help, labelnames, buckets)
+
+    def render(self) -> str:
+        """Prometheus文本格式。"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        return {name: {"type": metric.type, "values": metric.snapshot()}
+                for name, metric in list(self._metrics.items())}
+
+
+METRICS = MetricsRegistry()
+
+
+def process_rss_bytes() -> int:
+    """当前进程常驻内存，优先用psutil，否则读/proc，都不可用时返回0。"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, AttributeError, ValueError):
+        return 0
+
+
+METRICS.gauge("subgenie_process_rss_bytes", "Resident set size of the process").set_function(process_rss_bytes)
+MODEL_LOAD_SECONDS = METRICS.gauge("subgenie_model_load_seconds", "Time spent loading each model", ("model",))
+AUDIO_CACHE_TOTAL = METRICS.counter("subgenie_audio_cache_total", "load_audio calls by cache result", ("result",))
+VAD_CACHE_TOTAL = METRICS.counter("subgenie_vad_cache_total", "Speech map lookups by cache result", ("result",))
+
+
+@contextmanager
+def record_model_load(model: str):
+    """记录模型加载耗时。"""
+    start = time.perf_counter()
+    with TRACER.span("model_load", model=model):
+        yield
+    cost = time.perf_counter() - start
+    MODEL_LOAD_SECONDS.set(cost, model=model)
+    LOGGER.debug(f"Model loaded in {cost:.2f}s: {model}")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = METRICS.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """在后台线程中提供 http://host:port/metrics 。"""
+    httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    LOGGER.info(f"Metrics server listening on http://{host}:{port}/metrics")
+    return httpd
@@ -0,0 +1,148 @@
+"""
+标点恢复模型的推理引擎。
+- transformers: deepmultilingualpunctuation.PunctuationModel，HuggingFace pipeline全精度推理
+- onnx: 导出为ONNX并int8动态量化，用ONNX Runtime在CPU上推理，接口与PunctuationModel相同
+
+导出(在仓库根目录运行):
+python -m src.punctuation --model models/oliverguhr-fullstop-punctuation-multilang-large --output-dir models/fullstop-punctuation-multilang-large-onnx
+"""
+import json
+import shutil
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import onnxruntime as ort
+import tyro
+from deepmultilingualpunctuation import PunctuationModel
+from transformers import AutoTokenizer
+
+from src.utils import LOGGER
+
+PUNCTUATION_ENGINES = ("transformers", "onnx")
+ONNX_MODEL_FILE = "model.onnx"
+
+
+class OnnxPunctuationModel(PunctuationModel):
+    """
+    用ONNX Runtime推理的PunctuationModel。
+    分块、每个单词取最后一个子词的标签、输出文本的规则都与PunctuationModel一致，
+    restore_punctuation等方法直接继承。
+    """
+
+    def __init__(self, model_dir: str, intra_threads: int = 0):
+        # 不调用父类的__init__，不创建transformers pipeline
+        model_dir = Path(model_dir)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_threads:
+            options.intra_op_num_threads = intra_threads
+        self.session = ort.InferenceSession(
+            str(model_dir / ONNX_MODEL_FILE), options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        with (model_dir / "config.json").open("r", encoding="utf-8") as f:
+            self.id2label = {int(k): v for k, v in json.load(f)["id2label"].items()}
+
+    def predict(self, words: list[str]) -> list[list]:
+        """返回[[word, label, score], ...]，label为 0 . , ? - : 之一。"""
+        if not words:
+            return []
+        overlap = 5
+        chunk_size = 230
+        if len(words) <= chunk_size:
+            overlap = 0
+
+        batches = list(self.overlap_chunks(words, chunk_size, overlap))
+        # 最后一块比重叠部分还短时，上一块已经覆盖了它
+        if len(batches[-1]) <= overlap:
+            batches.pop()
+
+        tagged_words = []
+        for i, batch in enumerate(batches):
+            # 最后一块全部使用
+            keep = len(batch) if i == len(batches) - 1 else len(batch) - overlap
+            encoding = self.tokenizer(batch, is_split_into_words=True, return_tensors="np")
+            feeds = {name: encoding[name].astype(np.int64) for name in self.input_names}
+            logits = self.session.run(None, feeds)[0][0]
+            probs = np.exp(logits - logits.max(axis=-1, keepdims=True))
+            probs /= probs.sum(axis=-1, keepdims=True)
+
+            # 每个单词取最后一个子词的预测
+            last_token = {}
+            for token_index, word_index in enumerate(encoding.word_ids(0)):
+                if word_index is not None:
+                    last_token[word_index] = token_index
+            for word_index, word in enumerate(batch[:keep]):
+                token_index = last_token.get(word_index)
+                if token_index is None:
+                    tagged_words.append([word, "0", 0.0])
+                    continue
+                label_id = int(probs[token_index].argmax())
+                tagged_words.append([word, self.id2label[label_id], float(probs[token_index, label_id])])
+
+        assert len(tagged_words) == len(words)
+        return tagged_words
+
+
+def load_punctuation_model(model_path: str, engine: str = "transformers", intra_threads: int = 0) -> PunctuationModel:
+    if engine == "transformers":
+        return PunctuationModel(model_path)
+    if engine == "onnx":
+        if not (Path(model_path) / ONNX_MODEL_FILE).exists():
+            raise FileNotFoundError(f"{model_path}/{ONNX_MODEL_FILE} not found, export it with: python -m src.punctuation")
+        return OnnxPunctuationModel(model_path, intra_threads)
+    raise ValueError(f"Invalid punctuation engine: {engine}, expected one of {PUNCTUATION_ENGINES}")
+
+
+@dataclass
+class ExportConfig:
+    """把标点模型导出为ONNX(默认int8动态量化)"""
+
+    # transformers格式的标点模型文件夹或HuggingFace模型名
+    model: str = "models/oliverguhr-fullstop-punctuation-multilang-large"
+    # 输出文件夹
+    output_dir: str = "models/fullstop-punctuation-multilang-large-onnx"
+    # int8动态量化(权重int8，激活在推理时量化)，否则保留float32
+    quantize: bool = True
+    # ONNX opset版本
+    opset: int = 14
+
+
+def export_onnx(config: ExportConfig):
+    # 只有导出时需要torch
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModelForTokenClassification
+
+    output_dir = Path(config.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(config.model)
+    model = AutoModelForTokenClassification.from_pretrained(config.model).eval()
+    sample = tokenizer(["so", "let's", "open", "the", "project"], is_split_into_words=True, return_tensors="pt")
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in ("input_ids", "attention_mask", "logits")}
+
+    # large模型的float32权重超过2GB，会拆成多个外部数据文件，先导出到临时目录
+    with tempfile.TemporaryDirectory(dir=output_dir.parent) as tmp_dir:
+        fp32_path = Path(tmp_dir) / ONNX_MODEL_FILE
+        with torch.no_grad():
+            torch.onnx.export(
+                model, (sample["input_ids"], sample["attention_mask"]), str(fp32_path),
+                input_names=["input_ids", "attention_mask"], output_names=["logits"],
+                dynamic_axes=dynamic_axes, opset_version=config.opset)
+        LOGGER.info(f"Exported float32 ONNX model to {fp32_path}")
+
+        if config.quantize:
+            quantize_dynamic(str(fp32_path), str(output_dir / ONNX_MODEL_FILE), weight_type=QuantType.QInt8)
+            LOGGER.info(f"Quantized int8 ONNX model saved to {output_dir / ONNX_MODEL_FILE}")
+        else:
+            for path in Path(tmp_dir).iterdir():
+                shutil.move(str(path), output_dir / path.name)
+
+    tokenizer.save_pretrained(output_dir)
+    model.config.save_pretrained(output_dir)
+
+
+if __name__ == "__main__":
+    export_onnx(tyro.cli(ExportConfig))
@@ -1,14 +1,17 @@
-import re
+import queue
+import threading
 import warnings
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Union
+from typing import Callable, Optional, Union
 
 import dashscope
 
-from src.translator import Translator, TranslatorConfig
-from src.utils import (ASS_TEMPLAT, CONSOLE, LOGGER, extract_sound_from_video,
-                       filter_files, get_timestamp)
+from src.subtitle import SubtitleDocument, write_ass_tracks
+from src.tracing import TRACER
+from src.translator import Translator, TranslatorConfig, language_file_code
+from src.utils import (CONSOLE, LOGGER, PROGRESS, extract_sound_from_video,
+                       filter_files)
 from src.whisper_asr import WhisperAsr, WhisperAsrConfig
 from src.youtube_downloader import DownloadConfig, YoutubeDownloader
 
@@ -19,7 +22,7 @@ warnings.filterwarnings('ignore')
 class SubGenieConfig:
     """SubGenie, 一个双语字幕生成工具"""
 
-    # 任务类型(download | generate | continue)
+    # 任务类型(download | generate | continue | cover | stream | enqueue | worker)
     task: str = 'generate'
     # 输入视频目录
     video_dir: str = "assets/video"
@@ -33,7 +36,7 @@ class SubGenieConfig:
     asr_dir: str = "assets/asr_output"
     # ASR输出文件过滤器
     asr_filter: str = 'list'
-    # 输出字幕文件类型 srt | ass
+    # 输出字幕文件类型 srt | ass | vtt
     subtitle_type: str = 'ass'
     # 直接从已有音频开始，不需要从视频中提取这一步
     input_is_audio: bool = False
@@ -47,19 +50,36 @@ class SubGenieConfig:
     translator: TranslatorConfig = field(default_factory=TranslatorConfig)
     # Youtube下载配置
     youtube_downloader: DownloadConfig = field(default_factory=DownloadConfig)
+    # 保存Chrome trace格式的分阶段耗时，为空则不记录。可在 https://ui.perfetto.dev 中查看
+    trace_path: str = ''
+    # 日志级别 DEBUG | INFO | WARNING | ERROR
+    log_level: str = 'DEBUG'
+    # 多个目标语言(--translator.tgt-langs)时，写入同一个ass文件的不同样式，否则每种语言一个字幕文件(xx.ja.ass)
+    multi_lang_tracks: bool = False
+    # 无界面模式: 关闭Rich输出，日志以纯文本写到stderr，stdout输出JSON lines进度事件
+    headless: bool = False
+    # 任务队列数据库，enqueue和worker任务使用。多台机器共享时放在共享目录中
+    job_db: str = "assets/jobs.db"
+    # 工作进程名称，为空则使用 主机名-进程号
+    worker_id: str = ''
+    # 任务租约时长(秒)，工作进程崩溃后超过该时长任务会被重新领取
+    lease_seconds: float = 60.0
+    # 队列为空时工作进程退出，否则一直等待新任务
+    worker_idle_exit: bool = False
 
 
 class SubGenie:
-    def __init__(self, config: SubGenieConfig = SubGenieConfig()):
+    def __init__(self, config: SubGenieConfig = SubGenieConfig(), whisper_asr: Optional[WhisperAsr] = None):
+        """whisper_asr可以传入已加载模型的实例，常驻进程中避免重复加载模型。"""
         self.config = config
         self._check_config()
         self.translator = Translator(config.translator)
-        self.whisper_asr = WhisperAsr(config.whisper_asr)
+        self.whisper_asr = whisper_asr or WhisperAsr(config.whisper_asr)
     
     def download_video(self):
         downloader = YoutubeDownloader(self.config.youtube_downloader)
         downloader.run()
-    
+
     def batch_generate(self):
         """
         批量处理视频文件，包括提取音频、语音转文字和字幕翻译。
@@ -82,7 +102,10 @@ class SubGenie:
             for file in video_files_need_extract:
                 CONSOLE.print(f'[green]提取音频: {file.name}')
                 extracted_audio_path = self.audio_dir / (file.stem + '.wav')
-                extract_sound_from_video(file, extracted_audio_path)
+                PROGRESS.emit(file.stem, "extract_audio", 0, 1)
+                with TRACER.span("extract_audio", file=file.stem):
+                    extract_sound_from_video(file, extracted_audio_path)
+                PROGRESS.emit(file.stem, "extract_audio", 1, 1)
                 audio_files.append(extracted_audio_path)
         
         CONSOLE.rule('语音转文字')
@@ -91,21 +114,14 @@ class SubGenie:
                     and file.stem in [f.stem for f in video_files])
         audio_files = list(filter(filter_audio_file, audio_files))
         for file in audio_files:
-            CONSOLE.print(f'[green]语音转文字: {file.as_posix()}')
-            self.whisper_asr.load_audio(file.as_posix())
-            subtitle_line_lst = self.whisper_asr.transcribe_audio_full()
-            asr_output_path = self.asr_output_dir / (file.stem + '.list')
-            with asr_output_path.open("w", encoding="utf-8") as f:
-                for line in subtitle_line_lst:
-                    f.write("[%.2f->%.2f]%s\n" % (line.start, line.end, line.text))
-            asr_output_files.append(asr_output_path)
+            asr_output_files.append(self.transcribe_file(file))
 
-        translated_files = filter_files(self.video_dir, "srt,ass")
+        translated_files = filter_files(self.video_dir, "srt,ass,vtt")
         def filter_list_file(file: Path) -> bool:
             return (file.stem not in [f.stem for f in translated_files] 
                     and file.stem in [f.stem for f in video_files])
         asr_output_files = list(filter(filter_list_file, asr_output_files))
-        if self.config.skip_translate or not dashscope.api_key:
+        if not self.can_translate:
             return
             if not dashscope.api_key:
                 LOGGER.warning("Dashscope api key not set, skip translate")
@@ -118,11 +134,79 @@ class SubGenie:
         for file in asr_output_files:
             if file.stem.endswith("_zh"):
                 continue
-            CONSOLE.print(f'[green]字幕翻译: {file.name}')
-            self._write_subtitle(
-                self.translator.translate_file(file), 
-                self.video_dir / (file.stem + '.' + self.config.subtitle_type)
-            )
+            self.translate_file(file)
+
+    def stream_generate(self):
+        """
+        下载与字幕生成的流水线。
+        每个视频的音频流下载完成后立即交给语音转文字和翻译，不等待视频流下载、合并和音频提取。
+        视频流的下载与合并在后台线程中同时进行。
+        """
+        audio_queue = queue.Queue()
+        downloader = YoutubeDownloader(self.config.youtube_downloader, on_audio_ready=audio_queue.put)
+
+        def download():
+            try:
+                downloader.run()
+            finally:
+                audio_queue.put(None)
+
+        download_thread = threading.Thread(target=download, daemon=True)
+        download_thread.start()
+        while (audio_path := audio_queue.get()) is not None:
+            asr_output_path = self.asr_output_dir / (audio_path.stem + '.list')
+            if not asr_output_path.exists():
+                self.transcribe_file(audio_path)
+            subtitle_path = self.video_dir / (audio_path.stem + '.' + self.config.subtitle_type)
+            if self.can_translate and not subtitle_path.exists():
+                self.translate_file(asr_output_path)
+        download_thread.join()
+
+    def transcribe_file(self, audio_path: Path, on_progress: Optional[Callable[[float], None]] = None) -> Path:
+        """语音转文字，结果写入asr_output_dir下的同名.list文件并返回其路径。"""
+        CONSOLE.print(f'[green]语音转文字: {audio_path.as_posix()}')
+        with TRACER.span("transcribe", file=audio_path.stem):
+            self.whisper_asr.load_audio(audio_path.as_posix())
+            duration = self.whisper_asr.audio_duration
+
+            def report(progress: float):
+                PROGRESS.emit(audio_path.stem, "transcribe", progress * duration, duration, "audio_s")
+                if on_progress is not None:
+                    on_progress(progress)
+
+            PROGRESS.emit(audio_path.stem, "transcribe", 0, duration, "audio_s")
+            subtitle_line_lst = self.whisper_asr.transcribe_audio_full(report)
+            PROGRESS.emit(audio_path.stem, "transcribe", duration, duration, "audio_s")
+            asr_output_path = self.asr_output_dir / (audio_path.stem + '.list')
+            with asr_output_path.open("w", encoding="utf-8") as f:
+                for line in subtitle_line_lst:
+                    f.write("[%.2f->%.2f]%s\n" % (line.start, line.end, line.text))
+        # 翻译和处理下一个文件时不再占用音频内存
+        self.whisper_asr.unload_audio()
+        return asr_output_path
+
+    def translate_file(self, asr_output_path: Path,
+                       on_progress: Optional[Callable[[float], None]] = None) -> Path:
+        """翻译.list文件，字幕写入video_dir并返回其路径。on_progress参数为进度(0~1)。"""
+        CONSOLE.print(f'[green]字幕翻译: {asr_output_path.name}')
+        subtitle_path = self.video_dir / (asr_output_path.stem + '.' + self.config.subtitle_type)
+
+        def report(done: int, total: int):
+            PROGRESS.emit(asr_output_path.stem, "translate", done, total, "lines")
+            if on_progress is not None and total:
+                on_progress(done / total)
+
+        with TRACER.span("translate", file=asr_output_path.stem, api=self.config.translator.translate_api):
+            translated_line_lsts = self.translator.translate_file_multi(asr_output_path, report)
+            with TRACER.span("write_subtitle"):
+                self._write_language_subtitles(translated_line_lsts, subtitle_path)
+        return subtitle_path
+
+    @property
+    def can_translate(self) -> bool:
+        # 只有qwen需要Dashscope api key，local等后端不受影响
+        need_api_key = self.config.translator.translate_api == "qwen"
+        return not self.config.skip_translate and not (need_api_key and not dashscope.api_key)
     
     def continue_generate(self):
         """
@@ -142,108 +226,47 @@ class SubGenie:
                 continue
 
             CONSOLE.print(f'[green]合并翻译结果: {file.name}')
+            doc = SubtitleDocument.from_list_file(raw_file)
             with file.open("r", encoding="utf-8") as f:
-                translation = f.read().strip()
-            with raw_file.open("r", encoding="utf-8") as f:
-                raw_line_lst = f.read().strip().splitlines()
-
-            # final_srt_path = self.video_dir / (raw_file.stem + '.' + self.config.subtitle_type)
-            # self._write_ass_subtitle(raw_line_lst, translation.splitlines(), final_srt_path)
-            
-            # 合并翻译结果
-            pattern = re.compile(r"\[\d+\.\d+->\d+\.\d+\]")
-            translated_subtitles = re.split(pattern, translation)[1:]
-            if len(translated_subtitles) != len(raw_line_lst):
-                CONSOLE.print(f'[red]翻译结果数量不匹配: {file.name}')
-                continue
-            
-            for i in range(len(raw_line_lst)):
-                raw_line_lst[i] = raw_line_lst[i].strip() + r"@@@" + \
-                    translated_subtitles[i].strip() + "\n"
-
-            self._write_subtitle(raw_line_lst, final_srt_path)
+                alignment = doc.align(f.read())
+            if alignment.missing:
+                # 只标记确实缺失的行，其余行照常合并
+                CONSOLE.print(f'[red]{file.name} 缺少{len(alignment.missing)}行译文: ' +
+                              " ".join("%.2f" % doc.starts[k] for k in alignment.missing))
+            doc = SubtitleDocument(doc.starts, doc.ends, doc.source_texts, alignment.filled())
+            doc.write(final_srt_path, self.config.only_tgt)
     
     # 利用ass格式的能力，将中英字幕分开写。可以避免AI翻译吞行导致的错位。
     def _write_ass_subtitle(self, en_line_lst, zh_line_lst, srt_path):
         if srt_path.suffix != '.ass':
             return
         
-        pattern = re.compile(r"^\[(\d+\.\d+)->(\d+\.\d+)\](.*)$")
-        line_format_zh = "Dialogue: %d,%s,%s,ZH,,0,0,0,,%s\n"
-        line_format_en = "Dialogue: %d,%s,%s,EN,,0,0,0,,%s\n"
-        with srt_path.open("w", encoding="utf-8") as f:
-            if srt_path.suffix == '.ass':
-                f.write(ASS_TEMPLAT)
-            
-            for line in en_line_lst: # 文件中先出现的显示在下。
-                if line == "":
-                    continue
-
-                match = pattern.match(line.strip())
-                if match is None:
-                    # API翻译结果有时候会出现"\u200b"，导致正则匹配失败，去掉再试一次。
-                    line = line.replace("\u200b", "") 
-                    match = pattern.match(line.strip())
-                    if match is None:
-                        CONSOLE.print("[red]匹配失败: %s" % line)
-                        continue
-                start, end, text = match.groups()
-                f.write(line_format_en % (0, get_timestamp(start), get_timestamp(end), text))
-
-            for line in zh_line_lst:
-                if line == "":
-                    continue
-
-                match = pattern.match(line.strip())
-                if match is None:
-                    # API翻译结果有时候会出现"\u200b"，导致正则匹配失败，去掉再试一次。
-                    line = line.replace("\u200b", "") 
-                    match = pattern.match(line.strip())
-                    if match is None:
-                        CONSOLE.print("[red]匹配失败: %s" % line)
-                        continue
-                start, end, text = match.groups()
-                f.write(line_format_zh % (0, get_timestamp(start), get_timestamp(end), text))
-
+        # 文件中先出现的显示在下。
+        write_ass_tracks(srt_path, [
+            (SubtitleDocument.from_list_lines(en_line_lst), "EN"),
+            (SubtitleDocument.from_list_lines(zh_line_lst), "ZH"),
+        ])
 
     def _write_subtitle(self, translated_line_lst, srt_path):
-        pattern = re.compile(r"^\[(\d+\.\d+)->(\d+\.\d+)\](.*)@@@(.*)$")
-        if srt_path.suffix == '.ass':
-            if self.config.only_tgt:
-                line_format = "Dialogue: %d,%s,%s,ZH,,0,0,0,,%s\n"
-            else:
-                line_format = "Dialogue: %d,%s,%s,ZH,,0,0,0,,%s\\N{\\rEN}%s\n"
-        else:
-            if self.config.only_tgt:
-                line_format = "%d\n%s --> %s\n%s\n\n"
-            else:
-                line_format = "%d\n%s --> %s\n%s\n%s\n\n"
+        SubtitleDocument.from_merged_lines(translated_line_lst).write(srt_path, self.config.only_tgt)
 
-        with srt_path.open("w", encoding="utf-8") as f:
-            if srt_path.suffix == '.ass':
-                f.write(ASS_TEMPLAT)
-
-            for i, line in enumerate(translated_line_lst):
-                if line == "":
-                    continue
-                if srt_path.suffix == '.ass':
-                    line_id = 0
-                else:
-                    line_id = i + 1
+    def _write_language_subtitles(self, translated_line_lsts: dict[str, list], subtitle_path: Path):
+        """
+        写入各目标语言的字幕。第一个语言写入subtitle_path，其他语言写入xx.语言码.后缀，
+        multi_lang_tracks且为ass时所有语言写入subtitle_path的不同样式。
+        """
+        languages = list(translated_line_lsts)
+        if len(languages) > 1 and self.config.multi_lang_tracks and subtitle_path.suffix == '.ass':
+            docs = [SubtitleDocument.from_merged_lines(translated_line_lsts[lang]) for lang in languages]
+            tracks = [] if self.config.only_tgt else [(docs[0], "EN")]
+            tracks += [(SubtitleDocument(doc.starts, doc.ends, doc.target_texts), language_file_code(lang).upper())
+                       for doc, lang in zip(docs, languages)]
+            write_ass_tracks(subtitle_path, tracks)
+            return
 
-                match = pattern.match(line.strip())
-                if match is None:
-                    # API翻译结果有时候会出现"\u200b"，导致正则匹配失败，去掉再试一次。
-                    line = line.replace("\u200b", "") 
-                    match = pattern.match(line.strip())
-                    if match is None:
-                        CONSOLE.print("[red]匹配失败: %s" % line)
-                        continue
-                start, end, source_text, target_text = match.groups()
-                if self.config.only_tgt:
-                    f.write(line_format % (line_id, get_timestamp(start), get_timestamp(end), target_text))
-                else:
-                    f.write(line_format % (line_id, get_timestamp(start), get_timestamp(end), target_text, source_text))
+        for i, lang in enumerate(languages):
+            path = subtitle_path if i == 0 else subtitle_path.with_suffix(f'.{language_file_code(lang)}{subtitle_path.suffix}')
+            self._write_subtitle(translated_line_lsts[lang], path)
 
     @property
     def video_dir(self):
@@ -0,0 +1,400 @@
+import re
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import tyro
+
+from src.alignment import Alignment, TimestampIndex
+from src.utils import (ASS_TEMPLAT, CONSOLE, filter_files, get_timestamps,
+                       timestamps_to_seconds)
+
+# [1.44->3.18]text
+LIST_LINE_PATTERN = re.compile(r"^\[(\d+\.\d+)->(\d+\.\d+)\](.*)$", re.M)
+# [1.44->3.18]source text@@@目标文本
+MERGED_LINE_PATTERN = re.compile(r"^\[(\d+\.\d+)->(\d+\.\d+)\](.*)@@@(.*)$", re.M)
+TIME_TAG_PATTERN = re.compile(r"\[\d+\.\d+->\d+\.\d+\]")
+
+ASS_LINE_FORMAT = "Dialogue: 0,%s,%s,%s,,0,0,0,,%s\n"
+# Dialogue: 0,0:00:01.44,0:00:03.18,ZH,,0,0,0,,text
+ASS_EVENT_PATTERN = re.compile(r"^((?:Dialogue|Comment):\s*[^,]*),([^,]*),([^,]*),(.*)$")
+ASS_TAG_PATTERN = re.compile(r"\{[^}]*\}")
+# 双语ass中译文和原文的分隔
+BILINGUAL_SEPARATOR = "\\N{\\rEN}"
+
+
+class SubtitleDocument:
+    """
+    内存中的字幕文档，只解析一次，可以输出为srt、ass、vtt。
+    时间轴保存在numpy数组中，便于批量格式化。
+    """
+
+    def __init__(self, starts, ends, source_texts: list[str], target_texts: list[str] = None):
+        self.starts = np.asarray(starts, dtype=np.float64)
+        self.ends = np.asarray(ends, dtype=np.float64)
+        self.source_texts = list(source_texts)
+        self.target_texts = list(target_texts) if target_texts is not None else None
+        if not (len(self.starts) == len(self.ends) == len(self.source_texts)):
+            raise ValueError("starts, ends, source_texts must have the same length")
+        if self.target_texts is not None and len(self.target_texts) != len(self.source_texts):
+            raise ValueError(f"翻译结果数量不匹配: {len(self.target_texts)} -- {len(self.source_texts)}")
+
+    def __len__(self) -> int:
+        return len(self.source_texts)
+
+    @property
+    def has_target(self) -> bool:
+        return self.target_texts is not None
+
+    @classmethod
+    def _parse_lines(cls, lines: list[str], pattern: re.Pattern) -> tuple:
+        lines = [line.strip() for line in lines]
+        lines = [line for line in lines if line != ""]
+        # API翻译结果有时候会出现"\u200b"，导致正则匹配失败，统一去掉。
+        text = "\n".join(lines).replace("\u200b", "")
+        groups = pattern.findall(text)
+        if len(groups) != len(lines):
+            # 有无法解析的行，逐行匹配找出并跳过它们
+            groups = []
+            for line in lines:
+                match = pattern.match(line.replace("\u200b", ""))
+                if match is None:
+                    CONSOLE.print("[red]匹配失败: %s" % line)
+                    continue
+                groups.append(match.groups())
+
+        n = len(groups)
+        starts = np.fromiter((float(g[0]) for g in groups), dtype=np.float64, count=n)
+        ends = np.fromiter((float(g[1]) for g in groups), dtype=np.float64, count=n)
+        return starts, ends, [g[2:] for g in groups]
+
+    @classmethod
+    def from_list_lines(cls, lines: list[str]) -> "SubtitleDocument":
+        """解析ASR输出，每行格式为 [0.00->2.46]some text"""
+        starts, ends, groups = cls._parse_lines(lines, LIST_LINE_PATTERN)
+        return cls(starts, ends, [g[0] for g in groups])
+
+    @classmethod
+    def from_merged_lines(cls, lines: list[str]) -> "SubtitleDocument":
+        """解析Translator.translate_file的输出，每行格式为 [0.00->2.46]some text@@@一些文本"""
+        starts, ends, groups = cls._parse_lines(lines, MERGED_LINE_PATTERN)
+        return cls(starts, ends, [g[0] for g in groups], [g[1] for g in groups])
+
+    @classmethod
+    def from_list_file(cls, list_path: Path, translation_path: Path = None) -> "SubtitleDocument":
+        """
+        从.list文件读取原文，若给出translation_path(_zh.list)，则按时间标签对齐出对应的译文，
+        缺失的行填入MISSING_TRANSLATION。
+        """
+        with Path(list_path).open("r", encoding="utf-8") as f:
+            doc = cls.from_list_lines(f.read().strip().splitlines())
+        if translation_path is not None:
+            with Path(translation_path).open("r", encoding="utf-8") as f:
+                alignment = doc.align(f.read())
+            doc = cls(doc.starts, doc.ends, doc.source_texts, alignment.filled())
+        return doc
+
+    def align(self, translation: str, tolerance: float = 0.3) -> Alignment:
+        """按时间标签把带时间标签的译文对齐到本文档的各行。"""
+        return TimestampIndex(self.starts, self.ends, tolerance).align(translation)
+
+    def to_list_lines(self) -> list[str]:
+        return ["[%.2f->%.2f]%s\n" % (s, e, t) for s, e, t in
+                zip(self.starts.tolist(), self.ends.tolist(), self.source_texts)]
+
+    def _cue_texts(self, only_tgt: bool, sep: str) -> list[str]:
+        """每条字幕的显示文本。译文在上，原文在下。"""
+        if not self.has_target:
+            return [t.strip() for t in self.source_texts]
+        if only_tgt:
+            return [t.strip() for t in self.target_texts]
+        return [f"{tgt.strip()}{sep}{src.strip()}" for src, tgt in zip(self.source_texts, self.target_texts)]
+
+    def to_ass(self, only_tgt=False) -> str:
+        starts = get_timestamps(self.starts)
+        ends = get_timestamps(self.ends)
+        style = "ZH" if self.has_target else "EN"
+        texts = self._cue_texts(only_tgt, BILINGUAL_SEPARATOR)
+        body = "".join([ASS_LINE_FORMAT % (s, e, style, t) for s, e, t in zip(starts, ends, texts)])
+        return ASS_TEMPLAT + body
+
+    def to_srt(self, only_tgt=False) -> str:
+        starts = get_timestamps(self.starts, ass=False)
+        ends = get_timestamps(self.ends, ass=False)
+        texts = self._cue_texts(only_tgt, "\n")
+        return "".join([f"{i}\n{s} --> {e}\n{t}\n\n"
+                        for i, (s, e, t) in enumerate(zip(starts, ends, texts), 1)])
+
+    def to_vtt(self, only_tgt=False) -> str:
+        starts = get_timestamps(self.starts, ass=False)
+        ends = get_timestamps(self.ends, ass=False)
+        texts = self._cue_texts(only_tgt, "\n")
+        body = "".join([f"{s.replace(',', '.')} --> {e.replace(',', '.')}\n{t}\n\n"
+                        for s, e, t in zip(starts, ends, texts)])
+        return "WEBVTT\n\n" + body
+
+    def write(self, path: Path, only_tgt=False):
+        """根据后缀名(.ass | .srt | .vtt)写入字幕文件。"""
+        path = Path(path)
+        writers = {".ass": self.to_ass, ".srt": self.to_srt, ".vtt": self.to_vtt}
+        if path.suffix not in writers:
+            raise ValueError(f"Unsupported subtitle type: {path.suffix}")
+        with path.open("w", encoding="utf-8") as f:
+            f.write(writers[path.suffix](only_tgt))
+
+
+# ASS样式行中Fontsize和MarginV的位置(见ASS_TEMPLAT的Format行)
+ASS_STYLE_FONTSIZE, ASS_STYLE_MARGIN_V = 2, 21
+
+
+def ass_header(styles: list[str]) -> str:
+    """
+    多轨道ass的文件头。ASS_TEMPLAT中没有的样式按ZH样式补充，如多语言字幕的JA、KO。
+    styles按从下到上的显示顺序，第一个样式保留模板的MarginV，之后每个样式的MarginV依次抬高一行，
+    各轨道同时显示时不会叠在一起。
+    """
+    template = {m.group(1): m.group(0) for m in re.finditer(r"^Style: ([^,]+),.*$", ASS_TEMPLAT, re.M)}
+    stacked = {}
+    margin_v = None
+    for style in dict.fromkeys(styles):
+        fields = template.get(style, template["ZH"]).split(",")
+        fields[0] = f"Style: {style}"
+        if margin_v is None:
+            margin_v = int(fields[ASS_STYLE_MARGIN_V])
+        fields[ASS_STYLE_MARGIN_V] = str(margin_v)
+        # 行高按字号的1.25倍估算
+        margin_v += int(int(fields[ASS_STYLE_FONTSIZE]) * 1.25)
+        stacked[style] = ",".join(fields)
+
+    lines = [stacked.get(name, line) for name, line in template.items()]
+    lines += [line for name, line in stacked.items() if name not in template]
+    header = re.sub(r"^Style: .*\n", "", ASS_TEMPLAT, flags=re.M)
+    return header.replace("\n\n[Events]", "\n" + "".join(line + "\n" for line in lines) + "\n[Events]", 1)
+
+
+def write_ass_tracks(ass_path: Path, tracks: list[tuple[SubtitleDocument, str]]):
+    """
+    把多个文档按各自的样式写入同一个ass文件，每个文档只使用其原文。
+    文件中先出现的显示在下。
+    """
+    with Path(ass_path).open("w", encoding="utf-8") as f:
+        f.write(ass_header([style for _, style in tracks]))
+        for doc, style in tracks:
+            starts = get_timestamps(doc.starts)
+            ends = get_timestamps(doc.ends)
+            f.write("".join([ASS_LINE_FORMAT % (s, e, style, t.strip())
+                             for s, e, t in zip(starts, ends, doc.source_texts)]))
+
+
+class SubtitleFile:
+    """
+    已有字幕文件(ass | srt | vtt)的时间轴。
+    批量修改时间时，样式、特效标签等其他内容原样保留。
+    """
+
+    def __init__(self, suffix: str, header: str, starts, ends,
+                 prefixes: list[str], bodies: list[str], footer: str = ""):
+        self.suffix = suffix
+        self.header = header
+        self.starts = np.asarray(starts, dtype=np.float64)
+        self.ends = np.asarray(ends, dtype=np.float64)
+        # ass: "Dialogue: 0"  vtt: cue标识  srt: 不使用
+        self.prefixes = prefixes
+        # ass: 结束时间之后的字段  srt/vtt: 时间行剩余部分 + 换行 + 字幕文本
+        self.bodies = bodies
+        self.footer = footer
+
+    def __len__(self) -> int:
+        return len(self.bodies)
+
+    @classmethod
+    def load(cls, path: Path) -> "SubtitleFile":
+        path = Path(path)
+        with path.open("r", encoding="utf-8-sig") as f:
+            content = f.read()
+        if path.suffix == ".ass":
+            return cls._parse_ass(content)
+        elif path.suffix in (".srt", ".vtt"):
+            return cls._parse_cues(content, path.suffix)
+        raise ValueError(f"Unsupported subtitle type: {path.suffix}")
+
+    @classmethod
+    def _parse_ass(cls, content: str) -> "SubtitleFile":
+        header, footer = [], []
+        start_strs, end_strs, prefixes, bodies = [], [], [], []
+        for line in content.splitlines():
+            match = ASS_EVENT_PATTERN.match(line)
+            if match is None:
+                (footer if prefixes else header).append(line + "\n")
+                continue
+            prefix, start, end, body = match.groups()
+            prefixes.append(prefix)
+            start_strs.append(start.strip())
+            end_strs.append(end.strip())
+            bodies.append(body)
+        return cls(".ass", "".join(header), timestamps_to_seconds(start_strs), timestamps_to_seconds(end_strs),
+                   prefixes, bodies, "".join(footer))
+
+    @classmethod
+    def _parse_cues(cls, content: str, suffix: str) -> "SubtitleFile":
+        header = "WEBVTT\n\n" if suffix == ".vtt" else ""
+        start_strs, end_strs, prefixes, bodies = [], [], [], []
+        for block in re.split(r"\n\s*\n", content.strip()):
+            lines = block.splitlines()
+            time_index = next((i for i, line in enumerate(lines) if "-->" in line), None)
+            if time_index is None:  # WEBVTT头、NOTE、STYLE块
+                if suffix == ".vtt" and not start_strs and not block.startswith("WEBVTT"):
+                    header += block + "\n\n"
+                continue
+            start, _, rest = lines[time_index].partition("-->")
+            end, *settings = rest.split(maxsplit=1)
+            start_strs.append(cls._normalize_cue_time(start.strip()))
+            end_strs.append(cls._normalize_cue_time(end))
+            prefixes.append("\n".join(lines[:time_index]))
+            bodies.append((" " + settings[0] if settings else "") + "\n" + "\n".join(lines[time_index + 1:]))
+        return cls(suffix, header, timestamps_to_seconds(start_strs, ass=False),
+                   timestamps_to_seconds(end_strs, ass=False), prefixes, bodies)
+
+    @staticmethod
+    def _normalize_cue_time(time_str: str) -> str:
+        """vtt的 01:02.500 / 00:01:02.500 统一为srt的 00:01:02,500"""
+        time_str = time_str.replace(".", ",")
+        return time_str if time_str.count(":") == 2 else "00:" + time_str
+
+    @property
+    def texts(self) -> list[str]:
+        """不含样式标签的纯文本，多行用换行分隔。"""
+        if self.suffix == ".ass":
+            return [ASS_TAG_PATTERN.sub("", body.split(",", 6)[-1]).replace("\\N", "\n").replace("\\n", "\n")
+                    for body in self.bodies]
+        return [body.partition("\n")[2] for body in self.bodies]
+
+    def _select(self, mask: np.ndarray):
+        indices = np.flatnonzero(mask).tolist()
+        self.starts = self.starts[mask]
+        self.ends = self.ends[mask]
+        self.prefixes = [self.prefixes[i] for i in indices]
+        self.bodies = [self.bodies[i] for i in indices]
+
+    def _clip(self):
+        # 丢弃移到0点之前的字幕，并把跨过0点的字幕截断
+        self._select(self.ends > 0)
+        np.maximum(self.starts, 0, out=self.starts)
+
+    def shift(self, offset: float) -> "SubtitleFile":
+        """整体平移offset秒，负数表示提前。"""
+        self.starts = self.starts + offset
+        self.ends = self.ends + offset
+        self._clip()
+        return self
+
+    def scale(self, factor: float, origin: float = 0.0) -> "SubtitleFile":
+        """以origin为基准缩放时间轴，如帧率转换时 factor = 25 / 23.976。"""
+        self.starts = origin + (self.starts - origin) * factor
+        self.ends = origin + (self.ends - origin) * factor
+        self._clip()
+        return self
+
+    def slice(self, start: float, end: float) -> "SubtitleFile":
+        """截取与[start, end)有重叠的字幕，并以start为新的0点，返回新对象。"""
+        sliced = SubtitleFile(self.suffix, self.header, self.starts, self.ends,
+                              self.prefixes, self.bodies, self.footer)
+        sliced._select((self.ends > start) & (self.starts < end))
+        return sliced.shift(-start)
+
+    def to_document(self) -> SubtitleDocument:
+        return SubtitleDocument(self.starts, self.ends, self.texts)
+
+    def dumps(self) -> str:
+        if self.suffix == ".ass":
+            starts = get_timestamps(self.starts)
+            ends = get_timestamps(self.ends)
+            events = "".join([f"{p},{s},{e},{b}\n"
+                              for p, s, e, b in zip(self.prefixes, starts, ends, self.bodies)])
+            return self.header + events + self.footer
+
+        starts = get_timestamps(self.starts, ass=False)
+        ends = get_timestamps(self.ends, ass=False)
+        if self.suffix == ".srt":
+            return "".join([f"{i}\n{s} --> {e}{b}\n\n"
+                            for i, (s, e, b) in enumerate(zip(starts, ends, self.bodies), 1)])
+        return self.header + "".join([(f"{p}\n" if p else "") + f"{s.replace(',', '.')} --> {e.replace(',', '.')}{b}\n\n"
+                                      for p, s, e, b in zip(self.prefixes, starts, ends, self.bodies)])
+
+    def save(self, path: Path):
+        """保存字幕。后缀名和原文件不同时转换格式，此时只保留纯文本。"""
+        path = Path(path)
+        if path.suffix == self.suffix:
+            with path.open("w", encoding="utf-8") as f:
+                f.write(self.dumps())
+            return
+
+        doc = self.to_document()
+        if path.suffix == ".ass":
+            doc.source_texts = [text.replace("\n", "\\N") for text in doc.source_texts]
+        doc.write(path)
+
+
+def split_bilingual(subtitle: SubtitleFile) -> tuple[SubtitleDocument, SubtitleDocument]:
+    """
+    把SubGenie生成的ass拆成(译文, 原文)两个单语文档。
+    同时支持译文原文写在同一行的双语格式，和ZH/EN样式分开写的格式。
+    """
+    tgt = ([], [], [])
+    src = ([], [], [])
+    for start, end, body in zip(subtitle.starts.tolist(), subtitle.ends.tolist(), subtitle.bodies):
+        style = body.split(",", 1)[0].strip()
+        text = body.split(",", 6)[-1]
+        if BILINGUAL_SEPARATOR in text:
+            tgt_text, _, src_text = text.partition(BILINGUAL_SEPARATOR)
+            pairs = [(tgt, tgt_text), (src, src_text)]
+        else:
+            pairs = [(tgt if style == "ZH" else src, text)]
+        for track, track_text in pairs:
+            track[0].append(start)
+            track[1].append(end)
+            track[2].append(track_text)
+    tgt_doc = SubtitleDocument(tgt[0], tgt[1], tgt[2], tgt[2])
+    src_doc = SubtitleDocument(src[0], src[1], src[2])
+    return tgt_doc, src_doc
+
+
+@dataclass
+class RetimeConfig:
+    """批量平移、缩放字幕时间轴，或转换字幕格式"""
+
+    # 字幕文件或字幕目录
+    path: str = 'assets/video'
+    # 字幕过滤器
+    subtitle_filter: str = 'ass,srt,vtt'
+    # 时间缩放倍数(先缩放再平移)，如帧率转换时 25/23.976
+    scale: float = 1.0
+    # 缩放的基准时间点(秒)
+    origin: float = 0.0
+    # 时间平移量(秒)，负数表示提前
+    offset: float = 0.0
+    # 输出格式 ass | srt | vtt，为空时保持原格式
+    output_type: str = ''
+    # 输出目录，为空时覆盖原文件
+    output_dir: str = ''
+
+
+def retime_subtitles(config: RetimeConfig):
+    path = Path(config.path)
+    files = [path] if path.is_file() else filter_files(path, config.subtitle_filter)
+    for file in files:
+        subtitle = SubtitleFile.load(file)
+        if config.scale != 1.0:
+            subtitle.scale(config.scale, config.origin)
+        if config.offset != 0.0:
+            subtitle.shift(config.offset)
+
+        output_dir = Path(config.output_dir) if config.output_dir else file.parent
+        output_dir.mkdir(parents=True, exist_ok=True)
+        suffix = "." + config.output_type if config.output_type else file.suffix
+        subtitle.save(output_dir / (file.stem + suffix))
+        CONSOLE.print(f"[green]{file.name} -> {file.stem + suffix} ({len(subtitle)} lines)")
+
+
+if __name__ == '__main__':
+    retime_subtitles(tyro.cli(RetimeConfig))
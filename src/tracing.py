@@ -0,0 +1,116 @@
+"""
+分层计时。用TRACER.span()包裹流水线的各个阶段，嵌套的span自动形成父子关系，
+子span继承父span的属性(如file)，结果导出为Chrome trace格式，
+可以在 chrome://tracing 或 https://ui.perfetto.dev 中查看。
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from rich.table import Table
+
+from src.utils import CONSOLE, LOGGER
+
+
+class Tracer:
+    def __init__(self):
+        # 默认关闭，关闭时span几乎没有开销
+        self.enabled = False
+        self._events = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = time.perf_counter()
+
+    def enable(self):
+        with self._lock:
+            self.enabled = True
+            self._events = []
+            self._origin = time.perf_counter()
+
+    def _stack(self) -> list[dict]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def current_attrs(self) -> dict:
+        """
+        当前线程最内层span的属性。span的嵌套关系按线程记录，
+        在线程池中执行的子任务需要把调用方的属性显式传给其中的span。
+        """
+        if not self.enabled:
+            return {}
+        stack = self._stack()
+        return dict(stack[-1]) if stack else {}
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """
+        记录一段耗时。attrs会写入trace的args，并被同一线程中嵌套的子span继承。
+        yield的字典可以在span执行过程中补充属性。
+        """
+        if not self.enabled:
+            yield {}
+            return
+
+        stack = self._stack()
+        args = {**stack[-1], **attrs} if stack else dict(attrs)
+        stack.append(args)
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            end = time.perf_counter()
+            stack.pop()
+            event = {
+                "name": name,
+                "ph": "X",
+                "ts": (start - self._origin) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": {k: v if isinstance(v, (int, float, bool)) else str(v) for k, v in args.items()},
+            }
+            with self._lock:
+                self._events.append(event)
+
+    def save(self, path: str):
+        """导出Chrome trace JSON。"""
+        with self._lock:
+            events = list(self._events)
+        thread_names = {t.ident: t.name for t in threading.enumerate()}
+        metadata = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+                     "args": {"name": thread_names.get(tid, str(tid))}}
+                    for tid in {event["tid"] for event in events}]
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+        LOGGER.info(f"Trace saved to {path}, open it in https://ui.perfetto.dev")
+
+    def summary(self) -> dict[str, tuple[int, float]]:
+        """按span名称汇总: {name: (次数, 总耗时秒)}。"""
+        summary = {}
+        with self._lock:
+            for event in self._events:
+                count, total = summary.get(event["name"], (0, 0.0))
+                summary[event["name"]] = (count + 1, total + event["dur"] / 1e6)
+        return summary
+
+    def show(self, title: str = "Trace Summary"):
+        """按span名称汇总耗时。"""
+        summary = self.summary()
+
+        table = Table(title=title, show_header=True)
+        table.add_column('Span', style='cyan')
+        table.add_column('Count', justify="right", style='magenta')
+        table.add_column('Total(s)', justify="right", style='magenta')
+        for name, (count, total) in sorted(summary.items(), key=lambda item: -item[1][1]):
+            table.add_row(name, str(count), f"{total:.3f}")
+
+        CONSOLE.line(1)
+        CONSOLE.print(table)
+
+
+TRACER = Tracer()
@@ -1,14 +1,24 @@
+import copy
 import os
 import re
+import threading
 import time
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
 from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Optional
 
 import dashscope
 from deep_translator import BaiduTranslator, GoogleTranslator, constants
 from deep_translator.base import BaseTranslator
 
-from src.utils import API_USAGE_RECORDER, qwen_translate
+from src.alignment import MISSING_TRANSLATION, align_translation
+from src.subtitle import SubtitleDocument
+from src.tracing import TRACER
+from src.utils import API_USAGE_RECORDER, LOGGER, qwen_translate
+
+if TYPE_CHECKING:
+    from src.local_translator import LocalTranslator
 
 dashscope.api_key = os.getenv("DASHSCOPE_API_KEY")
 
@@ -17,12 +27,37 @@ LANGUAGE_CHARACTER_LIMIT = {
     "japanese": 1600,
 }
 
+# 目标语言: (译文缓存文件和字幕文件名中的语言码, qwen提示词中的语言名)
+LANGUAGES = {
+    "chinese": ("zh", "中文"),
+    "chinese (simplified)": ("zh", "中文"),
+    "chinese (traditional)": ("zh-TW", "繁体中文"),
+    "japanese": ("ja", "日语"),
+    "korean": ("ko", "韩语"),
+    "english": ("en", "英语"),
+    "french": ("fr", "法语"),
+    "german": ("de", "德语"),
+    "spanish": ("es", "西班牙语"),
+    "russian": ("ru", "俄语"),
+}
+
+
+def language_file_code(language: str) -> str:
+    """文件名中使用的语言码，如 chinese -> zh。"""
+    if language in LANGUAGES:
+        return LANGUAGES[language][0]
+    return constants.GOOGLE_LANGUAGES_TO_CODES.get(language, language)
+
+
+def qwen_language_name(language: str) -> str:
+    return LANGUAGES[language][1] if language in LANGUAGES else language
+
 
 @dataclass
 class TranslatorConfig:
     """翻译配置"""
 
-    # 使用的翻译api google | baidu | qwen
+    # 使用的翻译api google | baidu | qwen | local
     translate_api: str = 'qwen'
     baidu_appid: str = ''
     baidu_appkey: str = ''
@@ -30,15 +65,55 @@ class TranslatorConfig:
     src_lang: str = 'english'
     # 翻译目标语言
     tgt_lang: str = 'chinese'
+    # 多个目标语言，逗号分隔，如 chinese,japanese,korean。不为空时代替tgt_lang，各语言并发翻译，第一个为主语言
+    tgt_langs: str = ''
     # qwen专用。每次调用API时输入的字幕行数。
     line_num_in_one_call: int = 8
     # 通义千问模型
     qwen_model: str = 'qwen-turbo'
+    # local专用。CTranslate2格式的翻译模型文件夹路径
+    local_model: str = 'models/opus-mt-en-zh'
+    # local专用。模型精度 int8 | int8_float32 | float32
+    local_compute_type: str = 'int8'
+    # local专用。并行执行的翻译批次数(inter_threads)
+    local_inter_threads: int = 1
+    # local专用。每个批次使用的线程数(intra_threads)，0表示自动
+    local_intra_threads: int = 0
+    # local专用。每批翻译的最大行数
+    local_batch_size: int = 32
+    # local专用。beam search宽度，1为贪心解码
+    local_beam_size: int = 2
+    # local专用。多语言模型(NLLB/M2M100)的源语言码，如 eng_Latn
+    local_src_code: str = ''
+    # local专用。多语言模型(NLLB/M2M100)的目标语言前缀，如 zho_Hans
+    local_tgt_prefix: str = ''
 
 
 class Translator:
     def __init__(self, config: TranslatorConfig = TranslatorConfig()):
         self.config = config
+        self._local_translator = None
+
+    @property
+    def target_languages(self) -> list[str]:
+        """tgt_langs中的目标语言(去重)，为空或只有逗号时只翻译为tgt_lang。"""
+        languages = []
+        for lang in self.config.tgt_langs.split(","):
+            lang = lang.strip()
+            if lang and lang not in languages:
+                languages.append(lang)
+        if not languages:
+            if self.config.tgt_langs.strip():
+                LOGGER.warning("No target language in tgt_langs=%r, translating to %s",
+                               self.config.tgt_langs, self.config.tgt_lang)
+            return [self.config.tgt_lang]
+        return languages
+
+    def for_language(self, language: str) -> "Translator":
+        """目标语言为language的翻译器，其他配置不变。"""
+        translator = copy.copy(self)
+        translator.config = replace(self.config, tgt_lang=language, tgt_langs='')
+        return translator
 
     @property
     def character_limit(self) -> int:
@@ -77,10 +152,27 @@ class Translator:
             raise ValueError(
                 "Invalid translate_api value. Please choose 'google' or 'baidu'.")
 
+    @property
+    def local_translator(self) -> "LocalTranslator":
+        # 模型只在第一次使用时加载，只有translate_api为local时需要ctranslate2和transformers
+        if self._local_translator is None:
+            from src.local_translator import LocalTranslator
+            self._local_translator = LocalTranslator(
+                self.config.local_model,
+                compute_type=self.config.local_compute_type,
+                inter_threads=self.config.local_inter_threads,
+                intra_threads=self.config.local_intra_threads,
+                target_prefix=self.config.local_tgt_prefix,
+                source_code=self.config.local_src_code)
+        return self._local_translator
+
     def translate(self, subtitle: str) -> str:
+        if self.config.translate_api == "local":
+            return self.local_translator.translate_batch([subtitle])[0]
         return self.translator.translate(subtitle)
 
-    def translate_file(self, asr_output_file: Path) -> list:
+    def translate_file(self, asr_output_file: Path,
+                       on_progress: Optional[Callable[[int, int], None]] = None) -> list:
         """
         翻译文件，asr_output_file文件格式如下:\n  
         [0.00->2.46]some text\n  
@@ -89,85 +181,149 @@ class Translator:
         [46.10->48.02]yet another text\n 
 
         return ["[0.00->2.46]some text@@@一些文本", ..., "[46.10->48.02]yet another text@@@另一些文本"]
+        on_progress(已翻译行数, 总行数)在每批翻译完成后调用
         """
-        pattern = re.compile(r"\[\d+\.\d+->\d+\.\d+\]")
-        print(f"Translating {asr_output_file}")
+        LOGGER.info("Translating %s", asr_output_file)
+        with asr_output_file.open("r", encoding="utf-8") as f:
+            text_lines = f.readlines()
+        merged_lines = self.translate_lines(text_lines, on_progress)
+        if self.config.translate_api == "qwen":
+            API_USAGE_RECORDER.show()
+        return merged_lines
 
+    def translate_lines(self, text_lines: list[str],
+                        on_progress: Optional[Callable[[int, int], None]] = None) -> list:
+        """同translate_file，输入为.list文件的各行。"""
+        return merge_translation(text_lines, self.translate_texts(text_lines, on_progress))
+
+    def translate_texts(self, text_lines: list[str],
+                        on_progress: Optional[Callable[[int, int], None]] = None) -> list[str]:
+        """
+        翻译.list文件的各行，返回与原文逐行对应的译文(不含时间标签)。
+        API返回的译文按时间标签对齐到原文，只有确实缺失的行填入MISSING_TRANSLATION。
+        """
+        pattern = re.compile(r"\[\d+\.\d+->\d+\.\d+\]")
         translated_subtitles = []
-        text_lines= []
+
+        def collect(source_lines: list[str], translation: str):
+            alignment = align_translation(source_lines, translation)
+            if alignment.missing:
+                LOGGER.warning("翻译结果缺少%d行: %s", len(alignment.missing),
+                               " ".join(source_lines[k].split("]")[0] + "]" for k in alignment.missing))
+            translated_subtitles.extend(alignment.filled())
+            if on_progress is not None:
+                on_progress(len(translated_subtitles), len(text_lines))
 
         def batch_translate(subs):
-            translation = self.translator.translate(''.join(subs))
-            translated_subtitles.extend(re.split(pattern, translation)[1:])
-            trl = len(translated_subtitles)
-            if trl != i + 1:  # 翻译API自动合并短句导致翻译结果数量和原文字幕数量不一致。
-                translated_subtitles.extend(["翻译结果数量不匹配，请检查。"]*(i+1-trl))
-                print(f"翻译结果数量不匹配: {trl} -- {i + 1}.")
+            with TRACER.span("translate_call", api=self.config.translate_api, lines=len(subs)):
+                translation = self.translator.translate(''.join(subs))
+            collect(subs, translation)
+
+        if self.config.translate_api == "qwen":
+            for i in range(0, len(text_lines), self.config.line_num_in_one_call):
+                window = text_lines[i:i+self.config.line_num_in_one_call]
+                with TRACER.span("translate_call", api="qwen", first_line=i):
+                    qwen_result = qwen_translate("\n".join(window), self.config.qwen_model,
+                                                 qwen_language_name(self.config.tgt_lang))
+                collect(window, qwen_result)
+                LOGGER.debug("Translated %d lines", len(translated_subtitles))
+        elif self.config.translate_api == "local":
+            # 去掉时间戳后整个文件一次性批量翻译，结果与原文逐行对应
+            texts = [re.sub(pattern, "", line).strip() for line in text_lines]
+            with TRACER.span("translate_call", api="local", lines=len(texts)):
+                translated_subtitles = self.local_translator.translate_batch(
+                    texts, self.config.local_batch_size, self.config.local_beam_size)
+            if on_progress is not None:
+                on_progress(len(texts), len(texts))
+        else:
+            total_chara = 0
+            subtitles = []
+            for i in range(0, len(text_lines)):
+                subtitle = text_lines[i]
+                total_chara += len(subtitle)
+                subtitles.append(subtitle)
+                # 打包翻译，减少API调用次数
+                if total_chara > self.character_limit:
+                    batch_translate(subtitles)
+                    subtitles = []
+                    total_chara = 0
+                    time.sleep(.1)  # 等待0.1秒，防止被ban。
 
+            batch_translate(subtitles)
+
+        return translated_subtitles
+
+    def translate_file_multi(self, asr_output_file: Path,
+                             on_progress: Optional[Callable[[int, int], None]] = None) -> dict[str, list]:
+        """
+        把同一个.list文件并发翻译为target_languages中的各个语言，返回{目标语言: translate_file格式的结果}。
+        文件只读取一次。各语言的译文缓存为同目录下的{stem}_{语言码}.list(与手动翻译的_zh.list格式相同)，
+        缓存按时间标签对齐到原文，只翻译缓存中没有或翻译失败的行。
+        on_progress(已翻译行数, 总行数)按所有语言合计。
+        """
+        # target_languages至少有一个语言，线程池大小不会为0
+        languages = self.target_languages
+        if self.config.translate_api == "local" and len(languages) > 1:
+            raise ValueError("local翻译模型只支持一个目标语言")
+        LOGGER.info("Translating %s -> %s", asr_output_file, ", ".join(languages))
         with asr_output_file.open("r", encoding="utf-8") as f:
             text_lines = f.readlines()
 
-            if self.config.translate_api == "qwen":
-                for i in range(0, len(text_lines), self.config.line_num_in_one_call):
-                    qwen_result = qwen_translate("\n".join(text_lines[i:i+self.config.line_num_in_one_call]), self.config.qwen_model)
-                    qwen_lst = re.split(pattern, qwen_result)[1:]
-                    
-                    if len(qwen_lst) > self.config.line_num_in_one_call: # AI有可能编出不存在的内容
-                        qwen_lst = qwen_lst[:self.config.line_num_in_one_call]
-
-                    if len(qwen_lst) < self.config.line_num_in_one_call:
-                        qwen_result_lst = list(filter(lambda x: x != "", qwen_result.splitlines()))
-                        time_pattern = re.compile(r"^\[(\d+\.\d+->\d+\.\d+)\](.*)$")
-                        qwen_index = 0
-                        qwen_lst = []
-                        for j in range(self.config.line_num_in_one_call):
-                            if i + j >= len(text_lines):
-                                break
-                            
-                            if qwen_index >= len(qwen_result_lst):
-                                qwen_lst.append("AI翻译漏行")
-                                print(f"补充了一个AI翻译漏行")
-                                break
-                            m = time_pattern.match(text_lines[i + j])
-                            if m:
-                                raw_time_str, raw_text = m.groups()
-                            m = time_pattern.match(qwen_result_lst[qwen_index])
-                            if m:
-                                trans_time_str, trans_text = m.groups()
-                            if raw_time_str == trans_time_str:
-                                qwen_index += 1
-                                qwen_lst.append(trans_text)
-                            else:
-                                qwen_lst.append("AI翻译漏行")
-                        print("\n".join(qwen_lst))
-
-                    translated_subtitles.extend(qwen_lst)
-                    print(len(translated_subtitles))
-            else:
-                total_chara = 0
-                subtitles = []
-                for i in range(0, len(text_lines)):
-                    subtitle = text_lines[i]
-                    total_chara += len(subtitle)
-                    subtitles.append(subtitle)
-                    # 打包翻译，减少API调用次数
-                    if total_chara > self.character_limit:
-                        batch_translate(subtitles)
-                        subtitles = []
-                        total_chara = 0
-                        time.sleep(.1)  # 等待0.1秒，防止被ban。
-
-                batch_translate(subtitles)
+        total = len(text_lines) * len(languages)
+        done = dict.fromkeys(languages, 0)
+        lock = threading.Lock()
+        # 各语言在线程池中翻译，span的父子关系不跨线程，需要带上调用方span的属性(如file)
+        parent_attrs = TRACER.current_attrs()
 
+        def report(language: str, count: int):
+            with lock:
+                done[language] = count
+                if on_progress is not None:
+                    on_progress(sum(done.values()), total)
+
+        def translate(language: str) -> list:
+            cache_path = asr_output_file.with_stem(f"{asr_output_file.stem}_{language_file_code(language)}")
+            texts = load_translation_cache(cache_path, text_lines)
+            # 只翻译缓存中没有的行
+            todo = [k for k, text in enumerate(texts) if text is None]
+            if len(todo) < len(text_lines):
+                LOGGER.info("Using cached translation %s, %d lines to translate", cache_path, len(todo))
+            cached_count = len(text_lines) - len(todo)
+            report(language, cached_count)
+            if todo:
+                translator = self if len(languages) == 1 else self.for_language(language)
+                attrs = {**parent_attrs, "language": language, "lines": len(todo)}
+                with TRACER.span("translate_language", **attrs):
+                    new_texts = translator.translate_texts(
+                        [text_lines[k] for k in todo], lambda n, _: report(language, cached_count + n))
+                for k, text in zip(todo, new_texts):
+                    texts[k] = text
+                # 缺失的行也写入缓存，下次只重新翻译这些行
+                source = SubtitleDocument.from_list_lines(text_lines)
+                with cache_path.open("w", encoding="utf-8") as f:
+                    f.writelines(SubtitleDocument(source.starts, source.ends, texts).to_list_lines())
+            return merge_translation(text_lines, texts)
+
+        with ThreadPoolExecutor(len(languages)) as executor:
+            results = dict(zip(languages, executor.map(translate, languages)))
         if self.config.translate_api == "qwen":
             API_USAGE_RECORDER.show()
+        return results
+
+
+def merge_translation(text_lines: list[str], translations: list[str]) -> list[str]:
+    """合并原文和译文: [0.00->2.46]some text@@@一些文本"""
+    return [line.strip() + r"@@@" + translation.strip() + "\n"
+            for line, translation in zip(text_lines, translations)]
 
-        # 合并翻译结果
-        for i in range(len(text_lines)):
-            text_lines[i] = text_lines[i].strip() + r"@@@" + \
-                translated_subtitles[i].strip() + "\n"
 
-        return text_lines
+def load_translation_cache(cache_path: Path, text_lines: list[str]) -> list[Optional[str]]:
+    """按时间标签读取译文缓存，返回与原文逐行对应的译文，缓存中没有或翻译失败的行为None。"""
+    if not cache_path.exists():
+        return [None] * len(text_lines)
+    with cache_path.open("r", encoding="utf-8") as f:
+        alignment = align_translation(text_lines, f.read())
+    return [None if text is None or text == MISSING_TRANSLATION else text for text in alignment.texts]
 
 
 if __name__ == '__main__':
@@ -1,18 +1,24 @@
+import json
 import logging
 import os
 import re
+import sys
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor
 from http import HTTPStatus
 from pathlib import Path
 from typing import Union
 
 import dashscope
+import numpy as np
 import requests
 from numpy import void
 from PIL import Image, ImageOps
 from pydub import AudioSegment
 from rich.console import Console
 from rich.logging import RichHandler
+from rich.markup import render
 from rich.table import Table
 from rich.traceback import install
 from torch import ge, mode
@@ -21,24 +27,118 @@ from torch import ge, mode
 class MyFilter(logging.Filter):
     def __init__(self, name: str = "") -> None:
         super().__init__(name)
-        self.pys = []  # 记录项目所有的py文件
-        for _, _, i in os.walk(os.path.dirname(__file__)):
-            self.pys.extend([j for j in i if j.endswith('py')])
-        # CONSOLE.print(self.pys)
+        self._pys = None  # 记录项目所有的py文件，第一次过滤时才扫描
+
+    @property
+    def pys(self) -> frozenset:
+        if self._pys is None:
+            pys = []
+            for _, _, i in os.walk(os.path.dirname(__file__)):
+                pys.extend([j for j in i if j.endswith('py')])
+            self._pys = frozenset(pys)
+        return self._pys
 
     def filter(self, record):
         if record.filename in self.pys:
             return True
         return False
 
+
+class PlainFormatter(logging.Formatter):
+    """无界面模式的日志格式，去掉rich markup。"""
+
+    def format(self, record):
+        message = super().format(record)
+        try:
+            return render(message).plain
+        except Exception:
+            return message
+
+
+class QuietableConsole(Console):
+    """quiet时直接跳过，不做渲染。无界面模式下CONSOLE的输出几乎没有开销。"""
+
+    def print(self, *args, **kwargs):
+        if not self.quiet:
+            super().print(*args, **kwargs)
+
+    def rule(self, *args, **kwargs):
+        if not self.quiet:
+            super().rule(*args, **kwargs)
+
+    def line(self, *args, **kwargs):
+        if not self.quiet:
+            super().line(*args, **kwargs)
+
+
+class ProgressReporter:
+    """
+    无界面模式下以JSON lines输出结构化进度事件，每行一个:
+    {"time": ..., "file": ..., "stage": ..., "percent": ..., "rate": ..., "unit": ...}
+    rate为该阶段开始以来每秒处理的unit数。未启用时emit直接返回。
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stream = sys.stdout
+        self._lock = threading.Lock()
+        self._start_times = {}
+
+    def enable(self, stream=None):
+        self.enabled = True
+        self.stream = stream or sys.stdout
+
+    def emit(self, file: str, stage: str, done: float, total: float, unit: str = ""):
+        if not self.enabled:
+            return
+        now = time.time()
+        key = (file, stage)
+        with self._lock:
+            start = self._start_times.setdefault(key, now)
+            if done >= total:
+                self._start_times.pop(key, None)
+            elapsed = now - start
+            event = {
+                "time": round(now, 3),
+                "file": file,
+                "stage": stage,
+                "percent": round(done / total * 100, 1) if total else 100.0,
+                "rate": round(done / elapsed, 2) if elapsed > 0 else None,
+                "unit": unit,
+            }
+            self.stream.write(json.dumps(event, ensure_ascii=False) + "\n")
+            self.stream.flush()
+
+
 FORMAT = "%(message)s"
 rich_handler = RichHandler(markup=True)
 rich_handler.addFilter(MyFilter())
 logging.basicConfig(
-    level=logging.DEBUG, format=FORMAT, datefmt="[%X]", handlers=[rich_handler])
+    level=os.getenv("SUBGENIE_LOG_LEVEL", "DEBUG").upper(), format=FORMAT, datefmt="[%X]", handlers=[rich_handler])
 
 LOGGER = logging.getLogger("rich")
-CONSOLE = Console()
+CONSOLE = QuietableConsole()
+PROGRESS = ProgressReporter()
+
+
+def configure_logging(level: str = "DEBUG", headless: bool = False):
+    """
+    设置日志级别。headless为True时进入无界面模式:
+    日志以纯文本输出到stderr，关闭Rich的控制台输出，stdout只输出JSON lines进度事件。
+    """
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    if headless:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(PlainFormatter("%(asctime)s %(levelname)s %(message)s"))
+        handler.addFilter(MyFilter())
+        root.handlers = [handler]
+        CONSOLE.quiet = True
+        PROGRESS.enable()
+
+
+if os.getenv("SUBGENIE_HEADLESS"):
+    configure_logging(os.getenv("SUBGENIE_LOG_LEVEL", "INFO"), headless=True)
 
 install(show_locals=False)
 
@@ -95,6 +195,10 @@ class TimeRecorder:
     def record(self, description):
         self._record[description] = time.time() - self._start_time
         self._start_time = time.time()
+
+    def add(self, description, seconds):
+        """直接记录一段耗时，用于多个任务并发执行的情况。"""
+        self._record[description] = seconds
     
     def show(self, title: str = "Time Cost"):
         table = Table(title=title, show_header=False)
@@ -111,16 +215,19 @@ TIME_RECORDER = TimeRecorder()
 class ApiUsageRecorder:
     def __init__(self):
         self._record = {}
+        # 多语言翻译时多个线程同时调用qwen
+        self._lock = threading.Lock()
 
     def record(self, model, usage):
-        if self._record.get(model, None):
-            self._record[model]["input_tokens"] += usage["input_tokens"]
-            self._record[model]["output_tokens"] += usage["output_tokens"]
-        else:
-            self._record[model] = {
-                "input_tokens": usage["input_tokens"],
-                "output_tokens": usage["output_tokens"],
-            }
+        with self._lock:
+            if self._record.get(model, None):
+                self._record[model]["input_tokens"] += usage["input_tokens"]
+                self._record[model]["output_tokens"] += usage["output_tokens"]
+            else:
+                self._record[model] = {
+                    "input_tokens": usage["input_tokens"],
+                    "output_tokens": usage["output_tokens"],
+                }
     
     def show(self, title: str = "Api Usage"):
         table = Table(title=title, show_header=True)
@@ -128,7 +235,9 @@ class ApiUsageRecorder:
         table.add_column('Input Tokens', justify="center", style='magenta')
         table.add_column('Output Tokens', justify="center", style='magenta')
         table.add_column('Cost(￥)', justify="center", style='gold1')
-        for k, token_dict in self._record.items():
+        with self._lock:
+            record = {k: dict(v) for k, v in self._record.items()}
+        for k, token_dict in record.items():
             price = round(token_dict["input_tokens"] * get_input_token_price(k) + token_dict["output_tokens"] * get_output_token_price(k), 5)
             table.add_row(k, str(token_dict["input_tokens"]), str(token_dict["output_tokens"]), str(price))
 
@@ -150,10 +259,8 @@ def qwen_call_once(content, model="qwen-turbo") -> str:
         API_USAGE_RECORDER.record(model, response.usage)
         return response.output.choices[0].message.content
     else:
-        print('Request id: %s, Status code: %s, error code: %s, error message: %s' % (
-            response.request_id, response.status_code,
-            response.code, response.message
-        ))
+        LOGGER.error('Request id: %s, Status code: %s, error code: %s, error message: %s',
+                     response.request_id, response.status_code, response.code, response.message)
         return ""
 
 
@@ -178,27 +285,44 @@ def get_response(last_messages, model="qwen-max"):
     return response_json
 
 
-def qwen_translate(content: str, model="qwen-max") -> str:
+# qwen提示词中的翻译示例，"So let's open up the project,"的各语言译文，键为translator.LANGUAGES中的语言名
+QWEN_TRANSLATION_EXAMPLES = {
+    "中文": "我们打开项目，",
+    "繁体中文": "我們打開專案，",
+    "日语": "では、プロジェクトを開きましょう。",
+    "韩语": "그럼 프로젝트를 열어 봅시다.",
+    "英语": "So let's open up the project,",
+    "法语": "Ouvrons donc le projet,",
+    "德语": "Öffnen wir also das Projekt,",
+    "西班牙语": "Así que abramos el proyecto,",
+    "俄语": "Итак, давайте откроем проект,",
+}
+
+
+def qwen_translate(content: str, model="qwen-max", target_language: str = "中文") -> str:
     # turbo限流阈值
     # 每分钟不超过500次API调用；
     # 每分钟消耗的token数目不超过500,000。
+    # 没有示例译文的语言不给翻译示例，避免模型照抄占位符
+    example = QWEN_TRANSLATION_EXAMPLES.get(target_language)
+    example_block = f"""
+**翻译示例**：
+原文：
+[44.06->45.72]So let's open up the project,
+
+翻译结果：
+[44.06->45.72]{example}
+""" if example else ""
     messages = [
         {
             "role": "system",
             "content": \
-"""请你扮演专业翻译员的角色。将各种语言精准而优雅地转化为尽量简短的中文。请在翻译时避免生硬的直译，而是追求自然流畅、贴近原文。不要进行任何格式修改
+f"""请你扮演专业翻译员的角色。将各种语言精准而优雅地转化为尽量简短的{target_language}。请在翻译时避免生硬的直译，而是追求自然流畅、贴近原文。不要进行任何格式修改
 **注意事项**：
 - 严格保留每行开头的时间格式，示例"[1.44->3.18]"。
 - 逐行翻译。
 - 不要输出任何与翻译结果无关的内容。
-
-**翻译示例**：
-原文：
-[44.06->45.72]So let's open up the project,
-
-翻译结果：
-[44.06->45.72]我们打开项目，
-"""   
+{example_block}"""
         }
     ]
 
@@ -217,8 +341,8 @@ def qwen_translate(content: str, model="qwen-max") -> str:
             messages.append(assistant_output)
             # print(messages)
         else:
-            print(assistant_output['content'])
-            print(f"{response['usage']}" )
+            LOGGER.debug("%s", assistant_output['content'])
+            LOGGER.debug("%s", response['usage'])
             return assistant_output['content']
 
 
@@ -257,6 +381,73 @@ def timestamp_to_seconds(time_str: str, ass=True) -> float:
         return hours * 3600 + minutes * 60 + seconds + float(ms) / 1000
 
 
+_TWO_DIGITS = [f"{i:02d}" for i in range(100)]
+_THREE_DIGITS = [f"{i:03d}" for i in range(1000)]
+
+
+def _two_product(a: np.ndarray, b: float) -> tuple[np.ndarray, np.ndarray]:
+    """Dekker乘法: 返回p, e，满足a*b == p + e(精确)。"""
+    p = a * b
+    c = 134217729.0 * a  # 2**27 + 1
+    a_hi = c - (c - a)
+    a_lo = a - a_hi
+    c = 134217729.0 * b
+    b_hi = c - (c - b)
+    b_lo = b - b_hi
+    e = ((a_hi * b_hi - p) + a_hi * b_lo + a_lo * b_hi) + a_lo * b_lo
+    return p, e
+
+
+def get_timestamps(t, ass=True) -> list[str]:
+    """
+    批量版的get_timestamp，输出与逐个调用get_timestamp完全一致。
+    小数部分按round()的规则(精确值、四舍六入五成双)取整，并且和get_timestamp一样不向秒进位。
+    [1234.12, 1.5] -> ['0:20:34.12', '0:00:01.50']
+    """
+    t = np.asarray(t, dtype=np.float64)
+    whole = np.trunc(t)
+    scale = 100.0 if ass else 1000.0
+    p, e = _two_product(t - whole, scale)
+    frac = np.rint(p)
+    diff = p - frac
+    frac += (diff == 0.5) & (e > 0)
+    frac -= (diff == -0.5) & (e < 0)
+    frac = (frac.astype(np.int64) % int(scale)).tolist()
+
+    whole = whole.astype(np.int64)
+    secs = (whole % 60).tolist()
+    mins = (whole // 60 % 60).tolist()
+    hours = whole // 3600
+    # 用查表代替逐个格式化数字
+    hour_table = [f"{h}" if ass else f"{h:02d}" for h in range(int(hours.max(initial=0)) + 1)]
+    hours = hours.tolist()
+    if ass:
+        return [f"{hour_table[h]}:{_TWO_DIGITS[m]}:{_TWO_DIGITS[s]}.{_TWO_DIGITS[f]}"
+                for h, m, s, f in zip(hours, mins, secs, frac)]
+    return [f"{hour_table[h]}:{_TWO_DIGITS[m]}:{_TWO_DIGITS[s]},{_THREE_DIGITS[f]}"
+            for h, m, s, f in zip(hours, mins, secs, frac)]
+
+
+def timestamps_to_seconds(time_strs: list[str], ass=True) -> np.ndarray:
+    """
+    批量版的timestamp_to_seconds，结果与逐个调用timestamp_to_seconds完全一致。
+    ass ['00:02:45.678'] -> array([165.678])
+    srt ['00:02:45,678'] -> array([165.678])
+    """
+    n = len(time_strs)
+    width = 3 if ass else 4
+    if ass:
+        fields = (part for time_str in time_strs for part in time_str.split(':'))
+    else:
+        fields = (part for time_str in time_strs for part in time_str.replace(',', ':').split(':'))
+    values = np.fromiter(map(float, fields), dtype=np.float64, count=n * width).reshape(n, width)
+    # 保持与标量版本相同的运算顺序，保证结果逐位相同
+    seconds = values[:, 0] * 3600 + values[:, 1] * 60 + values[:, 2]
+    if not ass:
+        seconds = seconds + values[:, 3] / 1000
+    return seconds
+
+
 
 def filter_files(path: Union[Path|str], filter_str) -> list[Path]:
     """
@@ -287,31 +478,10 @@ def write_ass_subtitle(translated_line_lst: list[str], srt_path: Path) -> void:
     :param translated_line_lst: 包含翻译后字幕行的列表。
     :param srt_path: 字幕文件的路径，可以是ASS或SRT格式。
     """
-    pattern = re.compile(r"^\[(\d+\.\d+)->(\d+\.\d+)\](.*)@@@(.*)$")
-    line_format = "Dialogue: %d,%s,%s,ZH,,0,0,0,,%s\\N{\\rEN}%s\n"
-
-    with srt_path.open("w", encoding="utf-8") as f:
-        if srt_path.suffix == '.ass':
-            f.write(ASS_TEMPLAT)
-
-        for i, line in enumerate(translated_line_lst):
-            if line == "":
-                continue
-            if srt_path.suffix == '.ass':
-                line_id = 0
-            else:
-                line_id = i + 1
-
-            match = pattern.match(line.strip())
-            if match is None:
-                # API翻译结果有时候会出现"\u200b"，导致正则匹配失败，去掉再试一次。
-                line = line.replace("\u200b", "") 
-                match = pattern.match(line.strip())
-                if match is None:
-                    print("[red]匹配失败: %s" % line)
-                    continue
-            start, end, source_text, target_text = match.groups()
-            f.write(line_format % (line_id, get_timestamp(start), get_timestamp(end), target_text, source_text))
+    # 放在函数内导入，避免和src.subtitle循环导入
+    from src.subtitle import SubtitleDocument
+
+    SubtitleDocument.from_merged_lines(translated_line_lst).write(srt_path)
 
 def ensure_folder_exists(path: str):
     if not os.path.exists(path):
@@ -330,6 +500,35 @@ def resize_image(input_image_path, output_image_path, size):
         resized_image.save(output_image_path)
 
 
+def is_up_to_date(output_path: Path, *input_paths: Path) -> bool:
+    """输出文件存在，且不早于所有输入文件。"""
+    output_path = Path(output_path)
+    if not output_path.exists():
+        return False
+    output_mtime = output_path.stat().st_mtime
+    return all(output_mtime >= Path(p).stat().st_mtime for p in input_paths if Path(p).exists())
+
+
+def dominant_color(image: Image.Image):
+    """
+    图像中出现次数最多的颜色，可直接作为同一模式图像的填充色。
+    把每个像素的各通道打包成一个整数后用numpy计数，代替getcolors + 排序。
+    """
+    pixels = np.asarray(image)
+    if pixels.ndim == 2:
+        values, counts = np.unique(pixels.ravel(), return_counts=True)
+        return values[counts.argmax()].item()
+
+    channels = pixels.shape[2]
+    pixels = pixels.reshape(-1, channels).astype(np.uint32)
+    packed = pixels[:, 0].copy()
+    for i in range(1, channels):
+        packed = (packed << 8) | pixels[:, i]
+    values, counts = np.unique(packed, return_counts=True)
+    value = int(values[counts.argmax()])
+    return tuple((value >> (8 * (channels - 1 - i))) & 0xFF for i in range(channels))
+
+
 def sbcover_pad(image_path, output_path=None, color=None):
     """
     使用Pillow对图像进行Padding
@@ -340,12 +539,12 @@ def sbcover_pad(image_path, output_path=None, color=None):
     """
     image = Image.open(image_path)
     w, h = image.size
-    if color is None:
-        color = sorted(image.getcolors(w*h), key=lambda x: x[0], reverse=True)[0][1]
     pad_size = ((w * 0.75) - h) / 2
     pad_size = int(pad_size)
     if pad_size <= 0:
         return
+    if color is None:
+        color = dominant_color(image)
     
     padded_image = ImageOps.expand(image, border=(0, pad_size, 0, pad_size), fill=color)
     
@@ -355,6 +554,43 @@ def sbcover_pad(image_path, output_path=None, color=None):
         padded_image.save('padded_image.png')
 
 
+def process_cover(image_path, output_path, size=None):
+    """
+    封面处理: 上下填充出现最多的颜色到4:3，再缩放到size(宽, 高)。
+    不需要填充的图像也会输出，保证每张封面都有对应的结果。
+    """
+    with Image.open(image_path) as image:
+        w, h = image.size
+        pad_size = int(((w * 0.75) - h) / 2)
+        if pad_size > 0:
+            image = ImageOps.expand(image, border=(0, pad_size, 0, pad_size), fill=dominant_color(image))
+        if size:
+            image = image.resize(size)
+        image.save(output_path)
+
+
+def batch_process_covers(cover_dir, size=None, workers=0, overwrite=False) -> list[Path]:
+    """
+    用进程池批量处理cover_dir中的封面，输出为 padded_原文件名。
+    跳过输出已是最新的封面。返回新生成的文件列表。
+    """
+    jobs = []
+    for image_path in filter_files(cover_dir, "jpg,jpeg,png,webp"):
+        if image_path.name.startswith("padded_"):
+            continue
+        output_path = image_path.with_name("padded_" + image_path.name)
+        if not overwrite and is_up_to_date(output_path, image_path):
+            continue
+        jobs.append((image_path, output_path))
+
+    if not jobs:
+        return []
+    with ProcessPoolExecutor(max_workers=workers or None) as executor:
+        list(executor.map(process_cover, *zip(*jobs), [size] * len(jobs)))
+    LOGGER.info(f"{len(jobs)} covers processed.")
+    return [output_path for _, output_path in jobs]
+
+
 if __name__ == '__main__':
     # image_path = Path('assets\misc\Shop and Treasure Room for a Roguelike Deckbuilder in Godot (S02E12).jpg')
     # sbcover_pad(
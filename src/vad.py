@@ -0,0 +1,183 @@
+"""
+语音活动检测(VAD)。用faster_whisper自带的Silero VAD找出音频中的语音区间，结果按音频文件缓存为json(xx.vad.json)。
+- SpeechMap: 语音区间表，查询片段内的语音区间和静音时长
+- load_speech_map: 读取缓存，缓存不存在或已失效时重新检测
+- collect_speech: 拼接一段音频中的语音部分，返回的TimeMap把拼接后音频的时间换算回原始时间
+"""
+import bisect
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from faster_whisper.vad import VadOptions, get_speech_timestamps
+
+from src.audio_stream import iter_audio_windows, probe_duration
+from src.metrics import VAD_CACHE_TOTAL
+from src.tracing import TRACER
+from src.utils import LOGGER, SAMPLE_RATE
+
+# 缓存格式版本，格式变化时递增使旧缓存失效
+VAD_CACHE_VERSION = 1
+
+
+@dataclass
+class VadConfig:
+    # 语音概率阈值
+    threshold: float = 0.5
+    # 短于该时长(秒)的静音不切分
+    min_silence: float = 1.0
+    # 语音区间两端各扩展的时长(秒)，避免截断单词开头结尾
+    speech_pad: float = 0.4
+
+    def vad_options(self) -> VadOptions:
+        return VadOptions(threshold=self.threshold,
+                          min_silence_duration_ms=int(self.min_silence * 1000),
+                          speech_pad_ms=int(self.speech_pad * 1000))
+
+
+@dataclass
+class SpeechMap:
+    # 音频时长(秒)
+    duration: float
+    # 按时间排序、互不重叠的语音区间[(start, end), ...]
+    regions: list[tuple[float, float]] = field(default_factory=list)
+
+    def __post_init__(self):
+        self.regions = [(float(s), float(e)) for s, e in self.regions]
+        self._starts = [s for s, _ in self.regions]
+
+    @property
+    def speech_seconds(self) -> float:
+        return sum(e - s for s, e in self.regions)
+
+    def clip(self, start: float, end: float) -> list[tuple[float, float]]:
+        """[start, end)内的语音区间，裁剪到该范围。"""
+        i = max(bisect.bisect_right(self._starts, start) - 1, 0)
+        clipped = []
+        for s, e in self.regions[i:]:
+            if s >= end:
+                break
+            if e > start:
+                clipped.append((max(s, start), min(e, end)))
+        return clipped
+
+    def longest_silence(self, start: float, end: float) -> float:
+        """[start, end)内最长的连续静音时长。"""
+        if end <= start:
+            return 0.0
+        longest = 0.0
+        position = start
+        for s, e in self.clip(start, end):
+            longest = max(longest, s - position)
+            position = e
+        return max(longest, end - position)
+
+    def to_json(self) -> dict:
+        return {"duration": self.duration, "regions": [[round(s, 3), round(e, 3)] for s, e in self.regions]}
+
+
+class TimeMap:
+    """拼接后音频的时间 -> 原始音频的时间。"""
+
+    def __init__(self, pieces: list[tuple[float, float]]):
+        # [(拼接后音频中的开始时间, 原始音频中的开始时间), ...]
+        self._compact_starts = [c for c, _ in pieces]
+        self._original_starts = [o for _, o in pieces]
+
+    def __call__(self, t: float, is_end: bool = False) -> float:
+        """is_end为True时，恰好落在两段交界处的时间属于前一段(结束时间)。"""
+        if is_end:
+            i = bisect.bisect_left(self._compact_starts, t) - 1
+        else:
+            i = bisect.bisect_right(self._compact_starts, t) - 1
+        i = max(i, 0)
+        return t - self._compact_starts[i] + self._original_starts[i]
+
+
+def collect_speech(audio: np.ndarray, offset: float,
+                   regions: list[tuple[float, float]]) -> tuple[np.ndarray, TimeMap]:
+    """
+    audio为原始音频中从offset秒开始的一段，regions为其中的语音区间(原始时间)。
+    返回只包含语音部分的音频和时间换算表。
+    """
+    chunks, pieces = [], []
+    compact = 0
+    for s, e in regions:
+        lo = max(int(round((s - offset) * SAMPLE_RATE)), 0)
+        hi = min(int(round((e - offset) * SAMPLE_RATE)), len(audio))
+        if hi <= lo:
+            continue
+        chunks.append(audio[lo:hi])
+        pieces.append((compact / SAMPLE_RATE, offset + lo / SAMPLE_RATE))
+        compact += hi - lo
+    if not chunks:
+        return np.zeros(0, dtype=np.float32), TimeMap([(0.0, offset)])
+    return np.concatenate(chunks), TimeMap(pieces)
+
+
+def detect_speech(audio: np.ndarray, vad_config: VadConfig, offset: float = 0.0) -> list[tuple[float, float]]:
+    """检测一段音频中的语音区间，返回原始时间。"""
+    timestamps = get_speech_timestamps(audio, vad_options=vad_config.vad_options())
+    return [(offset + t["start"] / SAMPLE_RATE, offset + t["end"] / SAMPLE_RATE) for t in timestamps]
+
+
+def detect_speech_streaming(audio_path: str, vad_config: VadConfig,
+                            window_seconds: float) -> list[tuple[float, float]]:
+    """按window_seconds长的窗口边解码边检测，内存占用与音频总长度无关。"""
+    regions = []
+    for offset, audio in iter_audio_windows(audio_path, window_seconds, 0):
+        for s, e in detect_speech(audio, vad_config, offset):
+            # 窗口边界处被切开的语音区间重新合并
+            if regions and s - regions[-1][1] < vad_config.min_silence:
+                regions[-1] = (regions[-1][0], max(regions[-1][1], e))
+            else:
+                regions.append((s, e))
+    return regions
+
+
+def speech_map_cache_path(audio_path: str) -> Path:
+    return Path(audio_path).with_suffix(".vad.json")
+
+
+def _cache_key(audio_path: str, vad_config: VadConfig) -> dict:
+    stat = os.stat(audio_path)
+    return {"version": VAD_CACHE_VERSION, "size": stat.st_size, "mtime": stat.st_mtime, "vad": asdict(vad_config)}
+
+
+def load_speech_map(audio_path: str, vad_config: VadConfig = VadConfig(),
+                    audio: Optional[np.ndarray] = None, window_seconds: float = 0) -> SpeechMap:
+    """
+    读取audio_path的语音区间缓存，音频文件或VAD参数变化时重新检测并写入缓存。
+    传入audio(已解码的整个音频)时直接检测，否则按window_seconds分窗从磁盘读取(0为600秒)。
+    """
+    cache_path = speech_map_cache_path(audio_path)
+    key = _cache_key(audio_path, vad_config)
+    if cache_path.exists():
+        try:
+            with cache_path.open("r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached.get("key") == key:
+                VAD_CACHE_TOTAL.inc(result="hit")
+                return SpeechMap(cached["duration"], cached["regions"])
+        except (OSError, ValueError, KeyError) as e:
+            LOGGER.warning(f"Invalid VAD cache {cache_path}: {e}")
+    VAD_CACHE_TOTAL.inc(result="miss")
+
+    with TRACER.span("vad", audio=Path(audio_path).name):
+        if audio is not None:
+            speech_map = SpeechMap(len(audio) / SAMPLE_RATE, detect_speech(audio, vad_config))
+        else:
+            speech_map = SpeechMap(probe_duration(audio_path),
+                                   detect_speech_streaming(audio_path, vad_config, window_seconds or 600))
+    LOGGER.info(f"VAD {Path(audio_path).name}: {speech_map.speech_seconds:.1f}s speech "
+                f"in {speech_map.duration:.1f}s audio, {len(speech_map.regions)} regions")
+
+    try:
+        with cache_path.open("w", encoding="utf-8") as f:
+            json.dump({"key": key, **speech_map.to_json()}, f)
+    except OSError as e:
+        LOGGER.warning(f"Failed to write VAD cache {cache_path}: {e}")
+    return speech_map
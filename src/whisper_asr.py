@@ -1,15 +1,20 @@
 import json
 import warnings
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List, NamedTuple
+from typing import Callable, Iterator, List, NamedTuple, Optional
 
 from deepmultilingualpunctuation import PunctuationModel
 from faster_whisper import WhisperModel
 from faster_whisper.audio import decode_audio
 from faster_whisper.transcribe import Word
 
+from src.audio_stream import iter_audio_windows, probe_duration, read_audio_range
+from src.metrics import AUDIO_CACHE_TOTAL, record_model_load
+from src.punctuation import load_punctuation_model
+from src.tracing import TRACER
 from src.utils import CONSOLE, LOGGER, SAMPLE_RATE
+from src.vad import SpeechMap, VadConfig, collect_speech, load_speech_map
 
 warnings.filterwarnings("ignore")
 
@@ -18,8 +23,12 @@ warnings.filterwarnings("ignore")
 class WhisperAsrConfig:
     # 模型名或模型文件夹路径
     whisper_model: str = "models/whisper-large-v3"
-    # 预训练标点符号模型
+    # 预训练标点符号模型，punctuation_engine为onnx时是导出的ONNX模型文件夹
     punctuation_model: str = "models/oliverguhr-fullstop-punctuation-multilang-large"
+    # 标点模型推理引擎 transformers | onnx。onnx: int8量化的ONNX Runtime CPU推理，用python -m src.punctuation导出
+    punctuation_engine: str = "transformers"
+    # onnx引擎的CPU线程数，0为ONNX Runtime默认值
+    punctuation_threads: int = 0
     # 设备
     device: str = "cuda"
     # 模型精度 float16 | int8_float16 | int8 对应 cuda | cuda| cpu
@@ -34,6 +43,14 @@ class WhisperAsrConfig:
     long_sentence_threshold: int = 20
     # 需要重新标点的长句，对应的单词数/标点符号数的比例阈值
     words_mark_count_rate_threshold: int = 12
+    # 分窗识别的窗口长度(秒)，大于0时不把整个音频读入内存，按窗口边解码边识别，切片识别也只读取对应片段
+    window_seconds: float = 0
+    # 相邻窗口的重叠时长(秒)，重叠部分在中点处切分，避免窗口边界截断单词
+    window_overlap: float = 10
+    # 用VAD检测语音区间(按音频缓存为xx.vad.json)，识别时跳过静音和音乐，切片只识别其中的语音，断句时参考VAD检测到的静音
+    vad: bool = False
+    # VAD参数
+    vad_config: VadConfig = field(default_factory=VadConfig)
 
 
 class SubtitleLine(NamedTuple):
@@ -43,39 +60,81 @@ class SubtitleLine(NamedTuple):
 
 
 class WhisperAsr:
-    def __init__(self, config: WhisperAsrConfig = WhisperAsrConfig()):
+    def __init__(self, config: WhisperAsrConfig = WhisperAsrConfig(),
+                 model: Optional[WhisperModel] = None, punctuation_model: Optional[PunctuationModel] = None):
+        """model和punctuation_model可以传入已加载的模型，多个实例共享模型，各自加载音频。"""
         self.config = config
-        self.model = WhisperModel(config.whisper_model, device=config.device, compute_type=config.compute_type)
-        self.punctuation_model = PunctuationModel(config.punctuation_model)
+        if model is None:
+            with record_model_load(config.whisper_model):
+                model = WhisperModel(config.whisper_model, device=config.device, compute_type=config.compute_type)
+        if punctuation_model is None:
+            with record_model_load(config.punctuation_model):
+                punctuation_model = load_punctuation_model(
+                    config.punctuation_model, config.punctuation_engine, config.punctuation_threads)
+        self.model = model
+        self.punctuation_model = punctuation_model
         self.audio_np = None
         self.audio_path = None
-    
+        self.audio_duration = 0.0
+        # 当前音频的语音区间，未启用VAD时为None
+        self.speech_map: Optional[SpeechMap] = None
+
+    @property
+    def windowed(self) -> bool:
+        return self.config.window_seconds > 0
+
     def load_audio(self, audio_filepath: str):
         if self.audio_path == audio_filepath:
+            AUDIO_CACHE_TOTAL.inc(result="hit")
             return
+        AUDIO_CACHE_TOTAL.inc(result="miss")
 
         self.audio_path = audio_filepath
-        self.audio_np = decode_audio(audio_filepath, SAMPLE_RATE, False)
+        if self.windowed:
+            # 分窗模式只记录路径，识别时再从磁盘读取
+            self.audio_np = None
+            self.audio_duration = probe_duration(audio_filepath)
+        else:
+            with TRACER.span("decode_audio"):
+                self.audio_np = decode_audio(audio_filepath, SAMPLE_RATE, False)
+            self.audio_duration = len(self.audio_np) / SAMPLE_RATE
+        if self.config.vad:
+            self.speech_map = load_speech_map(audio_filepath, self.config.vad_config,
+                                              self.audio_np, self.config.window_seconds)
+
+    def unload_audio(self):
+        """释放已加载的音频。"""
+        self.audio_np = None
+        self.audio_path = None
+        self.audio_duration = 0.0
+        self.speech_map = None
 
-    def transcribe_audio_full(self) -> List[SubtitleLine]:
-        if self.audio_np is None:
+    @property
+    def audio_loaded(self) -> bool:
+        return self.audio_np is not None or (self.windowed and self.audio_path is not None)
+
+    def transcribe_audio_full(self, on_progress: Optional[Callable[[float], None]] = None) -> List[SubtitleLine]:
+        """识别整个音频，on_progress在每个segment解码完成时调用，参数为进度(0~1)。"""
+        if not self.audio_loaded:
             LOGGER.warn("No audio loaded, please call load_audio first.")
             return []
 
-        segments, _ = self.model.transcribe(
-            self.audio_np, word_timestamps=True, 
-            condition_on_previous_text=False, initial_prompt=self.config.prompt)
-
         # transcribe
         subtitle_line_lst = []
-        all_words = []
-        with CONSOLE.status("[green]Transcribing..."):
-            for segment in segments:
-                all_words.extend(list(segment.words))
+        duration = max(self.audio_duration, 1e-6)
+        with CONSOLE.status("[green]Transcribing..."), TRACER.span("whisper_decode", audio_seconds=duration):
+            if self.windowed:
+                all_words = self.transcribe_windows(on_progress)
+            else:
+                all_words = []
+                for segment_end, words in self._transcribe(self.audio_np, initial_prompt=self.config.prompt):
+                    all_words.extend(words)
+                    if on_progress is not None:
+                        on_progress(min(segment_end / duration, 1.0))
 
         # split sentences
         sentence_words = []
-        with CONSOLE.status("[green]Splitting sentences..."):
+        with CONSOLE.status("[green]Splitting sentences..."), TRACER.span("split_sentences", words=len(all_words)):
             for i, word in enumerate(all_words):
                 sentence_words.append(word)
 
@@ -84,7 +143,55 @@ class WhisperAsr:
                     sentence_words.clear()
 
         return subtitle_line_lst
-    
+
+    def transcribe_windows(self, on_progress: Optional[Callable[[float], None]] = None) -> List[Word]:
+        """
+        分窗识别，返回整个音频的单词列表，时间戳为相对音频开头的时间。
+        相邻窗口重叠的部分以中点为界: 前一个窗口保留中点之前开始的单词，
+        后一个窗口跳过与已保留单词重叠的部分，每个单词只保留一次。
+        """
+        duration = max(self.audio_duration, 1e-6)
+        overlap = min(self.config.window_overlap, self.config.window_seconds / 2)
+        all_words = []
+        # 上一个窗口中点之后的单词，下一个窗口会重新识别，最后一个窗口的才保留
+        pending = []
+        for offset, audio in iter_audio_windows(self.audio_path, self.config.window_seconds, overlap):
+            with TRACER.span("whisper_window", offset=offset):
+                last_end = all_words[-1].end if all_words else 0.0
+                cut = offset + len(audio) / SAMPLE_RATE - overlap / 2
+                pending = []
+                for segment_end, words in self._transcribe(audio, offset, initial_prompt=self.config.prompt):
+                    for word in words:
+                        if (word.start + word.end) / 2 < last_end:
+                            continue
+                        if word.start < cut:
+                            all_words.append(word)
+                        else:
+                            pending.append(word)
+                    if on_progress is not None:
+                        on_progress(min(segment_end / duration, 1.0))
+        all_words.extend(pending)
+        return all_words
+
+    def _transcribe(self, audio, offset: float = 0.0, **kwargs) -> Iterator[tuple[float, List[Word]]]:
+        """
+        识别从offset秒开始的一段音频，依次返回每个segment的(结束时间, 单词列表)，时间都是相对音频开头的时间。
+        启用VAD时只把其中的语音部分拼接起来送入模型，没有语音时不调用模型。
+        """
+        if self.speech_map is None:
+            def time_map(t: float, is_end: bool = False) -> float:
+                return t + offset
+        else:
+            regions = self.speech_map.clip(offset, offset + len(audio) / SAMPLE_RATE)
+            audio, time_map = collect_speech(audio, offset, regions)
+            if len(audio) == 0:
+                return
+        segments, _ = self.model.transcribe(audio, word_timestamps=True, condition_on_previous_text=False, **kwargs)
+        for segment in segments:
+            words = [word._replace(start=time_map(word.start), end=time_map(word.end, True))
+                     for word in segment.words]
+            yield time_map(segment.end, True), words
+
     def try_split_sentence(self, sentence_words: List[Word]) -> List[SubtitleLine]:
         # 丢弃语气词
         if len(sentence_words) < 2:
@@ -112,7 +219,7 @@ class WhisperAsr:
                                     and next_word.word.strip().lower() 
                                         in ["and", "so", "but", "or", "then", "because", "where", "we", "you"]
                                     )
-            long_gap_situation = next_word.start - curr_word.end > self.config.gap_threshold
+            long_gap_situation = self.gap_between(curr_word, next_word) > self.config.gap_threshold
             if common_sentence_end or comma_split_situation or long_gap_situation:
                 partial_sentence_list.append(SubtitleLine(partial_start, curr_word.end, get_sentence_text(partial_words)))
                 partial_words.clear()
@@ -121,6 +228,17 @@ class WhisperAsr:
         partial_sentence_list.append(SubtitleLine(partial_start, curr_word.end, get_sentence_text(partial_words)))
         return partial_sentence_list
     
+    def gap_between(self, curr_word: Word, next_word: Word) -> float:
+        """
+        两个相邻单词之间的静音时长。Whisper的单词时间戳经常把停顿算进相邻的单词里，
+        启用VAD时取两个单词中点之间VAD检测到的最长静音和时间戳间隔中较大的一个。
+        """
+        gap = next_word.start - curr_word.end
+        if self.speech_map is not None:
+            gap = max(gap, self.speech_map.longest_silence((curr_word.start + curr_word.end) / 2,
+                                                           (next_word.start + next_word.end) / 2))
+        return gap
+
     def try_punctuation(self, sentence_words: List[Word]) -> List[Word]:
         mark_count = 0
         for word in sentence_words:
@@ -130,7 +248,8 @@ class WhisperAsr:
         # LOGGER.debug(f"[blue]Rate: {len(sentence_words) / mark_count}")
         if mark_count == 0 or len(sentence_words) / mark_count > self.config.words_mark_count_rate_threshold:
             raw_text = get_sentence_text(sentence_words)
-            punctuation_text = self.punctuation_model.restore_punctuation(raw_text)
+            with TRACER.span("punctuation", words=len(sentence_words)):
+                punctuation_text = self.punctuation_model.restore_punctuation(raw_text)
             # LOGGER.info("Compare")
             # LOGGER.info(f"[red]Raw: {raw_text}")
             # LOGGER.info(f"[green]Punctuation: {punctuation_text}")
@@ -158,19 +277,46 @@ class WhisperAsr:
                 CONSOLE.print(sentence_words)
         return sentence_words
 
-    def transcribe_audio_slice(self, start_time: float, end_time: float) -> str:
-        if self.audio_np is None:
+    def transcribe_audio_slice(self, start_time: float, end_time: float,
+                               on_segment: Optional[Callable[[list, float], None]] = None) -> str:
+        """
+        识别音频片段，返回json格式的单词列表[(word, start, end), ...]。
+        on_segment在每个segment解码完成时调用，参数为该segment的单词列表和片段内的进度(0~1)。
+        """
+        if not self.audio_loaded:
             return ""
+        return json.dumps(self.transcribe_audio_slice_words(start_time, end_time, on_segment))
+
+    def transcribe_audio_slice_words(self, start_time: float, end_time: float,
+                                     on_segment: Optional[Callable[[list, float], None]] = None) -> list[tuple]:
+        """同transcribe_audio_slice，直接返回单词列表[(word, start, end), ...]，由调用方决定序列化方式。"""
+        if not self.audio_loaded:
+            return []
 
-        segments, _ = self.model.transcribe(self.audio_np[int(SAMPLE_RATE*start_time):int(SAMPLE_RATE*end_time)], word_timestamps=True, condition_on_previous_text=False)
+        read_start, read_end = start_time, end_time
+        if self.speech_map is not None:
+            # 只读取并识别片段中包含语音的部分
+            regions = self.speech_map.clip(start_time, end_time)
+            if not regions:
+                return []
+            read_start, read_end = regions[0][0], regions[-1][1]
 
-        all_words = []
+        if self.windowed:
+            with TRACER.span("decode_audio", start=read_start, end=read_end):
+                audio = read_audio_range(self.audio_path, read_start, read_end)
+        else:
+            audio = self.audio_np[int(SAMPLE_RATE*read_start):int(SAMPLE_RATE*read_end)]
+        duration = max(end_time - start_time, 1e-6)
+
+        all_words_reduce = []
         # transcribe
-        for segment in segments:
-            all_words.extend(list(segment.words))
-        
-        all_words_reduce = [(word.word, word.start + start_time, word.end + start_time) for word in all_words]
-        return json.dumps(all_words_reduce)
+        for segment_end, words in self._transcribe(audio, read_start):
+            segment_words = [(word.word, word.start, word.end) for word in words]
+            all_words_reduce.extend(segment_words)
+            if on_segment is not None:
+                on_segment(segment_words, min((segment_end - start_time) / duration, 1.0))
+
+        return all_words_reduce
 
 
 def get_sentence_text(words: list) -> str:
@@ -1,6 +1,8 @@
 import os
 import re
 import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
 
@@ -8,7 +10,8 @@ import requests
 import tyro
 from pytube import Playlist, StreamQuery, YouTube
 
-from src.utils import LOGGER, ensure_folder_exists, sbcover_pad
+from src.tracing import TRACER
+from src.utils import LOGGER, batch_process_covers, ensure_folder_exists
 
 
 @dataclass
@@ -25,12 +28,81 @@ class DownloadConfig:
     url: str = 'https://www.youtube.com/watch?v=ulgh_neTJG8&list=PL6SABXRSlpH8CD71L7zye311cp9R4JazJ'
     # 下载播放列表时给文件名加的前缀
     prefix: str = ''
+    # 同时下载的视频数
+    max_workers: int = 4
+    # 下载失败后的重试次数，每次都从已下载的位置继续
+    retries: int = 5
+    # 封面处理后的宽度，为0时不缩放
+    cover_width: int = 0
+    # 封面处理后的高度，为0时不缩放
+    cover_height: int = 0
+    # 封面处理的进程数，0表示CPU核数
+    cover_workers: int = 0
+
+
+def download_with_resume(url: str, path: str, total_size: int = 0, retries: int = 5,
+                         chunk_size: int = 1024 * 1024, on_progress=None) -> str:
+    """
+    下载url到path。未完成的数据写在path.part中，中断后通过HTTP Range请求从断点继续。
+    :param total_size: 文件总大小，已知时用于校验和跳过已完成的下载
+    :param on_progress: on_progress(已下载字节数, 总字节数)
+    :return: path
+    """
+    part_path = path + ".part"
+    for attempt in range(retries + 1):
+        # 本次尝试失败的原因，成功时为None
+        last_error = None
+        downloaded = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if total_size and downloaded >= total_size:
+            break
+        headers = {"Range": f"bytes={downloaded}-"} if downloaded else {}
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=30) as response:
+                if response.status_code == 416:  # 断点已经在文件末尾
+                    break
+                response.raise_for_status()
+                if downloaded and response.status_code != 206:
+                    # 服务器不支持Range，只能从头下载
+                    LOGGER.warning(f"Range not supported, restart download: {path}")
+                    downloaded = 0
+                if not total_size:
+                    length = int(response.headers.get("Content-Length", 0))
+                    total_size = downloaded + length if length else 0
+                with open(part_path, "ab" if downloaded else "wb") as f:
+                    for chunk in response.iter_content(chunk_size):
+                        f.write(chunk)
+                        downloaded += len(chunk)
+                        if on_progress:
+                            on_progress(downloaded, total_size)
+            if not total_size or downloaded >= total_size:
+                break
+            # 连接正常结束但数据不完整
+            last_error = f"connection closed at {downloaded}/{total_size} bytes"
+        except requests.RequestException as e:
+            last_error = e
+        if attempt < retries:
+            LOGGER.warning(f"Download interrupted at {downloaded} bytes ({last_error}), retry {attempt + 1}/{retries}")
+            time.sleep(min(2 ** attempt, 30))
+
+    # 确认下载完整后才改名，不完整时保留.part，下次从断点继续
+    downloaded = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    incomplete = downloaded < total_size if total_size else last_error is not None
+    if incomplete:
+        raise IOError(f"Download incomplete: {downloaded}/{total_size or '?'} bytes, "
+                      f"kept {part_path} for resuming ({last_error})")
+    os.replace(part_path, path)
+    return path
 
 
 class YoutubeDownloader(object):
     
-    def __init__(self, config: DownloadConfig) -> None:
+    def __init__(self, config: DownloadConfig, on_audio_ready=None) -> None:
+        """
+        :param on_audio_ready: on_audio_ready(音频路径: Path)，每个视频的音频流下载完成后调用，
+                               可在视频流下载、合并的同时开始语音识别。
+        """
         self.config = config
+        self.on_audio_ready = on_audio_ready
         ensure_folder_exists(config.dest_dir)
         ensure_folder_exists(config.download_dir)
         ensure_folder_exists(config.cover_dir)
@@ -42,6 +114,15 @@ class YoutubeDownloader(object):
             self.download_video()
         else:
             self.download_video_list()
+        self.process_covers()
+
+
+    # 批量填充、缩放封面
+    def process_covers(self):
+        size = None
+        if self.config.cover_width > 0 and self.config.cover_height > 0:
+            size = (self.config.cover_width, self.config.cover_height)
+        batch_process_covers(self.config.cover_dir, size, self.config.cover_workers)
 
 
     # 下载封面
@@ -58,7 +139,6 @@ class YoutubeDownloader(object):
         # 保存图片到本地文件
         with open(self.config.cover_dir + filename, 'wb') as file:
             file.write(response.content)
-        sbcover_pad(self.config.cover_dir + filename, self.config.cover_dir + "padded_" +filename)
         LOGGER.info(self.config.cover_dir + filename)
 
 
@@ -72,17 +152,32 @@ class YoutubeDownloader(object):
     # 下载视频列表中的所有视频
     def download_video_list(self):
         play_list = Playlist(self.config.url)
-        for i, video in enumerate(play_list.videos):
-            self.playlist_urls.append(f'{i:03d} {video.watch_url}' + "\n")
-            title = video.title
-            prefix=self.config.prefix + f'{i + 1:03d}' + '-'
-            filename = prefix + title
-
-            self.download_thumbnail(video.thumbnail_url, filename)
-
-            video.register_on_progress_callback(self.progress_callback)
-            video.register_on_complete_callback(self.completed_callback)
-            self.download_video_from_streams(video.streams, filename)
+        videos = list(play_list.videos)
+        self.playlist_urls = [f'{i:03d} {video.watch_url}' + "\n" for i, video in enumerate(videos)]
+
+        # 合并用单独的线程，和后面视频的下载同时进行
+        with ThreadPoolExecutor(max_workers=1) as merge_executor, \
+                ThreadPoolExecutor(max_workers=self.config.max_workers) as download_executor:
+            def download_one(i, video):
+                prefix = self.config.prefix + f'{i + 1:03d}' + '-'
+                filename = prefix + video.title
+                self.download_thumbnail(video.thumbnail_url, filename)
+                return self.download_video_from_streams(video.streams, filename, merge_executor)
+
+            download_futures = [download_executor.submit(download_one, i, video) for i, video in enumerate(videos)]
+            merge_futures = []
+            for future in download_futures:
+                try:
+                    merge_future = future.result()
+                    if merge_future is not None:
+                        merge_futures.append(merge_future)
+                except Exception as e:
+                    LOGGER.error(f"Download failed: {e}")
+            for future in merge_futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    LOGGER.error(f"Merge failed: {e}")
         
         with open(self.config.cover_dir + 'urls.txt', 'w') as f:
             f.writelines(self.playlist_urls)
@@ -90,7 +185,8 @@ class YoutubeDownloader(object):
 
 
     # 选择视频质量(1080p)
-    def download_video_from_streams(self, streams: StreamQuery, filename):
+    def download_video_from_streams(self, streams: StreamQuery, filename, merge_executor=None):
+        """下载音视频流并合并。传入merge_executor时，合并提交给它异步执行并返回Future。"""
         video_stream = streams.filter(adaptive=True, mime_type="video/mp4").order_by('resolution').desc().first()
         audio_stream = streams.filter(mime_type="audio/mp4").order_by('abr').desc().first()
         
@@ -103,22 +199,42 @@ class YoutubeDownloader(object):
 
         if os.path.exists(output_path):  # 如果文件已存在，则跳过下载
             LOGGER.info(f'{output_path} already exists!')
+            # 视频已合并过，但字幕可能还没生成(如上次在转写时中断)，音频仍交给下游
+            if os.path.exists(audio_path) and self.on_audio_ready:
+                self.on_audio_ready(Path(audio_path))
             return
 
         LOGGER.debug(video_path)
         LOGGER.debug(audio_path)
         LOGGER.debug(output_path)
 
-        # 下载视频
-        video_stream.download(filename=video_path)
-        # 下载音频
-        audio_stream.download(filename=audio_path)
-        # 合并音视频
-        subprocess.run(
-            f"ffmpeg -i \"{video_path}\" -i \"{audio_path}\" -c:v copy -c:a copy \"{output_path}\""
-        )
+        # 先下载音频，再下载视频，支持断点续传
+        for stream, path in ((audio_stream, audio_path), (video_stream, video_path)):
+            if not os.path.exists(path):
+                with TRACER.span("download", file=filename, stream=stream.mime_type, bytes=stream.filesize):
+                    download_with_resume(stream.url, path, stream.filesize, self.config.retries)
+                self.completed_callback(stream.title, path)
+            if path == audio_path and self.on_audio_ready:
+                self.on_audio_ready(Path(audio_path))
+
+        if merge_executor is None:
+            self.merge(video_path, audio_path, output_path)
+            return
+        return merge_executor.submit(self.merge, video_path, audio_path, output_path)
+
+
+    def merge(self, video_path, audio_path, output_path):
+        """合并音视频，先写临时文件，避免中断后留下不完整的输出被当作已下载。"""
+        tmp_path = output_path + '.part'
+        with TRACER.span("merge", file=Path(output_path).stem):
+            subprocess.run(
+                ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", video_path, "-i", audio_path,
+                 "-c:v", "copy", "-c:a", "copy", "-f", "mp4", tmp_path],
+                check=True)
+        os.replace(tmp_path, output_path)
         # 移除纯视频
         os.remove(video_path)
+        LOGGER.info(f'{output_path} merged!')
 
 
     def progress_callback(self, info, data, remain_bytes):
@@ -0,0 +1,161 @@
+"""download_with_resume的断点续传测试，用本地HTTP服务器模拟各种服务器行为。"""
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src import youtube_downloader
+from src.youtube_downloader import DownloadConfig, YoutubeDownloader, download_with_resume
+
+DATA = bytes(range(256)) * 3 + bytes(232)  # 1000字节
+assert len(DATA) == 1000
+
+
+class FakeServer:
+    """
+    本地HTTP服务器。
+    - support_range: 是否支持Range请求
+    - drop_first: 第一次请求只发送一半数据就断开连接(Content-Length仍为完整长度)。
+                  断开时未读满一个chunk的数据会被丢弃，所以测试中用小chunk_size
+    - truncate_to: 每次请求最多只提供前truncate_to字节，Content-Length与实际发送的一致
+    """
+
+    def __init__(self, support_range=True, drop_first=False, truncate_to=0):
+        self.support_range = support_range
+        self.drop_first = drop_first
+        self.truncate_to = truncate_to
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/file"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def handle(self, handler: BaseHTTPRequestHandler):
+        range_header = handler.headers.get("Range")
+        self.requests.append(range_header)
+        data = DATA[:self.truncate_to] if self.truncate_to else DATA
+        start = 0
+        if range_header and self.support_range:
+            start = int(range_header.split("=")[1].split("-")[0])
+            if start >= len(data):
+                handler.send_response(416)
+                handler.send_header("Content-Length", "0")
+                handler.end_headers()
+                return
+            handler.send_response(206)
+            handler.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+        else:
+            handler.send_response(200)
+        body = data[start:]
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        if self.drop_first and len(self.requests) == 1:
+            handler.wfile.write(body[:len(body) // 2])
+            handler.wfile.flush()
+            handler.close_connection = True
+            return
+        handler.wfile.write(body)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(youtube_downloader.time, "sleep", lambda seconds: None)
+
+
+def test_resume_with_range(tmp_path):
+    path = str(tmp_path / "a.m4a")
+    with FakeServer(support_range=True, drop_first=True) as server:
+        download_with_resume(server.url, path, total_size=len(DATA), retries=2, chunk_size=100)
+    assert open(path, "rb").read() == DATA
+    assert not os.path.exists(path + ".part")
+    # 第二次请求从断点继续
+    assert server.requests == [None, "bytes=500-"]
+
+
+def test_restart_without_range(tmp_path):
+    path = str(tmp_path / "a.m4a")
+    with FakeServer(support_range=False, drop_first=True) as server:
+        download_with_resume(server.url, path, total_size=len(DATA), retries=2, chunk_size=100)
+    assert open(path, "rb").read() == DATA
+    assert server.requests == [None, "bytes=500-"]
+
+
+def test_unknown_size_uses_content_length(tmp_path):
+    path = str(tmp_path / "a.m4a")
+    with FakeServer(support_range=True, drop_first=True) as server:
+        download_with_resume(server.url, path, retries=2, chunk_size=100)
+    assert open(path, "rb").read() == DATA
+
+
+def test_truncated_download_keeps_part(tmp_path):
+    path = str(tmp_path / "a.m4a")
+    with FakeServer(truncate_to=500) as server:
+        with pytest.raises(IOError):
+            download_with_resume(server.url, path, total_size=len(DATA), retries=2)
+    # 不完整的数据不会被当作已下载的文件
+    assert not os.path.exists(path)
+    assert os.path.getsize(path + ".part") == 500
+
+    # 之后从.part继续下载
+    with FakeServer(support_range=True) as server:
+        download_with_resume(server.url, path, total_size=len(DATA), retries=2)
+    assert open(path, "rb").read() == DATA
+    assert server.requests == ["bytes=500-"]
+
+
+def test_part_already_complete(tmp_path):
+    path = str(tmp_path / "a.m4a")
+    with open(path + ".part", "wb") as f:
+        f.write(DATA)
+    with FakeServer() as server:
+        download_with_resume(server.url, path, total_size=len(DATA))
+    assert open(path, "rb").read() == DATA
+    assert server.requests == []
+
+
+class FakeStreams:
+    """StreamQuery的替身，filter/order_by/desc都返回自身，first返回固定的流。"""
+
+    class Stream:
+        resolution = "1080p"
+
+    def filter(self, **kwargs):
+        return self
+
+    def order_by(self, attribute):
+        return self
+
+    def desc(self):
+        return self
+
+    def first(self):
+        return self.Stream()
+
+
+def test_existing_output_still_reports_audio(tmp_path):
+    config = DownloadConfig(dest_dir=f"{tmp_path}/video/", download_dir=f"{tmp_path}/audio/",
+                            cover_dir=f"{tmp_path}/cover/")
+    ready = []
+    downloader = YoutubeDownloader(config, on_audio_ready=ready.append)
+    (tmp_path / "video" / "ep1080p.mp4").write_bytes(b"")
+    (tmp_path / "audio" / "ep1080p.m4a").write_bytes(b"")
+    # 视频已合并过时不重新下载，但音频仍交给下游生成字幕
+    assert downloader.download_video_from_streams(FakeStreams(), "ep") is None
+    assert ready == [tmp_path / "audio" / "ep1080p.m4a"]
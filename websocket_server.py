@@ -1,50 +1,118 @@
 import asyncio
+import base64
 import json
-import re
+import threading
+import time
 import traceback
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
 
+import numpy as np
 import websockets
 from rich.pretty import pprint
 
+from src.alignment import align_translation
+from src.job_queue import CANCELLED, DONE, FAILED, QUEUED, Job, JobQueue, JobWorker
+from src.live_asr import LiveTranscriber, pcm16_to_float
+from src.metrics import METRICS, start_http_server
 from src.sub_genie import SubGenie, SubGenieConfig
-from src.translator import Translator
+from src.translator import Translator, TranslatorConfig
 from src.utils import CONSOLE, SAMPLE_RATE, qwen_call_once, qwen_translate
 from src.whisper_asr import WhisperAsr, WhisperAsrConfig
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 # test_audio_path = "assets/audio/test.m4a"
-whisper_asr_config = WhisperAsrConfig()
-whisper_asr_instance = WhisperAsr(whisper_asr_config)
+# 常驻进程按窗口读取音频: 切片请求只解码对应片段，整文件任务分窗识别，请求结束后不保留音频
+whisper_asr_config = WhisperAsrConfig(window_seconds=300)
+# 在main中加载模型，导入本模块时不加载(benchmarks中会替换为假模型)
+whisper_asr_instance: WhisperAsr = None
+
+# 任务在线程池中执行，不阻塞事件循环
+EXECUTOR = ThreadPoolExecutor(max_workers=8)
+# 每个连接同时执行的任务数，超出的任务排队等待
+MAX_TASKS_PER_CONNECTION = 4
+# WhisperAsr的模型和已加载的音频在任务间共享，ASR任务需要串行执行
+ASR_LOCK = threading.Lock()
+# qwen_translate任务每个窗口的字幕行数，每个窗口翻译完成后推送一次部分结果
+QWEN_WINDOW_LINES = TranslatorConfig.line_num_in_one_call
+# 工作线程等待进度消息发送完成的超时时间
+REPORT_TIMEOUT = 10
+# 客户端在握手时通过Sec-WebSocket-Protocol协商消息格式，不指定时使用json
+JSON_SUBPROTOCOL = "subgenie.json"
+MSGPACK_SUBPROTOCOL = "subgenie.msgpack"
+# 整文件任务队列数据库
+JOB_DB_PATH = "assets/jobs.db"
+# 整文件任务队列，在main中创建
+JOB_QUEUE: JobQueue = None
+# job_id -> 接收该任务进度推送的连接，只在事件循环线程中访问
+JOB_LISTENERS: dict[int, set] = {}
+# 整文件任务相关的消息类型
+JOB_TASK_TYPES = ("job_submit", "job_status", "job_list", "job_cancel")
+# Prometheus指标端口，http://localhost:5001/metrics
+METRICS_PORT = 5001
+
+REQUESTS_TOTAL = METRICS.counter("subgenie_requests_total", "Websocket tasks received", ("type",))
+REQUEST_ERRORS_TOTAL = METRICS.counter("subgenie_request_errors_total", "Websocket tasks that failed", ("type",))
+REQUEST_SECONDS = METRICS.histogram("subgenie_request_seconds", "Websocket task latency, including queueing", ("type",))
+COALESCED_TOTAL = METRICS.counter("subgenie_coalesced_requests_total", "Tasks that joined an identical in-flight request", ("type",))
+TASKS_WAITING = METRICS.gauge("subgenie_tasks_waiting", "Tasks waiting for a per-connection slot", ("type",))
+TASKS_RUNNING = METRICS.gauge("subgenie_tasks_running", "Tasks holding a per-connection slot", ("type",))
+CONNECTIONS = METRICS.gauge("subgenie_connections", "Open websocket connections")
 
-def run_asr(payload):
+
+def run_asr(payload, report):
     try:
         global whisper_asr_instance
 
         if Path(payload["audio_path"]).exists():
-            whisper_asr_instance.load_audio(payload["audio_path"])
             slice_start, slice_end = [float(t.strip()) for t in payload["time_range"].split(",")]
-            ret = whisper_asr_instance.transcribe_audio_slice(slice_start, slice_end)
+            with ASR_LOCK:
+                whisper_asr_instance.load_audio(payload["audio_path"])
+                # 返回单词列表，发送时再按连接协商的格式序列化
+                ret = whisper_asr_instance.transcribe_audio_slice_words(
+                    slice_start, slice_end,
+                    on_segment=lambda words, progress: report(progress * 100, words))
         else:
             print("Audio file not found")
-            ret = "[]"
+            ret = []
         return ret
     except Exception:
         traceback.print_exc()
-        return "[]"
+        return []
+
 
+def run_live_asr(transcriber: LiveTranscriber, chunks: list, finished: bool) -> list:
+    with ASR_LOCK:
+        for chunk in chunks:
+            transcriber.insert_audio(chunk)
+        words = transcriber.process_iter()
+        if finished:
+            words += transcriber.finish()
+    return words
 
-def run_qwen_translate(payload):
+
+def run_qwen_translate(payload, report):
     try:
-        pattern = re.compile(r"\[\d+\.\d+->\d+\.\d+\]")
-        qwen_result = qwen_translate(payload)
-        qwen_lst = re.split(pattern, qwen_result)[1:]
+        lines = [line for line in payload.splitlines() if line.strip()]
+        qwen_lst = []
+        for i in range(0, len(lines), QWEN_WINDOW_LINES):
+            window = lines[i:i+QWEN_WINDOW_LINES]
+            qwen_result = qwen_translate("\n".join(window))
+            # 按时间标签对齐，结果与输入逐行对应，缺失的行为MISSING_TRANSLATION
+            window_lst = align_translation(window, qwen_result).filled()
+            qwen_lst.extend(window_lst)
+            report(min(i + QWEN_WINDOW_LINES, len(lines)) / len(lines) * 100, window_lst)
         return qwen_lst
     except Exception:
         traceback.print_exc()
 
 
-def run_qwen_call_once(payload):
+def run_qwen_call_once(payload, report):
     try:
         qwen_result = qwen_call_once(payload)
         return qwen_result
@@ -52,7 +120,11 @@ def run_qwen_call_once(payload):
         traceback.print_exc()
 
 
-def default_handler(payload):
+def run_metrics(payload, report):
+    return METRICS.snapshot()
+
+
+def default_handler(payload, report):
     print("##########Using Default Task Handler!!!!!!!!!#############")
     print(payload)
     print("##########Using Default Task Handler End!!!!!#############")
@@ -62,54 +134,385 @@ TASK_HANDLER_MAP = {
     "asr": run_asr,
     "qwen_translate": run_qwen_translate,
     "qwen_call_once": run_qwen_call_once,
+    "metrics": run_metrics,
 }
 
 
-async def run_task(ws, task_dict):
-    await ws.send(json.dumps({
+def request_key(task_dict) -> str:
+    """归一化请求内容，内容相同的并发请求共享同一次执行。"""
+    payload = task_dict["payload"]
+    try:
+        if task_dict["type"] == "asr":
+            slice_start, slice_end = [float(t.strip()) for t in payload["time_range"].split(",")]
+            payload = [str(Path(payload["audio_path"]).resolve()), slice_start, slice_end]
+        elif task_dict["type"] == "qwen_translate":
+            payload = "\n".join(line.strip() for line in payload.splitlines() if line.strip())
+    except Exception:
+        # 格式不对的请求交给handler自己处理，按原始内容去重
+        pass
+    return json.dumps([task_dict["type"], payload], sort_keys=True, ensure_ascii=False)
+
+
+class InflightJob:
+    """
+    正在执行的请求。相同请求的所有客户端任务都订阅同一个job，
+    等待同一个future，进度和部分结果广播给所有订阅者，中途加入的订阅者会先补发已有的部分结果。
+    """
+
+    def __init__(self):
+        self.future: asyncio.Future = None
+        # (ws, task_dict)
+        self.subscribers: list[tuple] = []
+        # 已广播的进度消息(progress, partial)，用于补发
+        self.partials: list[tuple] = []
+        # 保证补发和广播的顺序
+        self.lock = asyncio.Lock()
+
+    async def subscribe(self, ws, task_dict):
+        async with self.lock:
+            for progress, partial in self.partials:
+                await send_progress(ws, task_dict, progress, partial)
+            self.subscribers.append((ws, task_dict))
+
+    def unsubscribe(self, ws, task_dict):
+        self.subscribers = [(w, t) for w, t in self.subscribers if t is not task_dict]
+
+    async def broadcast(self, progress: float, partial=None):
+        async with self.lock:
+            self.partials.append((progress, partial))
+            await asyncio.gather(*[send_progress(ws, task_dict, progress, partial)
+                                   for ws, task_dict in self.subscribers], return_exceptions=True)
+
+    def make_reporter(self, loop: asyncio.AbstractEventLoop):
+        """
+        生成在工作线程中调用的进度回调: report(progress, partial=None)。
+        progress为0~100的进度，partial为增量结果，会在最终结果之前按顺序推送给客户端。
+        """
+        def report(progress: float, partial=None):
+            try:
+                # 等待发送完成，保证部分结果的顺序，并在客户端接收慢时形成背压
+                asyncio.run_coroutine_threadsafe(self.broadcast(progress, partial), loop).result(REPORT_TIMEOUT)
+            except Exception:
+                # 连接已断开或超时，丢弃进度消息，不影响任务本身
+                pass
+        return report
+
+
+# 全局的进行中请求，key为request_key，只在事件循环线程中访问
+INFLIGHT: dict[str, InflightJob] = {}
+
+
+def encode_words(words: list, binary: bool):
+    """
+    序列化asr单词列表[(word, start, end), ...]。
+    json: 与旧协议一致，编码为json字符串。
+    msgpack: {"words": [word, ...], "timings": float32小端字节[start0, end0, start1, end1, ...]}。
+    """
+    if not binary:
+        return json.dumps(words)
+    timings = np.array([(start, end) for _, start, end in words], dtype="<f4").reshape(-1)
+    return {"words": [word for word, _, _ in words], "timings": timings.tobytes()}
+
+
+async def send_msg(ws, msg: dict):
+    """按连接协商的格式发送消息。"""
+    binary = ws.subprotocol == MSGPACK_SUBPROTOCOL
+    if msg["type"] in ("asr", "live_asr"):
+        for field in ("data", "partial"):
+            if isinstance(msg.get(field), list):
+                msg[field] = encode_words(msg[field], binary)
+    if binary:
+        await ws.send(msgpack.packb(msg))
+    else:
+        await ws.send(json.dumps(msg))
+
+
+def select_subprotocol(connection, subprotocols) -> str | None:
+    """优先使用msgpack，客户端未声明子协议时返回None，按json处理以兼容旧客户端。"""
+    if msgpack is not None and MSGPACK_SUBPROTOCOL in subprotocols:
+        return MSGPACK_SUBPROTOCOL
+    if JSON_SUBPROTOCOL in subprotocols:
+        return JSON_SUBPROTOCOL
+    return None
+
+
+def decode_msg(msg) -> dict:
+    """解析客户端消息，格式错误时抛出ValueError(msgpack和json的解析错误都是ValueError的子类)。"""
+    if isinstance(msg, bytes):
+        if msgpack is None:
+            raise ValueError("Binary message received but msgpack is not installed on the server")
+        msg_dict = msgpack.unpackb(msg)
+    else:
+        # 防止路径问题, '\\' 如果被当参数传两次，第一次会正确解析，第二次就会出错
+        msg_dict = json.loads(msg.replace("\\\\", "/"))
+    if not isinstance(msg_dict, dict) or "type" not in msg_dict:
+        raise ValueError(f"Message must be an object with a type field, got {type(msg_dict).__name__}")
+    return msg_dict
+
+
+async def send_progress(ws, task_dict, progress: float, partial=None):
+    msg = {
         "type": task_dict["type"],
         "task_id": task_dict["task_id"],
-        "task_progress": 0
-    }))
-
-    CONSOLE.print(f"[green]Task: {task_dict['type']} {task_dict['task_id']} start!")
-    ret = TASK_HANDLER_MAP.get(task_dict["type"], default_handler)(task_dict["payload"])
-    CONSOLE.print(f"[green]Task: {task_dict['type']} {task_dict['task_id']} done!")
-    
-    await ws.send(json.dumps({
+        # 0和100留给任务开始和结束的消息
+        "task_progress": min(max(int(progress), 1), 99),
+    }
+    if partial is not None:
+        msg["partial"] = partial
+    await send_msg(ws, msg)
+
+
+@asynccontextmanager
+async def acquire_slot(semaphore: asyncio.Semaphore, task_type: str):
+    """占用连接的一个并发名额，并统计排队和执行中的任务数。"""
+    TASKS_WAITING.inc(type=task_type)
+    try:
+        await semaphore.acquire()
+    finally:
+        TASKS_WAITING.dec(type=task_type)
+    TASKS_RUNNING.inc(type=task_type)
+    try:
+        yield
+    finally:
+        TASKS_RUNNING.dec(type=task_type)
+        semaphore.release()
+
+
+async def run_task(ws, task_dict, semaphore: asyncio.Semaphore):
+    async with acquire_slot(semaphore, task_dict["type"]):
+        await send_msg(ws, {
+            "type": task_dict["type"],
+            "task_id": task_dict["task_id"],
+            "task_progress": 0
+        })
+
+        CONSOLE.print(f"[green]Task: {task_dict['type']} {task_dict['task_id']} start!")
+        key = request_key(task_dict)
+        job = INFLIGHT.get(key)
+        if job is None:
+            job = INFLIGHT[key] = InflightJob()
+            handler = TASK_HANDLER_MAP.get(task_dict["type"], default_handler)
+            loop = asyncio.get_running_loop()
+            job.future = loop.run_in_executor(EXECUTOR, handler, task_dict["payload"], job.make_reporter(loop))
+            job.future.add_done_callback(lambda _: INFLIGHT.pop(key, None))
+        else:
+            COALESCED_TOTAL.inc(type=task_dict["type"])
+            CONSOLE.print(f"[green]Task: {task_dict['type']} {task_dict['task_id']} joined an identical in-flight request")
+
+        await job.subscribe(ws, task_dict)
+        try:
+            # 某个订阅者取消时不能取消共享的future
+            ret = await asyncio.shield(job.future)
+        finally:
+            job.unsubscribe(ws, task_dict)
+        CONSOLE.print(f"[green]Task: {task_dict['type']} {task_dict['task_id']} done!")
+        
+        await send_msg(ws, {
+            "type": task_dict["type"],
+            "task_id": task_dict["task_id"],
+            "task_progress": 100,
+            "data": ret 
+        })
+
+
+async def run_live_task(ws, task_dict, audio_queue: asyncio.Queue, semaphore: asyncio.Semaphore):
+    """
+    实时识别任务。客户端发送live_asr开始，之后用live_asr_audio发送16kHz 16位小端单声道PCM
+    (msgpack为bytes，json为base64字符串)，live_asr_end结束。
+    每次有新确认的单词时推送partial，结束时data为完整的单词列表。
+    """
+    async with acquire_slot(semaphore, task_dict["type"]):
+        await send_msg(ws, {
+            "type": task_dict["type"],
+            "task_id": task_dict["task_id"],
+            "task_progress": 0
+        })
+
+        CONSOLE.print(f"[green]Task: {task_dict['type']} {task_dict['task_id']} start!")
+        transcriber = LiveTranscriber(whisper_asr_instance.model, whisper_asr_config)
+        loop = asyncio.get_running_loop()
+        finished = False
+        while not finished:
+            # 识别期间收到的音频合并到下一次识别
+            chunks = [await audio_queue.get()]
+            while not audio_queue.empty():
+                chunks.append(audio_queue.get_nowait())
+            finished = chunks[-1] is None
+            chunks = [chunk for chunk in chunks if chunk is not None]
+            words = await loop.run_in_executor(EXECUTOR, run_live_asr, transcriber, chunks, finished)
+            if words:
+                # 实时任务没有总时长，进度固定为50
+                await send_progress(ws, task_dict, 50, words)
+        CONSOLE.print(f"[green]Task: {task_dict['type']} {task_dict['task_id']} done!")
+
+        await send_msg(ws, {
+            "type": task_dict["type"],
+            "task_id": task_dict["task_id"],
+            "task_progress": 100,
+            "data": transcriber.committed
+        })
+
+
+def run_job_message(task_dict):
+    """
+    job_submit: {"kind": "transcribe | translate | generate", "path": 文件路径, "priority": 0} -> job
+    job_status: {"job_id": id} -> job
+    job_list: {"status": "" | queued | running | done | failed | cancelled} -> [job, ...]
+    job_cancel: {"job_id": id} -> 是否取消成功，只能取消排队中的任务
+    """
+    payload = task_dict["payload"]
+    if task_dict["type"] == "job_submit":
+        return JOB_QUEUE.submit(payload["kind"], {"path": payload["path"]}, int(payload.get("priority", 0))).to_dict()
+    if task_dict["type"] == "job_status":
+        job = JOB_QUEUE.get(int(payload["job_id"]))
+        return job.to_dict() if job else None
+    if task_dict["type"] == "job_list":
+        return [job.to_dict() for job in JOB_QUEUE.list_jobs(payload.get("status", ""))]
+    if task_dict["type"] == "job_cancel":
+        return JOB_QUEUE.cancel(int(payload["job_id"]))
+
+
+async def run_job_task(ws, task_dict):
+    loop = asyncio.get_running_loop()
+    data = await loop.run_in_executor(EXECUTOR, run_job_message, task_dict)
+    # 提交或查询过的任务，之后的进度推送给该连接
+    if task_dict["type"] in ("job_submit", "job_status") and data and data["status"] not in (DONE, FAILED, CANCELLED):
+        JOB_LISTENERS.setdefault(data["id"], set()).add(ws)
+    await send_msg(ws, {
         "type": task_dict["type"],
         "task_id": task_dict["task_id"],
         "task_progress": 100,
-        "data": ret 
-    }))
+        "data": data
+    })
+
+
+async def broadcast_job_event(job: Job):
+    msg = {
+        "type": "job_progress",
+        "job_id": job.id,
+        "status": job.status,
+        "task_progress": int(job.progress),
+        "data": job.to_dict(),
+    }
+    listeners = JOB_LISTENERS.get(job.id, set())
+    if job.status in (DONE, FAILED, CANCELLED):
+        JOB_LISTENERS.pop(job.id, None)
+    await asyncio.gather(*[send_msg(ws, dict(msg)) for ws in listeners], return_exceptions=True)
+
+
+def decode_pcm(payload) -> np.ndarray:
+    if isinstance(payload, str):
+        payload = base64.b64decode(payload)
+    return pcm16_to_float(payload)
+
+
+async def guarded_run_task(ws, task_dict, coro):
+    REQUESTS_TOTAL.inc(type=task_dict["type"])
+    start = time.perf_counter()
+    try:
+        await coro
+        REQUEST_SECONDS.observe(time.perf_counter() - start, type=task_dict["type"])
+    except asyncio.CancelledError:
+        # 已经在线程池中运行的任务无法中断，只是丢弃结果
+        CONSOLE.print(f"[yellow]Task: {task_dict['type']} {task_dict['task_id']} cancelled!")
+    except websockets.ConnectionClosed:
+        pass
+    except Exception as e:
+        REQUEST_ERRORS_TOTAL.inc(type=task_dict["type"])
+        traceback.print_exc()
+        await send_msg(ws, {
+            "type": "error",
+            "task_id": task_dict["task_id"],
+            "data": str(e),
+        })
 
 
 async def server(ws):
-    async for msg in ws:
-        CONSOLE.rule("Msg from client", style="bold blue")
-        # 防止路径问题, '\\' 如果被当参数传两次，第一次会正确解析，第二次就会出错
-        msg_dict = json.loads(msg.replace("\\\\", "/"))
-        CONSOLE.print("Msg from client")
-        pprint(msg_dict)
-        CONSOLE.rule(style="bold blue")
+    tasks: dict[str, asyncio.Task] = {}
+    # 实时识别任务的音频队列，None表示音频流结束
+    live_queues: dict[str, asyncio.Queue] = {}
+    semaphore = asyncio.Semaphore(MAX_TASKS_PER_CONNECTION)
+    CONNECTIONS.inc()
+    try:
+        async for msg in ws:
+            try:
+                msg_dict = decode_msg(msg)
+            except ValueError as e:
+                # 单条消息格式错误时回复错误，不断开连接
+                error = f"Invalid message: {type(e).__name__}: {e}"
+                CONSOLE.print(f"[red]{error}")
+                await send_msg(ws, {"type": "error", "task_id": None, "data": error})
+                continue
+            # 音频数据量大且频繁，不打印
+            if msg_dict["type"] == "live_asr_audio":
+                if msg_dict["task_id"] in live_queues:
+                    live_queues[msg_dict["task_id"]].put_nowait(decode_pcm(msg_dict["payload"]))
+                continue
 
-        try:
-            if msg_dict["type"] in TASK_HANDLER_MAP.keys():
+            CONSOLE.rule("Msg from client", style="bold blue")
+            CONSOLE.print("Msg from client")
+            pprint(msg_dict)
+            CONSOLE.rule(style="bold blue")
+
+            if msg_dict["type"] == "cancel":
+                task = tasks.get(msg_dict["task_id"])
+                if task is not None:
+                    task.cancel()
+                await send_msg(ws, {
+                    "type": "cancel",
+                    "task_id": msg_dict["task_id"],
+                    "data": task is not None,
+                })
+            elif msg_dict["type"] == "live_asr":
+                CONSOLE.print(f"[green]Create Task: {msg_dict['type']} {msg_dict['task_id']}")
+                audio_queue = live_queues[msg_dict["task_id"]] = asyncio.Queue()
+                task = asyncio.create_task(guarded_run_task(
+                    ws, msg_dict, run_live_task(ws, msg_dict, audio_queue, semaphore)))
+                tasks[msg_dict["task_id"]] = task
+                task.add_done_callback(lambda _, task_id=msg_dict["task_id"]: (
+                    tasks.pop(task_id, None), live_queues.pop(task_id, None)))
+            elif msg_dict["type"] == "live_asr_end":
+                if msg_dict["task_id"] in live_queues:
+                    live_queues[msg_dict["task_id"]].put_nowait(None)
+            elif msg_dict["type"] in JOB_TASK_TYPES:
+                task = asyncio.create_task(guarded_run_task(ws, msg_dict, run_job_task(ws, msg_dict)))
+                tasks[msg_dict["task_id"]] = task
+                task.add_done_callback(lambda _, task_id=msg_dict["task_id"]: tasks.pop(task_id, None))
+            elif msg_dict["type"] in TASK_HANDLER_MAP.keys():
                 CONSOLE.print(f"[green]Create Task: {msg_dict['type']} {msg_dict['task_id']}")
-                await run_task(ws, msg_dict)
+                task = asyncio.create_task(guarded_run_task(ws, msg_dict, run_task(ws, msg_dict, semaphore)))
+                tasks[msg_dict["task_id"]] = task
+                task.add_done_callback(lambda _, task_id=msg_dict["task_id"]: tasks.pop(task_id, None))
             else:
                 print("Invalid task data %s" % msg_dict)
-        except Exception as e:
-            traceback.print_exc()
-            await ws.send(json.dumps({
-                "type": "error",
-                "task_id": msg_dict["task_id"],
-                "data": str(e),
-            }))
+    finally:
+        CONNECTIONS.dec()
+        # 连接断开，取消该连接所有未完成的任务，整文件任务继续执行
+        for task in tasks.values():
+            task.cancel()
+        for listeners in JOB_LISTENERS.values():
+            listeners.discard(ws)
 
 
 async def main():
-    async with websockets.serve(server, "localhost", 5000, max_size = 5*1024*1024):
+    global JOB_QUEUE, whisper_asr_instance
+    loop = asyncio.get_running_loop()
+    whisper_asr_instance = WhisperAsr(whisper_asr_config)
+    JOB_QUEUE = JobQueue(JOB_DB_PATH)
+    # 整文件任务共享已加载的模型，但使用独立的WhisperAsr加载音频，不影响切片识别
+    job_asr = WhisperAsr(whisper_asr_config, whisper_asr_instance.model, whisper_asr_instance.punctuation_model)
+    worker = JobWorker(JOB_QUEUE, SubGenie(SubGenieConfig(whisper_asr=whisper_asr_config), job_asr),
+                       on_event=lambda job: asyncio.run_coroutine_threadsafe(broadcast_job_event(job), loop))
+    worker.start()
+
+    METRICS.gauge("subgenie_inflight_requests", "Distinct requests being executed").set_function(lambda: len(INFLIGHT))
+    METRICS.gauge("subgenie_job_queue_depth", "Whole-file jobs waiting in the queue").set_function(
+        lambda: JOB_QUEUE.count(QUEUED))
+    start_http_server(METRICS_PORT)
+
+    # permessage-deflate压缩对json和msgpack都生效
+    async with websockets.serve(server, "localhost", 5000, max_size = 5*1024*1024,
+                                select_subprotocol=select_subprotocol, compression="deflate"):
         await asyncio.Future()  # run forever
 
 